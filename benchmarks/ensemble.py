@@ -0,0 +1,291 @@
+import argparse
+import itertools
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import yaml
+
+"""Ensembler overhead benchmarks
+
+Generates synthetic ensembles and runs them through ``BatchExecutor`` to
+measure the overhead of the ensembler itself, rather than of the jobs, which
+are trivial. Each scenario runs in a fresh process, so that peak RSS and the
+process wide ``Arguments`` are its own.
+
+Run from the repository root, for example::
+
+    python -m benchmarks.ensemble --runs 100 1000 --backends dummy simulator
+
+The ``simulator`` backend drives the SLURM backend against the stand-in
+commands from ``model_ensembler.simulator``, with jobs queueing and running
+instantly.
+"""
+
+JOB_TEMPLATE = """#!/bin/bash
+#SBATCH --job-name={{ run.id }}
+#SBATCH --ntasks={{ run.ntasks }}
+echo "{{ run.id }} {{ run.value }}" >job.out
+"""
+
+EXTRA_TEMPLATE = """{{ run.id }}
+{% for i in range(run.value % 10) %}{{ i }} {% endfor %}
+"""
+
+
+def write_ensemble(directory, runs, templates, tasks, maxruns, maxjobs):
+    """Write a synthetic ensemble configuration and its templates.
+
+    Args:
+        directory (str): Directory to write to.
+        runs (int): Number of runs.
+        templates (int): Number of templates, including the job script.
+        tasks (int): Number of commands in each of pre_run and post_run.
+        maxruns (int): Batch ``maxruns``.
+        maxjobs (int): Batch ``maxjobs``.
+
+    Returns:
+        (str): Configuration file.
+    """
+    templatedir = os.path.join(directory, "template")
+    os.makedirs(templatedir)
+
+    job_template = os.path.join(templatedir, "job.sh.j2")
+    with open(job_template, "w") as fh:
+        fh.write(JOB_TEMPLATE)
+    os.chmod(job_template, 0o755)
+
+    template_names = ["job.sh.j2"]
+    for i in range(1, templates):
+        template_names.append("extra{}.dat.j2".format(i))
+        with open(os.path.join(templatedir, template_names[-1]), "w") as fh:
+            fh.write(EXTRA_TEMPLATE)
+
+    def task_list(name):
+        return [{"name": "execute",
+                 "args": {"cmd": "touch {}.{}".format(name, i)}}
+                for i in range(tasks)]
+
+    config = {"ensemble": {
+        "vars": {},
+        "pre_process": [],
+        "post_process": [],
+        "batches": [{
+            "name": "bench",
+            "templatedir": templatedir,
+            "templates": template_names,
+            "job_file": "job.sh",
+            "cluster": "bench",
+            "basedir": os.path.join(directory, "runs"),
+            "ntasks": 1,
+            "maxruns": maxruns,
+            "maxjobs": maxjobs,
+            "pre_run": task_list("pre_run"),
+            "runs": [{"value": i} for i in range(runs)],
+            "post_run": task_list("post_run"),
+        }],
+    }}
+
+    path = os.path.join(directory, "bench.yaml")
+    with open(path, "w") as fh:
+        yaml.safe_dump(config, fh)
+    return path
+
+
+def run_scenario(backend, runs, templates, tasks, maxruns, maxjobs):
+    """Run a synthetic ensemble in this process and measure it.
+
+    Args:
+        backend (str): Cluster backend, ``dummy`` or ``simulator``.
+        runs (int): See ``write_ensemble``.
+        templates (int): See ``write_ensemble``.
+        tasks (int): See ``write_ensemble``.
+        maxruns (int): See ``write_ensemble``.
+        maxjobs (int): See ``write_ensemble``.
+
+    Returns:
+        (dict): Measurements of the scenario.
+    """
+    with tempfile.TemporaryDirectory(prefix="model_ensembler.bench.") \
+            as directory:
+        # Jobs queue and run instantly, so only the ensembler is measured
+        os.environ.update(ME_SIM_DIR=os.path.join(directory, "sim"),
+                          ME_SIM_QUEUE="0,0",
+                          ME_SIM_RUNTIME="0,0")
+        os.makedirs(os.environ["ME_SIM_DIR"])
+        configuration = write_ensemble(directory, runs, templates, tasks,
+                                       maxruns, maxjobs)
+
+        from model_ensembler.batcher import BatchExecutor, run_executors
+        from model_ensembler.cli import parse_args
+        from model_ensembler.config import EnsembleConfig
+        from model_ensembler.metrics import metrics
+
+        parse_args([configuration, backend,
+                    "-sr", "0", "-ct", "1", "-st", "1", "-rt", "1"])
+
+        start = time.monotonic()
+        executor = BatchExecutor(EnsembleConfig(configuration), backend, {})
+        configured = time.monotonic()
+
+        # Recorded by wrapping the backend the executor submits through
+        cluster = executor._cluster
+        submit_job = cluster.submit_job
+        first_submission = []
+
+        async def submit(*args, **kwargs):
+            if not first_submission:
+                first_submission.append(time.monotonic())
+            return await submit_job(*args, **kwargs)
+
+        cluster.submit_job = submit
+        run_executors([executor])
+        end = time.monotonic()
+
+        counters = metrics.summary()["counters"]
+        batch = metrics.summary("bench")["counters"]
+
+        result = dict(
+            backend=backend,
+            runs=runs,
+            templates=templates,
+            tasks=tasks,
+            completed=int(batch.get("jobs", dict()).get("state=COMPLETED",
+                                                        0)),
+            seconds=end - start,
+            config_seconds=configured - start,
+            runs_per_second=runs / (end - start),
+            first_submission=first_submission[0] - start
+            if first_submission else None,
+            # Kilobytes on Linux
+            peak_rss_mb=resource.getrusage(
+                resource.RUSAGE_SELF).ru_maxrss / 1024,
+            spawns=int(sum(counters.get("commands", dict()).values())),
+            scheduler_calls=int(sum(counters.get("scheduler_calls",
+                                                 dict()).values())),
+        )
+        result["spawns_per_run"] = result["spawns"] / runs if runs else 0.
+        check_spawns(result)
+        return result
+
+
+def check_spawns(result):
+    """Check the spawned commands of a scenario account for every run.
+
+    Each completed run spawns at least its template copy, its job, or the
+    ``sbatch`` submitting it, and its ``pre_run`` and ``post_run`` commands,
+    so fewer spawns means some are not being counted.
+
+    Args:
+        result (dict): Measurements of the scenario, see ``run_scenario``.
+
+    Raises:
+        RuntimeError: If fewer commands were counted than were spawned.
+    """
+    expected = result["completed"] * (2 + 2 * result["tasks"])
+
+    if result["spawns"] < expected:
+        raise RuntimeError("Counted {} spawned commands for {} completed "
+                           "runs, but at least {} were spawned".
+                           format(result["spawns"], result["completed"],
+                                  expected))
+
+
+def run_child(backend, runs, templates, tasks, maxruns, maxjobs):
+    """Run a scenario in a fresh process.
+
+    Args:
+        backend (str): See ``run_scenario``.
+        runs (int): See ``write_ensemble``.
+        templates (int): See ``write_ensemble``.
+        tasks (int): See ``write_ensemble``.
+        maxruns (int): See ``write_ensemble``.
+        maxjobs (int): See ``write_ensemble``.
+
+    Returns:
+        (dict): Measurements of the scenario.
+
+    Raises:
+        subprocess.CalledProcessError: If the scenario fails.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    # The stand-in SLURM commands import the ensembler too, so a checkout
+    # need not be installed
+    env = dict(os.environ,
+               PYTHONPATH=os.pathsep.join(
+                   [root] + ([os.environ["PYTHONPATH"]]
+                             if os.environ.get("PYTHONPATH") else [])))
+    res = subprocess.run([sys.executable, "-m", "benchmarks.ensemble",
+                          "--scenario",
+                          "--backends", backend,
+                          "--runs", str(runs),
+                          "--templates", str(templates),
+                          "--tasks", str(tasks),
+                          "--maxruns", str(maxruns),
+                          "--maxjobs", str(maxjobs)],
+                         cwd=root, env=env, stdout=subprocess.PIPE,
+                         check=True)
+    return json.loads(res.stdout.decode().splitlines()[-1])
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Measure ensembler overhead on synthetic ensembles")
+    parser.add_argument("-r", "--runs", nargs="+", type=int,
+                        default=[100, 1000, 10000])
+    parser.add_argument("-t", "--templates", nargs="+", type=int,
+                        default=[1, 5],
+                        help="Templates per run, including the job script")
+    parser.add_argument("-k", "--tasks", nargs="+", type=int,
+                        default=[0, 3],
+                        help="Commands in each of pre_run and post_run")
+    parser.add_argument("-b", "--backends", nargs="+",
+                        choices=("dummy", "simulator"),
+                        default=["dummy", "simulator"])
+    parser.add_argument("-mr", "--maxruns", type=int, default=100)
+    parser.add_argument("-mj", "--maxjobs", type=int, default=100)
+    parser.add_argument("-o", "--output", default=None,
+                        help="File to write the results to as JSON")
+    parser.add_argument("--scenario", action="store_true",
+                        help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    if args.scenario:
+        logging.basicConfig(level=logging.WARNING)
+        print(json.dumps(run_scenario(args.backends[0], args.runs[0],
+                                      args.templates[0], args.tasks[0],
+                                      args.maxruns, args.maxjobs)))
+        return
+
+    columns = ("backend", "runs", "templates", "tasks", "completed",
+               "seconds", "runs_per_second", "first_submission",
+               "peak_rss_mb", "spawns", "spawns_per_run", "scheduler_calls")
+    print(" ".join("{:>16}".format(c) for c in columns))
+
+    results = []
+    for backend, runs, templates, tasks in itertools.product(
+            args.backends, args.runs, args.templates, args.tasks):
+        result = run_child(backend, runs, templates, tasks,
+                           args.maxruns, args.maxjobs)
+        results.append(result)
+        print(" ".join("{:>16.3f}".format(result[c])
+                       if isinstance(result[c], float)
+                       else "{:>16}".format(str(result[c]))
+                       for c in columns), flush=True)
+
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
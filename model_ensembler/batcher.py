@@ -1,27 +1,40 @@
 import asyncio
 import collections
+import contextlib
 import contextvars
 import importlib
 import logging
 import os
+import time
 
 from datetime import datetime
 from pprint import pformat
 
 import model_ensembler
 
+from model_ensembler.callback import CallbackServer
+from model_ensembler.cluster import ArraySubmitter
 from model_ensembler.exceptions import TemplatingError
+from model_ensembler.journal import PHASES, close_journals, get_journal
+from model_ensembler.metrics import metrics
+from model_ensembler.profiling import Profiler
+from model_ensembler.shell import shell_pool
 from model_ensembler.tasks.exceptions import ProcessingException
-from model_ensembler.tasks.hpc import init_hpc_backend
-from model_ensembler.utils import Arguments
+from model_ensembler.utils import \
+    Arguments, RunContext, cluster_ctx, command_path_ctx, cwd_ctx
 
 from model_ensembler.templates import \
-    prepare_run_directory, process_templates
-from model_ensembler.runners import run_check, run_runner, run_task_items
+    prepare_run_directory, render_templates, run_io, \
+    snapshot_template_directory
+from model_ensembler.runners import iter_runner, run_check, run_task_items
 
 batch_ctx = contextvars.ContextVar("batch")
 run_ctx = contextvars.ContextVar("run")
-cluster_ctx = contextvars.ContextVar("cluster")
+callback_ctx = contextvars.ContextVar("callback", default=None)
+jobs_ctx = contextvars.ContextVar("jobs", default=None)
+batch_jobs_ctx = contextvars.ContextVar("batch_jobs")
+batch_array_ctx = contextvars.ContextVar("batch_array", default=None)
+journal_ctx = contextvars.ContextVar("journal", default=None)
 extra_ctx = contextvars.ContextVar("extra")
 
 
@@ -29,14 +42,98 @@ extra_ctx = contextvars.ContextVar("extra")
 
 """
 
-_batch_job_sems = dict()
 
+@contextlib.asynccontextmanager
+async def job_slot():
+    """Hold a slot of the ensemble wide ``maxjobs`` limit, if there is one.
 
-async def run_batch_item(run):
+    The limit is shared by every batch running concurrently, whereas each
+    batch's own ``maxjobs`` is held in ``batch_jobs_ctx``.
+    """
+    jobs = jobs_ctx.get()
+
+    if jobs is None:
+        yield
+    else:
+        async with jobs:
+            yield
+
+
+def record(run, phase, **kwargs):
+    """Record a run reaching a phase in the batch's journal, if enabled.
+
+    Args:
+        run (object): Specific run configuration.
+        phase (str): Phase reached, see ``journal.PHASES``.
+        **kwargs: Job ID and state, see ``RunJournal.record``.
+    """
+    journal = journal_ctx.get()
+
+    if journal:
+        journal.record(run, phase, **kwargs)
+
+
+async def monitor_job(cluster, run, job_id):
+    """Wait for a submitted job to finish.
+
+    Args:
+        cluster (object): Cluster backend module.
+        run (object): Specific run configuration.
+        job_id (int|str): Job identifier, or None if submission failed.
+
+    Returns:
+        job (object): Final Job information, or None if not submitted.
+    """
+    if not job_id:
+        logging.exception("{} could not be submitted, we won't continue".
+                          format(run.id))
+        return None
+
+    # Job script callbacks, if enabled, are pushed into the same poller so
+    # we wake as soon as either reports a state change
+    callbacks = callback_ctx.get()
+    if callbacks:
+        callbacks.watch(run, job_id, cluster.poller)
+
+    # The backend poller shares a single scheduler query across every run
+    # waiting on a job
+    submitted = time.monotonic()
+    try:
+        job = await cluster.poller.wait_for(
+            job_id, cluster.START_STATES + cluster.FINISH_STATES)
+        logging.debug("{} monitor got state {} for job {}".
+                      format(run.id, job.state, job_id))
+
+        if job.state not in cluster.FINISH_STATES:
+            started = time.monotonic()
+            metrics.observe("phase", started - submitted,
+                            batch=run.name, phase="queue")
+            record(run, "submitted", job_state=job.state)
+            job = await cluster.poller.wait_for(job_id,
+                                                cluster.FINISH_STATES)
+            metrics.observe("phase", time.monotonic() - started,
+                            batch=run.name, phase="runtime")
+    finally:
+        if callbacks:
+            callbacks.unwatch(run)
+
+    logging.info("{} monitor got state {} for job {}".
+                 format(run.id, job.state, job_id))
+    metrics.inc("jobs", batch=run.name, state=job.state)
+    record(run, "finished", job_state=job.state)
+    return job
+
+
+async def run_batch_item(run, resume=None):
     """Execute a run configuration.
 
+    If the run has been journaled by an earlier invocation, it resumes from
+    the last phase it completed: templated runs are not templated again and
+    submitted runs are re-attached to their job rather than resubmitted.
+
     Args:
         run (object): Specific run configuration.
+        resume (object, optional): JournalEntry for the run.
 
     Returns:
         job_id (int): Job id number.
@@ -58,13 +155,34 @@ async def run_batch_item(run):
 
     args = Arguments()
     job_id = None
+    start = time.monotonic()
+    metrics.inc("runs", batch=batch.name)
+    # Number of phases completed by an earlier invocation
+    done = PHASES.index(resume.phase) + 1 if resume else 0
+
+    if done:
+        logging.info("Resuming run {} after {}".format(run.id, resume.phase))
 
     try:
-        await prepare_run_directory(batch, run)
-        process_templates(run, batch.templates)
+        if done < PHASES.index("templated") + 1:
+            record(run, "started")
+
+            with metrics.timer("phase", batch=batch.name, phase="template"):
+                # A run interrupted whilst being prepared reuses its directory
+                pickup = True if done else None
+                await prepare_run_directory(batch, run, pickup=pickup)
+                await render_templates(run, batch.templates,
+                                       batch.templatedir)
+
+                callbacks = callback_ctx.get()
+                if callbacks and batch.job_file and not args.no_submission:
+                    await run_io(callbacks.inject, run,
+                                 os.path.join(run.dir, batch.job_file))
+            record(run, "templated")
     except TemplatingError as e:
         # We catch gracefully and just prevent the run from happening
         logging.error("We cannot template the job {}: {}".format(run.id, e))
+        metrics.inc("runs_failed", batch=batch.name)
         return job_id, run
 
     # It's very tempting to move pre_run, but don't: we DO NOT execute until
@@ -72,84 +190,103 @@ async def run_batch_item(run):
     # to preparation/templating of the job for scenarios where you don't want
     # the templating to error out/job to even be prepared
     try:
-        await run_task_items(batch.pre_run)
-
-        if args.no_submission:
+        if done < PHASES.index("pre_run") + 1:
+            with metrics.timer("phase", batch=batch.name, phase="pre_run"):
+                await run_task_items(batch.pre_run, batch.maxtasks)
+            record(run, "pre_run")
+
+        if done >= PHASES.index("submitted") + 1 and resume.job_id:
+            # The job outlived the previous invocation, so we wait on it
+            # again, holding the same limits as a submission would
+            job_id = resume.job_id
+            logging.info("Re-attaching run {} to job {}".
+                         format(run.id, job_id))
+
+            async with batch_jobs_ctx.get(), job_slot():
+                counts = getattr(cluster, "job_counts", None)
+
+                try:
+                    await monitor_job(cluster, run, job_id)
+                finally:
+                    if counts:
+                        counts.finished(run, batch.name, job_id)
+        elif args.no_submission:
             logging.info("Skipping actual slurm submission based on arguments")
+        elif batch_array_ctx.get():
+            array = batch_array_ctx.get()
+
+            # Rather than runs holding the batch job semaphore, which would
+            # limit arrays to maxjobs runs, the submitter throttles arrays
+            # so that maxjobs applies across all of them
+            async with job_slot():
+                job_id = await array.submit(run)
+                if job_id:
+                    metrics.inc("jobs_submitted", batch=batch.name)
+                    record(run, "submitted", job_id=job_id)
+
+                try:
+                    await monitor_job(cluster, run, job_id)
+                finally:
+                    if job_id:
+                        array.finished(job_id)
         else:
-            async with _batch_job_sems[batch.name]:
+            waiting = time.monotonic()
+
+            async with batch_jobs_ctx.get(), job_slot():
                 func = getattr(model_ensembler.tasks, "jobs")
                 check = collections.namedtuple("check", ["args"])
+                counts = getattr(cluster, "job_counts", None)
 
                 await run_check(func, check({
                     "limit": batch.maxjobs,
                     "match": batch.name,
+                    "reserve": counts is not None,
                 }))
-
-                job_id = await cluster.submit_job(run, script=batch.job_file)
-
-                if not job_id:
-                    logging.exception(
-                        "{} could not be submitted, we won't continue".format(
-                            batch.name
-                        ))
-                else:
-                    running = False
-                    state = None
-
-                    while not running:
-                        try:
-                            job = await cluster.find_id(job_id)
-                            state = job.state
-                        except (IndexError, ValueError) as e:
-                            logging.warning("Job {} not registered yet, "
-                                            "or error encountered".
-                                            format(job_id))
-                            logging.exception(e)
-
-                        if state and (
-                                state in cluster.START_STATES or
-                                state in cluster.FINISH_STATES):
-                            running = True
-                        else:
-                            await asyncio.sleep(args.submit_timeout)
-
-                    while True:
-                        try:
-                            job = await cluster.find_id(job_id)
-                            state = job.state
-                        except (IndexError, ValueError):
-                            logging.exception("Job status for run {} retrieval"
-                                              " whilst slurm running, waiting "
-                                              "and retrying".
-                                              format(run.id))
-                            await asyncio.sleep(args.error_timeout)
-                            continue
-
-                        logging.debug("{} monitor got state {} for job {}".
-                                      format(run.id, state, job_id))
-
-                        if state in cluster.FINISH_STATES:
-                            logging.info("{} monitor got state {} for job {}".
-                                         format(run.id, state, job_id))
-                            break
-                        else:
-                            await asyncio.sleep(args.running_timeout)
-
-        await run_task_items(batch.post_run)
+                metrics.observe("phase", time.monotonic() - waiting,
+                                batch=batch.name, phase="jobs_wait")
+
+                # The passed check reserved a slot in the shared job count,
+                # which we hand over to the submitted job
+                try:
+                    job_id = await cluster.submit_job(run,
+                                                      script=batch.job_file)
+                finally:
+                    if counts:
+                        counts.submitted(run, batch.name, job_id)
+
+                if job_id:
+                    metrics.inc("jobs_submitted", batch=batch.name)
+                    record(run, "submitted", job_id=job_id)
+
+                try:
+                    await monitor_job(cluster, run, job_id)
+                finally:
+                    if counts and job_id:
+                        counts.finished(run, batch.name, job_id)
+
+        with metrics.timer("phase", batch=batch.name, phase="post_run"):
+            await run_task_items(batch.post_run, batch.maxtasks)
+        record(run, "post_run")
     except ProcessingException:
         logging.error("Run failure caught, abandoning {} but not the "
                       "batch".format(run.id))
+        metrics.inc("runs_failed", batch=batch.name)
 
+    metrics.observe("phase", time.monotonic() - start,
+                    batch=batch.name, phase="run")
     logging.info("End run {} at {}".format(run.id, datetime.utcnow()))
     return job_id, run
 
 
-def do_batch_execution(loop, batch, repeat=False):
+async def do_batch_execution(batch, repeat=False):
     """Execute a batch configuration.
 
+    Batches may run concurrently on the event loop, so the batch runs as its
+    own task with its own context: the working directory of its tasks and
+    commands is its base directory, set in ``cwd_ctx`` rather than changing
+    the process working directory.
+
     Args:
-        loop (object): Event loop.
         batch (object): Batch configuration.
         repeat (number): Loop n times.
 
@@ -164,28 +301,39 @@ def do_batch_execution(loop, batch, repeat=False):
     logging.debug(pformat(batch))
 
     args = Arguments()
-    skip_indexes = args.indexes if args.indexes else list()
+    skip_indexes = list(args.indexes) if args.indexes else list()
     batch_ctx.set(batch)
 
     batch_dict = {k: v
                   for k, v in batch._asdict().items() \
                   if not (k.startswith("pre_")
                           or k.startswith("post_")
-                          or k in "runs")
-                  and not (k in ["cluster", "email", "nodes", "ntasks", "length"]
+                          or k in "runs"
+                          or k in ["sweep", "depends_on"])
+                  and not (k in ["cluster", "email", "nodes", "ntasks",
+                                 "length", "mem"]
                            and v is None)}
 
-    run_vars = run_ctx.get()
-    run_vars.update(batch_dict)
-    run_ctx.set(run_vars)
-
-    # We are process dependent here, so this is where we have the choice of
-    # concurrency strategies but each batch
-    # is dependent on chdir remaining consistent after this point.
-    orig = os.getcwd()
-    if not os.path.exists(batch.basedir):
-        os.makedirs(batch.basedir, exist_ok=True)
-    os.chdir(batch.basedir)
+    # Batch fields are layered over the ensemble vars for this batch only,
+    # rather than being merged into the root context
+    batch_vars = run_ctx.get()._new_child(batch_dict)
+    run_ctx.set(batch_vars)
+    extra_vars = extra_ctx.get()
+
+    basedir = os.path.abspath(batch.basedir)
+    if not os.path.exists(basedir):
+        os.makedirs(basedir, exist_ok=True)
+    cwd_ctx.set(basedir)
+    journal = None
+
+    # Runs complete without a job in no submission mode, so journaling them
+    # would have a later invocation skip runs that never ran
+    if args.journal and args.no_submission:
+        logging.warning("Not journaling runs for {} as jobs are not being "
+                        "submitted".format(batch.name))
+    elif args.journal:
+        journal = get_journal(basedir)
+    journal_ctx.set(journal)
 
     # TODO: Gross implementation for #26 - repeat parameter, this should be
     #  abstracted away into executor implementations (BatchExecutor.execute)
@@ -199,84 +347,187 @@ def do_batch_execution(loop, batch, repeat=False):
     for rep_i in range(1, repeat_count):
         logging.info("Running cycle {}".format(rep_i))
 
-        batch_tasks = list()
-        _batch_job_sems[batch.name] = asyncio.Semaphore(batch.maxjobs)
+        # Set before the runs start, so they share this cycle's limits
+        batch_jobs_ctx.set(asyncio.Semaphore(batch.maxjobs))
+        batch_array_ctx.set(None)
+
+        if batch.array:
+            cluster = cluster_ctx.get()
+
+            if hasattr(cluster, "submit_array"):
+                batch_array_ctx.set(ArraySubmitter(
+                    cluster.submit_array, batch.job_file,
+                    batch.maxruns, batch.maxjobs,
+                    throttle_array=getattr(cluster, "throttle_array", None)))
+            else:
+                logging.warning("Backend {} does not support job arrays, "
+                                "submitting runs for {} individually".
+                                format(cluster.__name__, batch.name))
 
         try:
-            loop.run_until_complete(run_task_items(batch.pre_batch))
+            await run_task_items(batch.pre_batch, batch.maxtasks)
         except ProcessingException:
             logging.error("We have received a pre_batch failure, "
                           "will stop execution")
             break
 
-        if len(sorted(set(skip_indexes))) == len(batch.runs):
+        try:
+            await snapshot_template_directory(batch)
+        except TemplatingError as e:
+            logging.error("We cannot prepare templates for the batch, "
+                          "will stop execution: {}".format(e))
+            break
+
+        if len(sorted(set(skip_indexes))) == batch.run_count:
             logging.error("No longer able to run this batch, all runs are in "
                           "the indexes to skip")
             break
 
-        for idx, run in enumerate(batch.runs):
-            # Auto-generated context vars for run
-            run['idx'] = idx
-            run['id'] = "{}-{}".format(batch.name, run['idx'])
-            run['dir'] = os.path.abspath(os.path.join(os.getcwd(), run['id']))
-            run['batch_idx'] = rep_i
-
-            if idx < args.skips:
-                logging.warning("Skipping run index {} due to {} skips, run "
-                                "ID: {}".format(idx, args.skips, run['id']))
-                continue
-
-            if idx in skip_indexes:
-                logging.warning("Skipping run index {} due to being in "
-                                "skip indexes, run ID: {}".
-                                format(idx, run['id']))
-                continue
-
-            # At this point the context changes at root to property based
-            ctx_dict = run_ctx.get()
-            ctx_dict.update(run)
-            ctx_dict.update(extra_ctx.get())
-
-            Run = collections.namedtuple('Run', field_names=ctx_dict.keys())
-            r = Run(**ctx_dict)
-            task = run_batch_item(r)
-            batch_tasks.append(task)
-
-        batch_results = loop.run_until_complete(
-            run_runner(batch.maxruns, batch_tasks))
-
-        for idx, result in enumerate(batch_results):
-            job, run = result
-            logging.debug("Batch {} result #{} from run {}: job {}".format(
-                batch.name, idx, run.idx, str(job)
-            ))
+        # Runs, which may come from a sweep, are only generated as the runner
+        # has room for them
+        def batch_tasks():
+            for idx, run in enumerate(batch.iter_runs()):
+                # Auto-generated context vars for run
+                run['idx'] = idx
+                run['id'] = "{}-{}".format(batch.name, run['idx'])
+                run['dir'] = os.path.join(basedir, run['id'])
+                run['batch_idx'] = rep_i
+
+                if idx < args.skips:
+                    logging.warning("Skipping run index {} due to {} skips, "
+                                    "run ID: {}".format(idx, args.skips,
+                                                        run['id']))
+                    continue
+
+                if idx in skip_set:
+                    logging.warning("Skipping run index {} due to being in "
+                                    "skip indexes, run ID: {}".
+                                    format(idx, run['id']))
+                    continue
+
+                resume = journal.entry(batch.name, rep_i, idx) \
+                    if journal else None
+
+                if resume and resume.phase == PHASES[-1]:
+                    logging.info("Skipping run index {} as the journal "
+                                 "records it completed, run ID: {}".
+                                 format(idx, run['id']))
+                    continue
+
+                # Each run overlays its own fields on the shared batch
+                # context, with extra vars taking precedence
+                yield run_batch_item(batch_vars._new_child(extra_vars, run),
+                                     resume)
+
+        skip_set = set(skip_indexes)
+        completed = 0
+
+        # Results are handled as each run completes, rather than once the
+        # whole batch has
+        async for _, (job, run) in iter_runner(batch.maxruns, batch_tasks()):
+            logging.debug("Batch {} result #{} from run {}: job {}".
+                          format(batch.name, completed, run.idx, str(job)))
 
             if not job and run.idx not in skip_indexes:
                 logging.warning("Result #{} for run {} indicates unsuccessful "
                                 "submission, adding to indexes to skip".
-                                format(idx, run.idx))
+                                format(completed, run.idx))
                 skip_indexes.append(run.idx)
+            completed += 1
 
         try:
-            loop.run_until_complete(run_task_items(batch.post_batch))
+            await run_task_items(batch.post_batch, batch.maxtasks)
         except ProcessingException:
             logging.error("We have received a post_batch failure, "
                           "will stop execution")
             break
 
-    os.chdir(orig)
     logging.info("Batch {} completed: {}".
                  format(batch.name, datetime.utcnow()))
     # TODO: return batch windows/info
     return "Success"
 
 
+def batch_dependencies(batches):
+    """Resolve the batches each batch has to wait for.
+
+    Batches without ``depends_on`` wait for the batch before them, so
+    ensembles run their batches in order by default. ``depends_on`` names
+    earlier batches, so an empty list allows a batch to start straight away.
+
+    Args:
+        batches (list): Batch configurations.
+
+    Returns:
+        (list): For each batch, the indexes of the batches it depends on.
+
+    Raises:
+        RuntimeError: If a batch depends on a name not defined by an earlier
+            batch.
+    """
+    names = dict()
+    deps = list()
+
+    for idx, batch in enumerate(batches):
+        depends_on = batch.depends_on
+
+        if depends_on is None:
+            deps.append([idx - 1] if idx > 0 else [])
+        else:
+            depends_on = [depends_on] if isinstance(depends_on, str) \
+                else depends_on
+            missing = [dep for dep in depends_on if dep not in names]
+
+            if missing:
+                raise RuntimeError("Batch {} depends on {}, which are not "
+                                   "names of earlier batches".
+                                   format(batch.name, ", ".join(missing)))
+            deps.append(sorted(set(names[dep] for dep in depends_on)))
+        names[batch.name] = idx
+    return deps
+
+
+async def run_batches(batches):
+    """Execute batches, each as soon as the batches it depends on complete.
+
+    Independent batches run concurrently, each in its own context. If a
+    batch raises, the others are cancelled.
+
+    Args:
+        batches (list): Batch configurations.
+    """
+    deps = batch_dependencies(batches)
+    done = [asyncio.Event() for _ in batches]
+
+    async def node(idx):
+        try:
+            for dep in deps[idx]:
+                await done[dep].wait()
+            await do_batch_execution(batches[idx],
+                                     repeat=batches[idx].repeat)
+        finally:
+            done[idx].set()
+
+    nodes = [asyncio.ensure_future(node(idx)) for idx in range(len(batches))]
+
+    try:
+        await asyncio.gather(*nodes)
+    finally:
+        for future in nodes:
+            future.cancel()
+        await asyncio.gather(*nodes, return_exceptions=True)
+
+
 class BatchExecutor(object):
     """Create an executor for a ensemble configuration.
 
     The purpose of this is act as the extensible master executor for the
     ensemble configuration provided. It handles the event loop and should be
     used to contain and control the execution overall.
+
+    The executor's context is only established within ``execute``, so
+    several executors can run their ensembles concurrently on one event loop
+    through ``run_executors``.
     """
 
     def __init__(self, cfg, backend="slurm", extra_vars=[]):
@@ -285,13 +536,15 @@ class BatchExecutor(object):
         Args:
             cfg (object): EnsembleConfig ensemble configuration.
             backend (str): Backend to execute on,
-                        should be one of {'dummy'|'slurm'}.
+                        should be one of
+                        {'dummy'|'local'|'slurm'|'simulator'}.
             extra_vars (list): Additional variables.
         """
         self._cfg = cfg
+        self._cluster = None
+        self._extra_vars = dict(extra_vars)
 
         self._init_cluster(backend)
-        self._init_ctx(extra_vars)
 
     def _init_cluster(self, backend):
         """Initialise the cluster backend for batch execution.
@@ -304,6 +557,7 @@ class BatchExecutor(object):
             ModuleNotFoundError: If cluster backend specified is not supported.
         """
         nom = "model_ensembler.cluster.{}".format(backend)
+        logging.info("Importing {}".format(nom))
         try:
             mod = importlib.import_module(nom)
         except ModuleNotFoundError:
@@ -311,56 +565,114 @@ class BatchExecutor(object):
                                       "model_ensembler.cluster!".
                                       format(backend))
 
-        init_hpc_backend(nom)
-        cluster_ctx.set(mod)
+        self._cluster = mod
 
-    def _init_ctx(self, extra_vars):
+    def _init_ctx(self):
         """Initialise contexts.
 
         Initialise the root context vars for batch execution and set
         extra context vars that can be added last thing to the run.
-
-        Args:
-            extra_vars (list): Additional variables.
         """
-        var_dict = run_ctx.get(dict())
-        var_dict.update(self._cfg.vars)
-        run_ctx.set(var_dict)
+        cluster_ctx.set(self._cluster)
+        run_ctx.set(RunContext(dict(self._cfg.vars)))
+        extra_ctx.set(self._extra_vars)
+        jobs_ctx.set(asyncio.Semaphore(self._cfg.maxjobs)
+                     if self._cfg.maxjobs else None)
+
+        # Backends with their own commands, such as the simulator, provide
+        # them for this ensemble only
+        command_path = getattr(self._cluster, "command_path", None)
+        if command_path:
+            command_path_ctx.set(command_path())
+
+    async def execute(self):
+        """Execute the ensemble on the running event loop.
+
+        Runs the preprocessing actions for the ensemble, the batches and then
+        the postprocessing actions, within a context of its own.
+        """
+        await asyncio.ensure_future(self._execute())
+
+    async def _execute(self):
+        """Execute the ensemble, as a task copying the caller's context."""
+        self._init_ctx()
 
-        extra_ctx.set(extra_vars)
+        await run_task_items(self._cfg.pre_process)
+        await run_batches(self._cfg.batches)
+        await run_task_items(self._cfg.post_process)
 
     def run(self, loop=None):
         """Run the executor.
 
-        This will establish the event loop, run the preprocessing actions for
-        the ensemble, cycle through executing the batches and then run
-        postprocessing actions. Exceptions will be caught and the event loop
-        closed, currently with no specific handling.
+        This will establish the event loop and run the ensemble, see
+        ``run_executors``.
 
         Args:
             loop (object): Event loop.
         """
-        logging.info("Running batcher")
+        run_executors([self], loop)
 
-        try:
-            loop = asyncio.get_event_loop()
-            loop.run_until_complete(
-                run_task_items(self._cfg.pre_process))
 
-            # Should batch be in function signature?
-            for batch in self._cfg.batches:
-                do_batch_execution(loop, batch, repeat=batch.repeat)
-                # do_batch_execution(loop, batch) moves to
-                # self.execute(loop, batch)
+def run_executors(executors, loop=None):
+    """Run the ensembles of several executors concurrently.
 
-            loop.run_until_complete(
-                run_task_items(self._cfg.post_process))
+    This will establish the event loop and any callback server shared by the
+    executors, then run every ensemble, see ``BatchExecutor.execute``.
+    Exceptions will be caught and the event loop closed, currently with no
+    specific handling.
 
-        finally:
-            if loop:
-                loop.run_until_complete(loop.shutdown_asyncgens())
-                loop.close()
+    Args:
+        executors (list): BatchExecutor instances.
+        loop (object): Event loop.
+    """
+    logging.info("Running batcher")
+    args = Arguments()
+    callbacks = None
+    profiler = None
+
+    try:
+        loop = asyncio.get_event_loop()
+
+        if args.profile:
+            profiler = Profiler(loop, args.profile_lag, args.profile_output)
+            profiler.start()
+
+        if args.callback:
+            callbacks = CallbackServer(args.callback)
+            loop.run_until_complete(callbacks.start())
+            callback_ctx.set(callbacks)
+
+        # Cancelled along with any other background tasks on completion
+        if args.metrics_dir:
+            loop.create_task(metrics.exporter(args.metrics_dir,
+                                              args.metrics_interval))
+
+        loop.run_until_complete(asyncio.gather(
+            *(executor.execute() for executor in executors)))
+    finally:
+        if callbacks:
+            loop.run_until_complete(callbacks.stop())
+        if profiler:
+            profiler.stop()
+        close_journals()
+
+        if args.metrics_dir:
+            try:
+                metrics.export(args.metrics_dir)
+            except OSError as e:
+                logging.warning("Could not export metrics to {}: {}".
+                                format(args.metrics_dir, e))
+
+        if loop:
+            loop.run_until_complete(shell_pool.close())
+
+            # Background tasks, such as idle job pollers, may outlive the
+            # ensembles, so cancel them as asyncio.run would
+            pending = asyncio.all_tasks(loop)
+            for task in pending:
+                task.cancel()
+            loop.run_until_complete(
+                asyncio.gather(*pending, return_exceptions=True))
 
-# What does this do?
-    def execute(self, loop, batch):
-        raise NotImplementedError("")
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.close()
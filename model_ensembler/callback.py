@@ -0,0 +1,246 @@
+import asyncio
+import json
+import logging
+import os
+import secrets
+import shlex
+import socket
+import sys
+import tempfile
+
+from model_ensembler.cluster import Job
+from model_ensembler.exceptions import TemplatingError
+
+"""Job callback module
+
+Contains the completion channel allowing job scripts to notify the ensembler
+directly when they start and finish, rather than waiting on the scheduler.
+"""
+
+_CALLBACK_PY = """import json, socket, sys
+family, address, key, event = sys.argv[1:5]
+rc = int(sys.argv[5]) if len(sys.argv) > 5 else 0
+if family == "unix":
+    sock = socket.socket(socket.AF_UNIX)
+    sock.settimeout(10)
+    sock.connect(address)
+else:
+    host, port = address.rsplit(":", 1)
+    sock = socket.create_connection((host, int(port)), 10)
+sock.sendall((json.dumps(dict(key=key, event=event, rc=rc)) + "\\n").encode())
+sock.close()
+"""
+
+_CALLBACK_HELPER = """# >>> model_ensembler callback >>>
+_ME_CALLBACK_PY={code}
+_me_callback() {{
+    {python} -c "$_ME_CALLBACK_PY" {family} {address} {key} "$@" \\
+        >/dev/null 2>&1 || \\
+    python3 -c "$_ME_CALLBACK_PY" {family} {address} {key} "$@" \\
+        >/dev/null 2>&1 || true
+}}
+_me_callback start
+trap '_me_callback finish $?' EXIT
+# <<< model_ensembler callback <<<
+"""
+
+
+class CallbackServer(object):
+    """Listens for job start and finish notifications from job scripts.
+
+    A small helper is injected into each run's templated job file which
+    reports to this server when the job starts and exits. Notifications are
+    pushed into the cluster backend's poller, waking the waiting run
+    immediately, with scheduler polling retained as a slow fallback.
+
+    Args:
+        address (str): Where to listen, either ``unix[:PATH]`` or
+            ``tcp:HOST:PORT``. A port of zero selects a free port.
+    """
+
+    def __init__(self, address):
+        self._family, _, self._address = address.partition(":")
+
+        if self._family not in ("unix", "tcp"):
+            raise ValueError("Callback address {} should be unix:PATH or "
+                             "tcp:HOST:PORT".format(address))
+
+        self._server = None
+        self._keys = dict()
+        self._live = set()
+        self._events = dict()
+        self._watchers = dict()
+
+    @property
+    def address(self):
+        """ Property decorator for the address job scripts connect to.
+
+        Returns:
+            (str): Socket path or host:port.
+        """
+        return self._address
+
+    async def start(self):
+        """Start listening for notifications."""
+        if self._family == "unix":
+            if not self._address:
+                self._address = os.path.join(
+                    tempfile.gettempdir(),
+                    "model_ensembler.{}.sock".format(os.getpid()))
+
+            if os.path.exists(self._address):
+                os.unlink(self._address)
+
+            self._server = await asyncio.start_unix_server(
+                self._handle, path=self._address)
+        else:
+            host, port = self._address.rsplit(":", 1)
+            self._server = await asyncio.start_server(
+                self._handle, host=host, port=int(port))
+
+            port = self._server.sockets[0].getsockname()[1]
+            if host in ("", "0.0.0.0", "::"):
+                host = socket.getfqdn()
+            self._address = "{}:{}".format(host, port)
+
+        logging.info("Listening for job callbacks on {}:{}".
+                     format(self._family, self._address))
+
+    async def stop(self):
+        """Stop listening for notifications."""
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+            if self._family == "unix" and os.path.exists(self._address):
+                os.unlink(self._address)
+
+    async def _handle(self, reader, writer):
+        """Process notifications from a single connection.
+
+        Args:
+            reader (object): asyncio.StreamReader for the connection.
+            writer (object): asyncio.StreamWriter for the connection.
+        """
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                try:
+                    msg = json.loads(line.decode())
+                    self.notify(msg["key"], msg["event"], int(msg["rc"]))
+                except (ValueError, KeyError, TypeError):
+                    logging.warning("Discarding malformed callback: {}".
+                                    format(line))
+        finally:
+            writer.close()
+
+    def inject(self, run, job_file):
+        """Inject the notification helper into a templated job file.
+
+        The helper is placed after the leading comment block so that any
+        scheduler directives remain ahead of the first command.
+
+        Args:
+            run (object): Specific run configuration.
+            job_file (str): Path to the templated job file.
+
+        Raises:
+            TemplatingError: If the job file cannot be rewritten.
+        """
+        try:
+            with open(job_file, "r") as fh:
+                lines = fh.readlines()
+
+            if lines and lines[0].startswith("#!") and \
+                    not any(word.endswith("sh")
+                            for word in lines[0][2:].split()):
+                logging.warning("Not injecting callback into {}, it does not "
+                                "appear to be a shell script".format(job_file))
+                return
+
+            key = "{}.{}".format(run.id, secrets.token_hex(8))
+            helper = _CALLBACK_HELPER.format(
+                code=shlex.quote(_CALLBACK_PY),
+                python=shlex.quote(sys.executable),
+                family=self._family,
+                address=shlex.quote(self._address),
+                key=shlex.quote(key))
+
+            idx = next((i for i, line in enumerate(lines)
+                        if line.strip() and not line.startswith("#")),
+                       len(lines))
+            lines.insert(idx, helper)
+
+            with open(job_file, "w") as fh:
+                fh.write("".join(lines))
+        except OSError as e:
+            raise TemplatingError("Could not inject callback into {}: {}".
+                                  format(job_file, e))
+
+        self.unwatch(run)
+        self._keys[run.dir] = key
+        self._live.add(key)
+
+    def notify(self, key, event, rc=0):
+        """Record a notification, pushing it to the run's watcher.
+
+        Args:
+            key (str): Per run key embedded into the job file.
+            event (str): Either "start" or "finish".
+            rc (int): Exit code of the job script, for finish events.
+        """
+        logging.debug("Callback {} received for {} with return code {}".
+                      format(event, key, rc))
+
+        if key not in self._live:
+            logging.debug("Ignoring callback for unknown key {}".format(key))
+            return
+        self._events[key] = (event, rc)
+
+        if key in self._watchers:
+            job_id, poller = self._watchers[key]
+
+            if event == "finish":
+                state = "COMPLETED" if rc == 0 else "FAILED"
+            else:
+                state = "RUNNING"
+
+            poller.push(job_id, Job(name=key.rsplit(".", 1)[0],
+                                    state=state,
+                                    started=True,
+                                    finished=event == "finish"))
+
+    def watch(self, run, job_id, poller):
+        """Route notifications for a run into a poller for its job.
+
+        Args:
+            run (object): Specific run configuration.
+            job_id (int|str): Job identifier the run is waiting on.
+            poller (object): Backend JobPoller the run is waiting with.
+        """
+        key = self._keys.get(run.dir)
+        if not key:
+            return
+
+        self._watchers[key] = (job_id, poller)
+        if key in self._events:
+            self.notify(key, *self._events[key])
+
+    def unwatch(self, run):
+        """Stop routing notifications for a run.
+
+        Args:
+            run (object): Specific run configuration.
+        """
+        key = self._keys.pop(run.dir, None)
+        self._live.discard(key)
+        self._events.pop(key, None)
+
+        watcher = self._watchers.pop(key, None)
+        if watcher:
+            job_id, poller = watcher
+            poller.forget(job_id)
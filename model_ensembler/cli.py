@@ -5,7 +5,7 @@ import re
 import sys
 
 from .config import EnsembleConfig
-from .batcher import BatchExecutor
+from .batcher import BatchExecutor, run_executors
 # TODO: logging and parse_args should be in utils
 from .utils import Arguments, background_fork, setup_logging
 
@@ -82,6 +82,54 @@ def parse_args(args_list=None):
                         help="Allows the user to specify the shell passed to "
                              "subprocess execs.",
                         default="/bin/bash", type=str)
+    parser.add_argument("-sw", "--shell-workers",
+                        help="Number of long lived shells to run commands "
+                             "on, rather than starting a shell per command",
+                        default=0, type=int)
+    parser.add_argument("-tc", "--template-cache",
+                        help="Directory to cache compiled templates in "
+                             "between invocations",
+                        default=None, type=str)
+    parser.add_argument("-iw", "--io-workers",
+                        help="Number of threads preparing run directories, "
+                             "rendering templates and writing command logs",
+                        default=8, type=int)
+    parser.add_argument("-cc", "--config-cache",
+                        help="Directory to cache validated configurations "
+                             "in, skipping parsing and validation when the "
+                             "configuration is unchanged",
+                        default=None, type=str)
+    parser.add_argument("-cp", "--command-path",
+                        help="Directory searched first for commands, for "
+                             "example stand-in SLURM commands from "
+                             "model_ensemble_simulator",
+                        default=None, type=str)
+
+    parser.add_argument("-j", "--journal", default=False,
+                        action="store_true",
+                        help="Journal run states under each batch basedir, "
+                             "resuming runs recorded there by an earlier "
+                             "invocation, not used with --no-submission")
+    parser.add_argument("-md", "--metrics-dir",
+                        help="Directory to export timings and counters to, "
+                             "as a Prometheus node-exporter textfile and a "
+                             "JSON summary per batch",
+                        default=None, type=str)
+    parser.add_argument("-mi", "--metrics-interval",
+                        help="Seconds between exports of metrics",
+                        default=30, type=int)
+
+    parser.add_argument("-pr", "--profile", default=False,
+                        action="store_true",
+                        help="Report the event loop being blocked, with the "
+                             "stack blocking it, and the wall time of tasks "
+                             "by coroutine on completion")
+    parser.add_argument("-pl", "--profile-lag", default=0.5, type=float,
+                        help="Seconds the event loop may be blocked before "
+                             "it is reported whilst profiling")
+    parser.add_argument("-po", "--profile-output", default=None, type=str,
+                        help="File to write cProfile statistics of the "
+                             "event loop thread to whilst profiling")
 
     # FIXME: These should not be applied in multi-batch ensembles
     parser.add_argument("-k", "--skips",
@@ -97,13 +145,43 @@ def parse_args(args_list=None):
     parser.add_argument("-rt", "--running-timeout", default=60, type=int)
     parser.add_argument("-et", "--error-timeout", default=120, type=int)
 
-    parser.add_argument("-ms", "--max-stagger", default=1, type=int)
+    parser.add_argument("-ms", "--max-stagger", default=1, type=int,
+                        help="Deprecated and ignored, submissions are "
+                             "limited by --submit-rate and --submit-burst")
+    parser.add_argument("-sr", "--submit-rate", default=1., type=float,
+                        help="Maximum sustained job submissions per second "
+                             "across all runs, 0 for unlimited")
+    parser.add_argument("-sb", "--submit-burst", default=5, type=int,
+                        help="Number of submissions allowed in a burst when "
+                             "the scheduler has been idle")
+
+    parser.add_argument("-cb", "--callback", default=None, type=str,
+                        help="Listen for job start and finish callbacks on "
+                             "unix[:PATH] or tcp:HOST:PORT, so runs wake as "
+                             "soon as their job finishes")
+    parser.add_argument("-cf", "--callback-fallback", default=600, type=int,
+                        help="Seconds between scheduler polls whilst "
+                             "callbacks are enabled")
+
+    parser.add_argument("-lc", "--local-cores", default=None, type=int,
+                        help="Cores the local backend schedules runs on, "
+                             "defaulting to those available")
+    parser.add_argument("-lm", "--local-memory", default=None, type=str,
+                        help="Memory the local backend schedules runs on, "
+                             "for example 64G, defaulting to that available")
 
     parser.add_argument("-x", "--extra-vars", dest="extra", nargs="*",
                         default=[], type=parse_extra_vars)
 
+    parser.add_argument("-ac", "--add-configuration", dest="configurations",
+                        action="append", default=[],
+                        help="Further configuration to run concurrently "
+                             "with the first in the same process, may be "
+                             "repeated")
+
     parser.add_argument("configuration")
-    parser.add_argument("backend", default="slurm", choices=("slurm", "dummy"),
+    parser.add_argument("backend", default="slurm",
+                        choices=("slurm", "dummy", "local", "simulator"),
                         nargs="?")
 
     # Required to allow passing pre-set config to be 
@@ -132,11 +210,14 @@ def main(args=None):
 
     logging.info("Model Ensemble Runner")
 
-    config = EnsembleConfig(args.configuration)
     # TODO: get_batch_executor
-    BatchExecutor(config,
-                  args.backend,
-                  dict(args.extra)).run()
+    executors = [BatchExecutor(EnsembleConfig(configuration,
+                                              cache_dir=args.config_cache),
+                               args.backend,
+                               dict(args.extra))
+                 for configuration in
+                 [args.configuration] + args.configurations]
+    run_executors(executors)
 
 
 def check():
@@ -1,5 +1,580 @@
 import asyncio
 import collections
+import logging
+
+from model_ensembler.utils import Arguments
 
 Job = collections.namedtuple("Job", ["name", "state", "started", "finished"])
 job_lock = asyncio.Lock()
+
+
+class TokenBucket(object):
+    """Token bucket rate limiter for scheduler submissions.
+
+    Tokens accrue at ``rate`` per second up to ``burst``, and each
+    submission consumes one, so an idle scheduler is submitted to
+    immediately while sustained submission is bounded by the rate.
+
+    Args:
+        rate (float, optional): Tokens per second, defaulting to the
+            ``submit_rate`` argument. Zero disables limiting.
+        burst (int, optional): Maximum number of tokens, defaulting to the
+            ``submit_burst`` argument.
+    """
+
+    def __init__(self, rate=None, burst=None):
+        self._rate = rate
+        self._burst = burst
+        self._tokens = None
+        self._updated = None
+        self._lock = None
+        self._loop = None
+
+    async def acquire(self):
+        """Wait for and consume a token.
+
+        Returns:
+            (float): Number of seconds spent waiting for the token.
+        """
+        if self._rate is None:
+            args = Arguments()
+            self._rate = args.submit_rate
+            self._burst = args.submit_burst if self._burst is None \
+                else self._burst
+
+        if not self._rate:
+            return 0.
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        burst = max(self._burst or 1, 1)
+
+        # Locks bind to the loop they are first used on before Python 3.10,
+        # so the limiter, which is created at import, makes one per loop
+        if self._loop is not loop:
+            self._lock = asyncio.Lock()
+            self._loop = loop
+            self._tokens = None
+
+        async with self._lock:
+            while True:
+                now = loop.time()
+                if self._tokens is None:
+                    self._tokens = burst
+                else:
+                    self._tokens = min(burst, self._tokens +
+                                       (now - self._updated) * self._rate)
+                self._updated = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    break
+                await asyncio.sleep((1 - self._tokens) / self._rate)
+
+        return loop.time() - start
+
+
+submit_limiter = TokenBucket()
+
+
+class JobPoller(object):
+    """Shared job state poller for a cluster backend.
+
+    Rather than every run querying the scheduler for its own job, runs
+    register interest with ``wait_for`` and a single task queries the backend
+    for every watched job at once, resolving the waiters as their jobs reach
+    the requested states. Scheduler load is therefore one query per interval
+    regardless of how many runs are in flight.
+
+    Args:
+        find_ids (callable): Async backend method accepting a list of job ids
+            and returning a dict of job id to Job for those it could find.
+    """
+
+    def __init__(self, find_ids):
+        self._find_ids = find_ids
+        self._jobs = dict()
+        self._pushed = dict()
+        self._waiters = collections.defaultdict(list)
+        self._last_poll = None
+        self._task = None
+        self._wakeup = None
+
+    def _interval(self):
+        """Determine how long to wait before the next poll.
+
+        Jobs not yet seen by the scheduler are polled at the submission
+        timeout, otherwise we fall back to the running timeout. When job
+        callbacks are enabled polling is only a slow fallback.
+
+        Returns:
+            (int): Number of seconds to wait.
+        """
+        args = Arguments()
+
+        if any(job_id not in self._jobs for job_id in self._waiters):
+            interval = args.submit_timeout
+        else:
+            interval = args.running_timeout
+
+        if args.callback:
+            interval = max(interval, args.callback_fallback)
+        return interval
+
+    def _ensure_running(self):
+        """Start the polling task if it isn't already running."""
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.ensure_future(self._poll())
+        self._wakeup.set()
+
+    async def _poll(self):
+        """Poll the backend for watched jobs until nobody is waiting."""
+        try:
+            await self._poll_watched()
+        finally:
+            self._jobs.clear()
+
+    async def _poll_watched(self):
+        """Poll the backend for watched jobs whilst anyone is waiting."""
+        args = Arguments()
+        loop = asyncio.get_running_loop()
+
+        while self._waiters:
+            job_ids = list(self._waiters.keys())
+            self._last_poll = loop.time()
+
+            try:
+                jobs = await self._find_ids(job_ids)
+            except Exception as e:
+                logging.warning("Could not retrieve states for {} jobs, "
+                                "waiting and retrying: {}".
+                                format(len(job_ids), e))
+                await asyncio.sleep(args.error_timeout)
+                continue
+
+            logging.debug("Poller retrieved {} of {} watched jobs".
+                          format(len(jobs), len(job_ids)))
+
+            for job_id, job in jobs.items():
+                self.update(job_id, job)
+
+            deadline = self._last_poll + self._interval()
+            while self._waiters:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(),
+                                           max(deadline - loop.time(), 0))
+                except asyncio.TimeoutError:
+                    break
+                deadline = min(deadline, self._last_poll + self._interval())
+
+    def update(self, job_id, job):
+        """Record a job state, resolving any waiters interested in it.
+
+        States are only kept whilst the job is watched, so a job ID reused
+        later is never resolved from a stale state.
+
+        Args:
+            job_id (int|str): Job identifier.
+            job (Job): Current job information.
+        """
+        job_id = str(job_id)
+        if job_id not in self._waiters:
+            return
+        self._jobs[job_id] = job
+
+        for states, fut in list(self._waiters[job_id]):
+            if job.state in states and not fut.done():
+                fut.set_result(job)
+
+    def push(self, job_id, job):
+        """Record a job state pushed for a watched job, such as a callback.
+
+        Unlike polled states, pushed states are kept until ``forget`` is
+        called for the job, so they also resolve waits that start later.
+
+        Args:
+            job_id (int|str): Job identifier.
+            job (Job): Current job information.
+        """
+        self._pushed[str(job_id)] = job
+        self.update(job_id, job)
+
+    def forget(self, job_id):
+        """Discard any pushed state for a job.
+
+        Args:
+            job_id (int|str): Job identifier.
+        """
+        self._pushed.pop(str(job_id), None)
+
+    async def wait_for(self, job_id, states):
+        """Wait for a job to reach one of the provided states.
+
+        Only states polled after the wait is registered, or pushed since the
+        job was last forgotten, resolve it.
+
+        Args:
+            job_id (int|str): Job identifier.
+            states (tuple): States to wait for.
+
+        Returns:
+            (Job): Job information at the point one of the states was seen.
+        """
+        job_id = str(job_id)
+        job = self._pushed.get(job_id)
+
+        if job and job.state in states:
+            return job
+
+        fut = asyncio.get_running_loop().create_future()
+        waiter = (states, fut)
+        self._waiters[job_id].append(waiter)
+        self._ensure_running()
+
+        try:
+            return await fut
+        finally:
+            self._waiters[job_id].remove(waiter)
+            if not self._waiters[job_id]:
+                del self._waiters[job_id]
+                self._jobs.pop(job_id, None)
+
+
+class JobCounter(object):
+    """Backend wide, cached view of the number of active jobs.
+
+    Rather than listing the scheduler queue for every check, the active jobs
+    for each partition and name prefix are refreshed at most once per check
+    timeout, and kept up to date in between from local submissions and
+    completions. Checks may reserve a slot, so that concurrent runs cannot
+    all pass a check for the same remaining slot.
+
+    Args:
+        current_jobs (callable): Async backend method accepting a context and
+            name prefix and returning a list of active jobs.
+    """
+
+    class _View(object):
+        """Active job state for a single partition and prefix"""
+
+        def __init__(self):
+            self.lock = asyncio.Lock()
+            self.refreshed = None
+            self.remote = set()
+            self.local = set()
+            self.finished = set()
+            self.reserved = 0
+
+        @property
+        def count(self):
+            return len((self.remote | self.local) - self.finished) + \
+                self.reserved
+
+    def __init__(self, current_jobs):
+        self._current_jobs = current_jobs
+        self._views = dict()
+
+    @staticmethod
+    def _job_id(job):
+        """Identify a job from either backend representation.
+
+        Args:
+            job (object): Job namedtuple or dict from current_jobs.
+
+        Returns:
+            (str): Job identifier.
+        """
+        if isinstance(job, dict):
+            return str(job.get("id", job["name"]))
+        return str(job.name)
+
+    def _view(self, ctx, match):
+        """Retrieve the view for the context's partition and a prefix.
+
+        Args:
+            ctx (object): Context object for retrieving configuration.
+            match (str): Name prefix.
+
+        Returns:
+            (object): View for the partition and prefix.
+        """
+        key = (getattr(ctx, "cluster", None), match)
+        if key not in self._views:
+            self._views[key] = self._View()
+        return self._views[key]
+
+    async def check(self, ctx, match, limit, reserve=False):
+        """Check whether the number of active jobs is under a limit.
+
+        Args:
+            ctx (object): Context object for retrieving configuration.
+            match (str): Name prefix of the jobs to count.
+            limit (int): Number of jobs to check against.
+            reserve (bool, optional): If under the limit, reserve a slot for a
+                submission to follow.
+
+        Returns:
+            (bool): True if the number of jobs is less than limit.
+        """
+        args = Arguments()
+        view = self._view(ctx, match)
+        loop = asyncio.get_running_loop()
+
+        async with view.lock:
+            if view.refreshed is None or \
+                    loop.time() - view.refreshed >= args.check_timeout:
+                submitted = set(view.local)
+                jobs = await self._current_jobs(ctx, match)
+
+                view.refreshed = loop.time()
+                view.remote = set(self._job_id(job) for job in jobs)
+                # Anything submitted during the refresh may not be listed
+                view.local -= submitted
+                view.finished &= view.remote
+
+            count = view.count
+            res = count < int(limit)
+            if res and reserve:
+                view.reserved += 1
+
+        logging.debug("Jobs in action {} with limit {}".format(count, limit))
+        return res
+
+    def submitted(self, ctx, match, job_id=None):
+        """Record the outcome of a reserved submission.
+
+        Args:
+            ctx (object): Context object for retrieving configuration.
+            match (str): Name prefix the reservation was made against.
+            job_id (int|str, optional): Submitted job ID, or None if the
+                submission failed and the reservation should be released.
+        """
+        view = self._view(ctx, match)
+        view.reserved = max(view.reserved - 1, 0)
+
+        if job_id:
+            view.local.add(str(job_id))
+
+    def finished(self, ctx, match, job_id):
+        """Record that a job is no longer active.
+
+        Args:
+            ctx (object): Context object for retrieving configuration.
+            match (str): Name prefix the job was counted against.
+            job_id (int|str): Finished job ID.
+        """
+        view = self._view(ctx, match)
+        job_id = str(job_id)
+
+        if job_id in view.local:
+            view.local.discard(job_id)
+        else:
+            view.finished.add(job_id)
+
+
+class ArraySubmitter(object):
+    """Coalesces run submissions for a batch into job arrays.
+
+    Runs hand their submission to ``submit`` and are held until the pending
+    runs, together with those unfinished from earlier arrays, reach ``size``
+    or the submission timeout elapses, at which point all pending runs are
+    handed to the backend as a single array submission. Each run then
+    receives its own array task ID, which it hands to ``finished`` once the
+    task is done.
+
+    ``limit`` applies across every array the batch has in flight. An array
+    running at most ``throttle`` tasks holds the lesser of its throttle and
+    its unfinished tasks from the limit, and new arrays are submitted with a
+    throttle of whatever remains. As tasks finish, the freed capacity is used
+    to raise the throttle of arrays with tasks waiting on it, if the backend
+    can, before submitting further arrays.
+
+    Args:
+        submit_array (callable): Async backend method accepting a list of run
+            contexts, the script and a concurrency limit, returning a list of
+            array task job IDs in the same order as the contexts.
+        script (str): Script name to submit from each run directory.
+        size (int): Number of runs in flight that trigger an immediate
+            submission, normally the number of runs that can be in flight.
+        limit (int, optional): Maximum number of simultaneously running array
+            tasks across all arrays.
+        throttle_array (callable, optional): Async backend method accepting
+            an array task job ID and a new limit for its array.
+    """
+
+    def __init__(self, submit_array, script, size, limit=None,
+                 throttle_array=None):
+        self._submit_array = submit_array
+        self._throttle_array = throttle_array
+        self._script = script
+        self._size = max(int(size), 1)
+        self._limit = int(limit) if limit else None
+        self._pending = list()
+        self._timer = None
+        self._due = False
+        self._arrays = list()
+        self._tasks = dict()
+        self._throttle_lock = None
+
+    def _free(self):
+        """Determine how many more tasks may run at once across arrays.
+
+        Returns:
+            (int): Free capacity, or None if there is no limit.
+        """
+        if not self._limit:
+            return None
+        return self._limit - sum(min(array["throttle"], array["unfinished"])
+                                 for array in self._arrays)
+
+    def _maybe_flush(self):
+        """Submit the pending runs, if they are due and there is capacity."""
+        if not self._pending:
+            return
+
+        free = self._free()
+        if free is not None and free < 1:
+            return
+
+        unfinished = sum(array["unfinished"] for array in self._arrays)
+        # Once every run in flight is pending or unfinished, no more runs
+        # can arrive until a task finishes
+        if self._due or len(self._pending) + unfinished >= self._size:
+            self._flush(free)
+
+    def _expire(self):
+        """Make the pending runs due once the submission timeout elapses."""
+        self._timer = None
+        self._due = True
+        self._maybe_flush()
+
+    def _flush(self, throttle):
+        """Hand all pending runs to the backend as a single submission.
+
+        Args:
+            throttle (int): Maximum number of the array's tasks to run at
+                once, or None for no limit.
+        """
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        self._due = False
+
+        pending, self._pending = self._pending, list()
+        array = {"task": None, "throttle": throttle,
+                 "unfinished": len(pending)}
+        # Accounted for immediately, so later arrays see its throttle
+        self._arrays.append(array)
+        asyncio.ensure_future(self._submit(pending, array))
+
+    async def _submit(self, pending, array):
+        """Submit pending runs and resolve their futures with task IDs.
+
+        Args:
+            pending (list): Tuples of run context and future.
+            array (dict): Accounting for the array.
+        """
+        job_ids = None
+
+        try:
+            job_ids = await self._submit_array([ctx for ctx, _ in pending],
+                                               script=self._script,
+                                               limit=array["throttle"])
+        except Exception as e:
+            logging.exception("Could not submit array of {} runs: {}".
+                              format(len(pending), e))
+        finally:
+            # Task IDs can only be matched to runs if there is one per run,
+            # otherwise every run in the array is treated as unsubmitted
+            if job_ids and len(job_ids) != len(pending):
+                logging.error("Array submission returned {} task IDs for {} "
+                              "runs, treating it as failed".
+                              format(len(job_ids), len(pending)))
+                job_ids = None
+
+            if job_ids:
+                array["task"] = job_ids[0]
+                for job_id in job_ids:
+                    self._tasks[str(job_id)] = array
+            else:
+                self._arrays.remove(array)
+
+            for i, (ctx, fut) in enumerate(pending):
+                if not fut.done():
+                    fut.set_result(job_ids[i] if job_ids else None)
+
+            if not job_ids:
+                self._maybe_flush()
+
+    def _raise_throttles(self):
+        """Use free capacity to raise the throttle of submitted arrays."""
+        free = self._free()
+        if not free or not self._throttle_array:
+            return
+
+        for array in self._arrays:
+            if free < 1:
+                break
+            extra = min(free, array["unfinished"] - array["throttle"])
+
+            if array["task"] and extra > 0:
+                array["throttle"] += extra
+                free -= extra
+                asyncio.ensure_future(self._throttle(array))
+
+    async def _throttle(self, array):
+        """Apply the current throttle of an array through the backend.
+
+        Args:
+            array (dict): Accounting for the array.
+        """
+        if self._throttle_lock is None:
+            self._throttle_lock = asyncio.Lock()
+
+        # Serialised, so the last throttle applied is the latest
+        async with self._throttle_lock:
+            try:
+                await self._throttle_array(array["task"], array["throttle"])
+            except Exception as e:
+                logging.warning("Could not raise the throttle of array {} "
+                                "to {}: {}".format(array["task"],
+                                                   array["throttle"], e))
+
+    async def submit(self, ctx):
+        """Add a run to the next array submission.
+
+        Args:
+            ctx (object): Context object for the run.
+
+        Returns:
+            (str): Array task job ID, or None if submission failed.
+        """
+        args = Arguments()
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+
+        self._pending.append((ctx, fut))
+        if self._timer is None and not self._due:
+            self._timer = loop.call_later(args.submit_timeout, self._expire)
+        self._maybe_flush()
+
+        return await fut
+
+    def finished(self, job_id):
+        """Record that a submitted array task has finished.
+
+        Args:
+            job_id (str): Array task job ID returned by ``submit``.
+        """
+        array = self._tasks.pop(str(job_id), None)
+        if not array:
+            return
+
+        array["unfinished"] -= 1
+        if not array["unfinished"]:
+            self._arrays.remove(array)
+
+        self._raise_throttles()
+        self._maybe_flush()
@@ -1,44 +1,88 @@
-import asyncio
+import collections
+import concurrent.futures
+import itertools
 import logging
-import random
+import os
 import subprocess
 import threading
 
-from model_ensembler.cluster import Job, job_lock
-from model_ensembler.utils import Arguments
+from model_ensembler.cluster import \
+    Job, JobCounter, JobPoller, job_lock, submit_limiter
+from model_ensembler.metrics import metrics
 
 
 START_STATES = ("SUBMITTED", "RUNNING")
 FINISH_STATES = ("COMPLETED", "FAILED")
 
 _dict_lock = threading.Lock()
+_executor = None
+_ids = itertools.count(1)
+
+# Jobs by ID, which is the run ID with a submission counter so ensembles
+# sharing a batch name don't collide, and IDs of active jobs by name prefix,
+# which is the batch name
 _jobs = dict()
+_active = collections.defaultdict(set)
+
+
+def _set_job(job_id, state, started, finished):
+    """Record a job state, maintaining the active job index.
+
+    Args:
+        job_id (str): Local job identifier.
+        state (str): Job state.
+        started (bool): Whether the job has started.
+        finished (bool): Whether the job has finished.
+
+    Returns:
+        (object): The recorded Job.
+    """
+    job = Job(job_id, state, started, finished)
+    prefix = job_id.rsplit("-", 1)[0]
+
+    with _dict_lock:
+        _jobs[job_id] = job
 
+        if state in START_STATES:
+            _active[prefix].add(job_id)
+        else:
+            _active[prefix].discard(job_id)
+    return job
 
-def threaded_job(run_dir, script):
-    """Dummy method to set off local job
+
+def threaded_job(job_id, run_dir, script):
+    """Dummy method to run local job on a worker thread
 
     Args:
+        job_id (str): Local job identifier.
         run_dir (str): Directory script is running in.
         script (str): Name of script to run.
     """
-    global _jobs
+    job = _set_job(job_id, "RUNNING", True, False)
+    logging.info("DUMMY RUN: {} - {}".format(run_dir, job))
 
-    with _dict_lock:
-        _jobs[run_dir] = Job(_jobs[run_dir].name,
-                             "RUNNING",
-                             True,
-                             False)
+    try:
+        rc = subprocess.run("./{}".format(script), cwd=run_dir).returncode
+    except OSError as e:
+        logging.exception("Could not run {} in {}: {}".
+                          format(script, run_dir, e))
+        rc = -1
+
+    _set_job(job_id, "COMPLETED" if rc == 0 else "FAILED", True, True)
 
-    logging.info("DUMMY RUN: {} - {}".format(run_dir, _jobs[run_dir]))
-    subprocess.run("./{}".format(script), cwd=run_dir)
 
-    # TODO: failed
+async def find_ids(job_ids):
+    """Dummy method to find many local jobs by ID.
+
+    Args:
+        job_ids (list): Local job identifiers.
+
+    Returns:
+        (dict): Jobs keyed by the string job identifier.
+    """
     with _dict_lock:
-        _jobs[run_dir] = Job(_jobs[run_dir].name,
-                             "COMPLETED",
-                             True,
-                             True)
+        return {str(job_id): _jobs[str(job_id)]
+                for job_id in job_ids if str(job_id) in _jobs}
 
 
 async def find_id(job_id):
@@ -48,22 +92,9 @@ async def find_id(job_id):
         job_id (int): Local job identifier.
 
     Returns:
-        (int): job id.
-
-    Raises:
-        LookupError: If job id not found.
+        (object): Job, or None if not found.
     """
-    global _jobs
-
-    job = None
-    job_arr = [el for el in _jobs.values() if el.name == job_id]
-
-    if len(job_arr) == 1:
-        job = job_arr[0]
-    elif len(job_arr) > 1:
-        raise LookupError("{} jobs found for ID {}".format(len(job_arr),
-                                                           job_id))
-    return job
+    return _jobs.get(str(job_id))
 
 
 async def current_jobs(ctx, match):
@@ -76,11 +107,15 @@ async def current_jobs(ctx, match):
     Returns:
         (list): Current jobs.
     """
-    global _jobs
+    job_arr = list()
 
-    job_arr = [el for el in _jobs.values()
-               if el.name.startswith(match)
-               and el.state in START_STATES]
+    with _dict_lock:
+        for prefix, job_ids in _active.items():
+            if prefix.startswith(match):
+                job_arr.extend(_jobs[job_id] for job_id in job_ids)
+            elif match.startswith(prefix):
+                job_arr.extend(_jobs[job_id] for job_id in job_ids
+                               if job_id.startswith(match))
 
     return job_arr
 
@@ -88,28 +123,33 @@ async def current_jobs(ctx, match):
 async def submit_job(ctx, script=None):
     """Dummy method to submit job locally.
 
+    Jobs are run on a pool of worker threads sized to the local cores, and
+    remain SUBMITTED until a worker is free.
+
     Args:
         ctx (object): Context object for retrieving configuration.
         script (str): Script name to submit.
 
     Returns:
-        (int): Job ID.
+        (str): Job ID.
     """
-    # TODO: ugh, we could use contextvars for this
-    global _jobs
-    args = Arguments()
+    global _executor
 
-    max_submit_sleep = args.max_stagger
-    sleep_for = random.randint(0, max_submit_sleep)
-    logging.debug(
-        "Sleeping for {} seconds before submission".format(sleep_for))
-    await asyncio.sleep(sleep_for)
+    waited = await submit_limiter.acquire()
+    logging.debug("Waited {:.2f} seconds for submission".format(waited))
 
-    with _dict_lock:
-        _jobs[ctx.dir] = Job(ctx.id, "SUBMITTED", False, False)
+    if _executor is None:
+        _executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=os.cpu_count() or 1,
+            thread_name_prefix="dummy")
+
+    job_id = "{}.{}".format(ctx.id, next(_ids))
+    _set_job(job_id, "SUBMITTED", False, False)
+    # Counted here rather than in the worker thread running the job
+    metrics.inc("commands", mode="dummy_job")
+    _executor.submit(threaded_job, job_id, ctx.dir, script)
+    return job_id
 
-    threading.Thread(target=threaded_job, args=(ctx.dir, script)).start()
-    return ctx.id
 
-if __name__ == "__main__":
-    pass
+job_counts = JobCounter(current_jobs)
+poller = JobPoller(find_ids)
@@ -0,0 +1,361 @@
+import asyncio
+import itertools
+import logging
+import os
+import re
+import signal
+
+from model_ensembler.cluster import Job, JobCounter, JobPoller
+from model_ensembler.metrics import metrics
+from model_ensembler.utils import Arguments
+
+"""Local backend
+
+Runs each job file as a subprocess of the ensembler, packing runs onto the
+cores and memory of the local machine using the batch ``ntasks`` and ``mem``
+as the request of each run.
+"""
+
+START_STATES = ("SUBMITTED", "RUNNING")
+FINISH_STATES = ("COMPLETED", "FAILED")
+
+# Seconds a cancelled job has to exit after SIGTERM before it is killed
+TERMINATE_TIMEOUT = 10
+
+r_memory = re.compile(r'^\s*([0-9.]+)\s*([KMGT]?)B?\s*$', re.IGNORECASE)
+
+_ids = itertools.count(1)
+_jobs = dict()
+_names = dict()
+_tasks = dict()
+_slots = None
+
+
+def parse_memory(value):
+    """Convert a memory request into megabytes.
+
+    Plain numbers are megabytes, as with ``sbatch --mem``, and strings may
+    carry a K, M, G or T suffix.
+
+    Args:
+        value (int|float|str): Memory request.
+
+    Returns:
+        (float): Memory in megabytes, or None if no value was given.
+
+    Raises:
+        ValueError: If the value cannot be interpreted.
+    """
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+
+    match = r_memory.match(str(value))
+    if not match:
+        raise ValueError("Cannot interpret memory request {}".format(value))
+
+    size, unit = match.groups()
+    scale = {"K": 1. / 1024, "": 1., "M": 1.,
+             "G": 1024., "T": 1024. ** 2}[unit.upper()]
+    return float(size) * scale
+
+
+def _available_memory():
+    """Determine the memory available to runs in megabytes.
+
+    Returns:
+        (float): Available memory, or None if it cannot be determined.
+    """
+    try:
+        with open("/proc/meminfo", "r") as fh:
+            for line in fh:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024.
+    except OSError:
+        pass
+
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * \
+            os.sysconf("SC_AVPHYS_PAGES") / 1024. ** 2
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def _available_cores():
+    """Determine the number of cores available to runs.
+
+    Returns:
+        (int): Number of cores.
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+class SlotScheduler(object):
+    """Packs requests for cores and memory onto a fixed capacity.
+
+    Whenever capacity is released every waiting request that now fits is
+    started, so smaller runs backfill around larger ones rather than queueing
+    behind them.
+
+    Args:
+        cores (int): Number of cores available.
+        memory (float, optional): Megabytes available, or None to not
+            schedule on memory.
+    """
+
+    def __init__(self, cores, memory=None):
+        self.cores = max(int(cores), 1)
+        self.memory = memory
+        self._used_cores = 0
+        self._used_memory = 0.
+        self._cond = None
+        self._loop = None
+
+    def _condition(self):
+        """Retrieve the condition for the running event loop.
+
+        Conditions bind to the loop they are first used on before Python
+        3.10, so the scheduler, which outlives any one loop, makes one per
+        loop.
+
+        Returns:
+            (object): asyncio.Condition guarding the capacity.
+        """
+        loop = asyncio.get_running_loop()
+
+        if self._loop is not loop:
+            self._cond = asyncio.Condition()
+            self._loop = loop
+        return self._cond
+
+    def _fits(self, cores, memory):
+        if self._used_cores + cores > self.cores:
+            return False
+        if self.memory is not None and memory and \
+                self._used_memory + memory > self.memory:
+            return False
+        return True
+
+    def clamp(self, cores, memory=None):
+        """Limit a request to the capacity so that it can ever be started.
+
+        Args:
+            cores (int): Requested cores.
+            memory (float, optional): Requested megabytes.
+
+        Returns:
+            (tuple): Cores and memory that will be requested.
+        """
+        cores = max(int(cores or 1), 1)
+
+        if cores > self.cores:
+            logging.warning("Request for {} cores exceeds the {} available, "
+                            "limiting to {}".format(cores, self.cores,
+                                                    self.cores))
+            cores = self.cores
+        if memory and self.memory is not None and memory > self.memory:
+            logging.warning("Request for {:.0f}MB exceeds the {:.0f}MB "
+                            "available, limiting to {:.0f}MB".
+                            format(memory, self.memory, self.memory))
+            memory = self.memory
+        return cores, memory
+
+    async def acquire(self, cores, memory=None):
+        """Wait for and take capacity.
+
+        Args:
+            cores (int): Cores to take, see ``clamp``.
+            memory (float, optional): Megabytes to take.
+        """
+        cond = self._condition()
+
+        async with cond:
+            await cond.wait_for(lambda: self._fits(cores, memory))
+            self._used_cores += cores
+            self._used_memory += memory or 0.
+
+    async def release(self, cores, memory=None):
+        """Return capacity, starting any waiting requests that now fit.
+
+        Args:
+            cores (int): Cores to return.
+            memory (float, optional): Megabytes to return.
+        """
+        cond = self._condition()
+
+        async with cond:
+            self._used_cores -= cores
+            self._used_memory -= memory or 0.
+            cond.notify_all()
+
+
+def _get_slots():
+    """Create the scheduler for this machine on first use.
+
+    Returns:
+        (object): SlotScheduler for the local machine.
+    """
+    global _slots
+
+    if _slots is None:
+        args = Arguments()
+        cores = args.local_cores or _available_cores()
+        memory = parse_memory(args.local_memory) \
+            if args.local_memory else _available_memory()
+
+        logging.info("Local backend scheduling on {} cores{}".format(
+            cores, " and {:.0f}MB".format(memory) if memory else ""))
+        _slots = SlotScheduler(cores, memory)
+    return _slots
+
+
+def _set_job(job_id, name, state):
+    """Record the state of a local job for the poller.
+
+    Args:
+        job_id (str): Local job identifier.
+        name (str): Job name, the run ID.
+        state (str): Job state, see START_STATES and FINISH_STATES.
+    """
+    _jobs[job_id] = Job(name, state,
+                        state != "SUBMITTED", state in FINISH_STATES)
+
+
+async def _terminate(proc):
+    """Terminate a job's process group and wait for it to exit.
+
+    Jobs are sent SIGTERM, and killed if they have not exited within
+    TERMINATE_TIMEOUT seconds.
+
+    Args:
+        proc (object): asyncio.subprocess.Process started in its own session.
+    """
+    logging.warning("Terminating local job process {}".format(proc.pid))
+
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.killpg(proc.pid, sig)
+        except ProcessLookupError:
+            pass
+
+        try:
+            await asyncio.wait_for(proc.wait(), TERMINATE_TIMEOUT)
+        except asyncio.TimeoutError:
+            continue
+        return
+
+
+async def _run_job(job_id, ctx, script):
+    """Wait for slots and run a job file to completion.
+
+    Args:
+        job_id (str): Local job identifier.
+        ctx (object): Context object for the run.
+        script (str): Name of script to run in the run directory.
+    """
+    slots = _get_slots()
+    cores, memory = slots.clamp(getattr(ctx, "ntasks", None),
+                                parse_memory(getattr(ctx, "mem", None)))
+
+    await slots.acquire(cores, memory)
+    _set_job(job_id, ctx.id, "RUNNING")
+    logging.info("LOCAL RUN: {} on {} cores{} - job {}".format(
+        ctx.dir, cores, " with {:.0f}MB".format(memory) if memory else "",
+        job_id))
+
+    rc = -1
+    proc = None
+    try:
+        with open(os.path.join(ctx.dir, "local-{}.out".format(job_id)),
+                  "wb") as out:
+            metrics.inc("commands", mode="local_job")
+            # In its own session, so the job and its children can be
+            # terminated together
+            proc = await asyncio.create_subprocess_exec(
+                "./{}".format(script), cwd=ctx.dir,
+                stdout=out, stderr=asyncio.subprocess.STDOUT,
+                start_new_session=True,
+                env=dict(os.environ,
+                         ME_JOB_ID=job_id,
+                         ME_NTASKS=str(cores),
+                         OMP_NUM_THREADS=os.environ.get("OMP_NUM_THREADS",
+                                                        str(cores))))
+            rc = await proc.wait()
+    except OSError as e:
+        logging.exception("Could not run {} in {}: {}".
+                          format(script, ctx.dir, e))
+    finally:
+        # Cancelled, such as at shutdown or on a batch failure, whilst the
+        # job is running, so we don't leave it orphaned
+        if proc is not None and proc.returncode is None:
+            await _terminate(proc)
+        _set_job(job_id, ctx.id, "COMPLETED" if rc == 0 else "FAILED")
+        _names.pop(job_id, None)
+        _tasks.pop(job_id, None)
+        await slots.release(cores, memory)
+
+
+async def find_ids(job_ids):
+    """Find many local jobs by ID.
+
+    Args:
+        job_ids (list): Local job identifiers.
+
+    Returns:
+        (dict): Jobs keyed by the string job identifier.
+    """
+    return {str(job_id): _jobs[str(job_id)]
+            for job_id in job_ids if str(job_id) in _jobs}
+
+
+async def find_id(job_id):
+    """Find a local job by ID.
+
+    Args:
+        job_id (int|str): Local job identifier.
+
+    Returns:
+        (object): Job, or None if not found.
+    """
+    return _jobs.get(str(job_id))
+
+
+async def current_jobs(ctx, match):
+    """Find waiting and running local jobs.
+
+    Args:
+        ctx (object): Context object for retrieving configuration.
+        match (str): Name prefix to match jobs with.
+
+    Returns:
+        (list): Current jobs, as dicts of id, name and state.
+    """
+    return [{"id": job_id, "name": name, "state": _jobs[job_id].state}
+            for job_id, name in list(_names.items())
+            if name.startswith(match)]
+
+
+async def submit_job(ctx, script=None):
+    """Start a job locally once there are cores and memory for it.
+
+    Args:
+        ctx (object): Context object for retrieving configuration.
+        script (str): Script name to run.
+
+    Returns:
+        (str): Job ID.
+    """
+    job_id = str(next(_ids))
+
+    _set_job(job_id, ctx.id, "SUBMITTED")
+    _names[job_id] = ctx.id
+    _tasks[job_id] = asyncio.ensure_future(_run_job(job_id, ctx, script))
+    return job_id
+
+
+job_counts = JobCounter(current_jobs)
+poller = JobPoller(find_ids)
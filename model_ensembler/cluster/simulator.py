@@ -0,0 +1,53 @@
+import atexit
+import logging
+import os
+import shutil
+import tempfile
+
+from model_ensembler import simulator
+from model_ensembler.cluster import JobCounter, JobPoller
+from model_ensembler.cluster.slurm import \
+    START_STATES, FINISH_STATES, current_jobs, find_id, find_ids, \
+    job_lock, submit_array, submit_job
+
+"""Simulated SLURM backend
+
+The SLURM backend driven against the stand-in commands from
+``model_ensembler.simulator``. The commands are installed into
+``ME_SIM_BIN`` (or a temporary directory) when an ensemble first uses the
+backend, and are searched first for the commands of that ensemble only, see
+``utils.command_path_ctx``.
+"""
+
+__all__ = [
+    "START_STATES", "FINISH_STATES",
+    "command_path", "current_jobs", "find_id", "find_ids", "job_counts",
+    "job_lock", "poller",
+    "submit_array", "submit_job",
+]
+
+_bin_dir = None
+
+
+def command_path():
+    """Install the stand-in SLURM commands on first use.
+
+    Returns:
+        (str): Directory containing the commands.
+    """
+    global _bin_dir
+
+    if _bin_dir is None:
+        bin_dir = os.environ.get("ME_SIM_BIN")
+
+        if not bin_dir:
+            bin_dir = tempfile.mkdtemp(prefix="model_ensembler.sim.")
+            atexit.register(shutil.rmtree, bin_dir, ignore_errors=True)
+
+        _bin_dir = simulator.install(bin_dir)
+        logging.info("Simulating SLURM with commands in {}".format(_bin_dir))
+    return _bin_dir
+
+
+job_counts = JobCounter(current_jobs)
+poller = JobPoller(find_ids)
@@ -1,13 +1,15 @@
 import asyncio
 import logging
-import random
+import os
 import re
 
 from pprint import pformat
 
 from model_ensembler.tasks.utils import execute_command
-from model_ensembler.cluster import Job, job_lock
-from model_ensembler.utils import Arguments
+from model_ensembler.cluster import \
+    Job, JobCounter, JobPoller, job_lock, submit_limiter
+from model_ensembler.metrics import metrics
+from model_ensembler.utils import Arguments, run_io
 
 START_STATES = ("COMPLETING", "PENDING", "RESV_DEL_HOLD", "RUNNING",
                 "SUSPENDED", "CONFIGURING", "REQUEUE_FED", "REQUEUE_HOLD",
@@ -16,42 +18,111 @@ START_STATES = ("COMPLETING", "PENDING", "RESV_DEL_HOLD", "RUNNING",
 FINISH_STATES = ("COMPLETED", "FAILED", "CANCELLED", "OUT_OF_MEMORY",
                  "DEADLINE", "NODE_FAIL", "PREEMPTED", "TIMEOUT")
 
+# Keep sacct command lines to a sensible length for very large ensembles
+SACCT_CHUNK = 1000
+
+# Directives that are set per array rather than taken from the run job file
+r_array_excluded = re.compile(
+    r'^#SBATCH\s+(--job-name|-J|--array|-a|--output|-o|--error|-e|'
+    r'--chdir|-D)\b')
+r_array_range = re.compile(r'^(\d+)_\[([0-9,\-]+)(?:%\d+)?\]$')
+r_sbatch_id = re.compile(r'Submitted batch job (\d+)$')
+
+
+def _expand_job_ids(job_id):
+    """Expand a sacct job ID, including pending array task ranges.
+
+    Pending array tasks are reported by sacct as a single record such as
+    ``123_[4-9%2]``, which is expanded to the individual task IDs.
+
+    Args:
+        job_id (str): Job ID field from sacct.
+
+    Returns:
+        (list): Individual job IDs.
+    """
+    array_match = r_array_range.match(job_id)
+    if not array_match:
+        return [job_id]
+
+    base_id, ranges = array_match.groups()
+    job_ids = list()
+
+    for task_range in ranges.split(","):
+        bounds = task_range.split("-")
+        for task_id in range(int(bounds[0]), int(bounds[-1]) + 1):
+            job_ids.append("{}_{}".format(base_id, task_id))
+    return job_ids
+
+
+async def find_ids(job_ids):
+    """Method to find many SLURM jobs by ID with a single sacct call.
+
+    Array tasks (``<job>_<task>``) are queried via their array job, so that
+    tasks still pending as part of the array record are also resolved.
+
+    Args:
+        job_ids (list): SLURM job identifiers.
+
+    Returns:
+        jobs (dict): Job objects, including name and state, keyed by the
+            string job identifier. Jobs not yet known to SLURM are omitted.
+    """
+    jobs = dict()
+    query_ids = sorted(set(str(job_id).split("_")[0] for job_id in job_ids))
+
+    for i in range(0, len(query_ids), SACCT_CHUNK):
+        metrics.inc("scheduler_calls", command="sacct")
+        res = await execute_command("sacct -XnP -j {} "
+                                    "-o jobid,jobname,state,start,end".
+                                    format(",".join(
+                                        query_ids[i:i + SACCT_CHUNK])),
+                                    limit=None)
+
+        for line in res.stdout.decode().splitlines():
+            try:
+                (job_id, name, state, started, finished) = \
+                    line.strip().split("|")
+            except ValueError:
+                logging.debug("Could not parse sacct line: {}".format(line))
+                continue
+
+            job = Job(
+                name=name,
+                state=state.split()[0],
+                started=started == "Unknown",
+                finished=finished == "Unknown"
+            )
+            for expanded_id in _expand_job_ids(job_id):
+                jobs[expanded_id] = job
+
+    logging.debug("SLURM find result for {} jobs: {} found".
+                  format(len(job_ids), len(jobs)))
+    return jobs
+
 
 async def find_id(job_id):
     """Method to find SLURM job by ID.
 
-    This method provides an interface to the squeue SLURM queue utility to
-    identify a job and return it along with it's state.
+    This method provides an interface to the sacct SLURM accounting utility
+    to identify a job and return it along with it's state.
 
     Args:
         job_id (int): SLURM job identifier.
 
     Returns:
-        jobs (list): Job objects including name and state.
-
-    Raises:
-        ValueError: If cannot retrieve job from list.
+        job (object): Job object including name and state.
     """
     job = None
     args = Arguments()
 
     while not job:
-        try:
-            res = await execute_command("sacct -XnP -j {} "
-                                        "-o jobname,state,start,end".
-                                        format(job_id))
-            output = res.stdout.decode().strip()
-            (name, state, started, finished) = output.split("|")
-        except ValueError:
+        jobs = await find_ids([job_id])
+        job = jobs.get(str(job_id))
+
+        if not job:
             logging.debug("Could not retrieve job from list")
             await asyncio.sleep(args.check_timeout)
-        else:
-            job = Job(
-                name=name,
-                state=state.split()[0],
-                started=started == "Unknown",
-                finished=finished == "Unknown"
-            )
 
     logging.debug("SLURM find result name: {}".format(job.name))
     return job
@@ -72,9 +143,10 @@ async def current_jobs(ctx, match):
     # Ensure we account for empty lists
     while not filtered_jobs and filtered_jobs is None:
         try:
-            res = await execute_command("squeue -o \"%j,%T\" -h -p {}".
+            metrics.inc("scheduler_calls", command="squeue")
+            res = await execute_command("squeue -o \"%i,%j,%T\" -h -p {}".
                                         format(ctx.cluster),
-                                        cwd=ctx.dir)
+                                        cwd=ctx.dir, limit=None)
             output = res.stdout.decode()
         except Exception as e:
             logging.warning("Could not retrieve list: {}".format(e))
@@ -82,9 +154,11 @@ async def current_jobs(ctx, match):
             jobs = []
             for line in output.split():
                 fields = line.strip().split(",")
-                jobs.append({"name": fields[0], "job_state": fields[1]})
+                jobs.append({"id": fields[0], "name": fields[1],
+                             "job_state": fields[2]})
 
-            filtered_jobs = [{"name": j['name'], "state": j["job_state"]}
+            filtered_jobs = [{"id": j['id'], "name": j['name'],
+                              "state": j["job_state"]}
                              for j in jobs
                              if j['name'].startswith(match)
                              and j['job_state'] in START_STATES]
@@ -105,15 +179,11 @@ async def submit_job(ctx, script=None):
     Returns:
         (int): Job ID.
     """
-    r_sbatch_id = re.compile(r'Submitted batch job (\d+)$')
-    args = Arguments()
+    # Don't smash the scheduler, all submissions share a rate limit
+    waited = await submit_limiter.acquire()
+    logging.debug("Waited {:.2f} seconds for submission".format(waited))
 
-    # Don't smash the scheduler immediately, it appears to have the potential
-    # to cause problems.
-    sleep_for = random.randint(0, args.max_stagger)
-    logging.debug(
-        "Sleeping for {} seconds before submission".format(sleep_for))
-    await asyncio.sleep(sleep_for)
+    metrics.inc("scheduler_calls", command="sbatch")
     res = await execute_command("sbatch --no-requeue {}".format(script),
                                 cwd=ctx.dir)
     output = res.stdout.decode()
@@ -125,3 +195,116 @@ async def submit_job(ctx, script=None):
 
         return int(job_id)
     return None
+
+
+def _write_array_script(ctxs, script, stem):
+    """Write the wrapper script and run directory list for a job array.
+
+    Args:
+        ctxs (list): Context objects for the runs, in array task order.
+        script (str): Script name to execute within each run directory.
+        stem (str): Path, without extension, of the files to write.
+
+    Returns:
+        (str): Path of the wrapper script.
+    """
+    dirs_file = "{}.dirs".format(stem)
+    array_script = "{}.sh".format(stem)
+
+    directives = list()
+    with open(os.path.join(ctxs[0].dir, script), "r") as fh:
+        for line in fh:
+            if line.strip() and not line.startswith("#"):
+                break
+            if line.startswith("#SBATCH") and \
+                    not r_array_excluded.match(line):
+                directives.append(line.rstrip("\n"))
+
+    with open(dirs_file, "w") as fh:
+        fh.write("".join("{}\n".format(ctx.dir) for ctx in ctxs))
+
+    with open(array_script, "w") as fh:
+        fh.write("\n".join([
+            "#!/bin/bash",
+            *directives,
+            "#SBATCH --job-name={}".format(ctxs[0].name),
+            "#SBATCH --output={}.%A_%a.out".format(stem),
+            "",
+            "RUN_DIR=\"$(sed -n \"$((SLURM_ARRAY_TASK_ID + 1))p\" {})\"".
+            format(dirs_file),
+            "cd \"$RUN_DIR\" || exit 1",
+            "exec >\"slurm-${SLURM_ARRAY_JOB_ID}_${SLURM_ARRAY_TASK_ID}.out\" "
+            "2>&1",
+            "if [ -x {0} ]; then exec ./{0}; else exec bash ./{0}; fi".
+            format(script),
+            ""]))
+    return array_script
+
+
+async def submit_array(ctxs, script=None, limit=None):
+    """Method to submit a set of runs to SLURM as a single job array.
+
+    A wrapper script is written alongside the run directories, on the I/O
+    pool, carrying the #SBATCH directives from the first run's job file,
+    which maps each array task ID to its run directory and executes the job
+    file from there.
+
+    Args:
+        ctxs (list): Context objects for the runs, in array task order.
+        script (str): Script name to execute within each run directory.
+        limit (int, optional): Maximum number of simultaneously running
+            array tasks.
+
+    Returns:
+        (list): Array task job IDs in the same order as ctxs, or None.
+    """
+    base_dir = os.path.dirname(ctxs[0].dir)
+    stem = os.path.join(base_dir,
+                        "{}.array.{}".format(ctxs[0].name, ctxs[0].idx))
+    array_script = await run_io(_write_array_script, ctxs, script, stem)
+
+    array_spec = "0-{}".format(len(ctxs) - 1)
+    if limit:
+        array_spec += "%{}".format(int(limit))
+
+    waited = await submit_limiter.acquire()
+    logging.debug("Waited {:.2f} seconds for submission".format(waited))
+
+    metrics.inc("scheduler_calls", command="sbatch")
+    res = await execute_command("sbatch --no-requeue --array={} {}".
+                                format(array_spec, array_script),
+                                cwd=base_dir)
+    output = res.stdout.decode()
+
+    sbatch_match = r_sbatch_id.match(output)
+    if sbatch_match:
+        job_id = sbatch_match.group(1)
+        logging.info("Submitted array job with ID {} for {} runs".
+                     format(job_id, len(ctxs)))
+
+        return ["{}_{}".format(job_id, i) for i in range(len(ctxs))]
+    return None
+
+
+async def throttle_array(job_id, limit):
+    """Method to change the number of simultaneously running array tasks.
+
+    Args:
+        job_id (str): Job ID of any task of the array.
+        limit (int): Maximum number of simultaneously running array tasks.
+    """
+    array_id = str(job_id).split("_")[0]
+
+    metrics.inc("scheduler_calls", command="scontrol")
+    res = await execute_command("scontrol update JobId={} "
+                                "ArrayTaskThrottle={}".
+                                format(array_id, int(limit)))
+
+    if res.returncode != 0:
+        raise RuntimeError("Could not throttle array {}: {}".
+                           format(array_id, res.stdout.decode().strip()))
+    logging.debug("Throttled array {} to {} tasks".format(array_id, limit))
+
+
+job_counts = JobCounter(current_jobs)
+poller = JobPoller(find_ids)
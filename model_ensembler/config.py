@@ -1,10 +1,16 @@
 import collections
+import hashlib
 import json
 import logging
 import os
+import pickle
+import tempfile
 
 import jsonschema
 
+from model_ensembler import __version__
+from model_ensembler.sweep import expand_sweep, sweep_size
+
 from yaml import load
 try:
     from yaml import CLoader as Loader
@@ -19,30 +25,57 @@ Contains classes, handlers and types relating to configuration of ensembles.
 
 path = os.path.abspath(os.path.dirname(__file__))
 
+_validators = dict()
+
+
+def get_validator(json_data):
+    """Retrieve a compiled validator for a JSON schema.
+
+    Args:
+        json_data (dict): JSON schema.
+
+    Returns:
+        (object): jsonschema validator, created once per schema.
+    """
+    key = json.dumps(json_data, sort_keys=True)
+
+    if key not in _validators:
+        cls = jsonschema.validators.validator_for(json_data)
+        cls.check_schema(json_data)
+        _validators[key] = cls(json_data)
+    return _validators[key]
+
 
-# TODO: Would like very much for some kind of itertools interactions to
-#  generate parameter setups
 class YAMLConfig():
     """Configuration processor for model-ensemble YAML-based configurations.
 
     Args:
         configuration (str): Name of the YAML configuration to load.
+        cache_dir (str, optional): Directory caching validated
+            configurations, see ``validate``.
     """
 
-    def __init__(self, configuration):
+    def __init__(self, configuration, cache_dir=None):
         self._schema = os.path.join(path, "model-ensemble.json")
         self._configuration_file = configuration
 
         self._schema_data, self._data = \
-            self.__class__.validate(self._schema, self._configuration_file)
+            self.__class__.validate(self._schema, self._configuration_file,
+                                    cache_dir=cache_dir)
 
     @staticmethod
-    def validate(json_schema, yaml_file):
+    def validate(json_schema, yaml_file, cache_dir=None):
         """Validate a YAML configuration against a JSON schema.
 
+        If a cache directory is given, the merged and validated configuration
+        is stored there keyed by a hash of the YAML and schema, and loaded
+        from there rather than being parsed and validated again while
+        neither changes.
+
         Args:
             json_schema (str): Name of schema to validate against.
             yaml_file (str): Name of the configuration to validate.
+            cache_dir (str, optional): Directory for cached configurations.
 
         Returns:
             (tuple): contains JSON schema, YAML data.
@@ -55,8 +88,36 @@ class YAMLConfig():
             json_schema, yaml_file
         ))
 
-        with open(yaml_file, "r") as fh:
-            yaml_data = load(fh, Loader=Loader)
+        with open(yaml_file, "rb") as fh:
+            yaml_raw = fh.read()
+
+        with open(json_schema, "rb") as fh:
+            json_raw = fh.read()
+
+        cache_file = None
+        if cache_dir:
+            # The version is included as merging may change between releases
+            digest = hashlib.sha256(__version__.encode())
+            for data in (json_raw, yaml_raw):
+                digest.update(hashlib.sha256(data).digest())
+
+            cache_file = os.path.join(cache_dir, "{}.pickle".
+                                      format(digest.hexdigest()))
+            try:
+                with open(cache_file, "rb") as fh:
+                    json_data, yaml_data = pickle.load(fh)
+
+                logging.info("Loaded validated configuration {} from {}".
+                             format(yaml_file, cache_file))
+                return json_data, yaml_data
+            except FileNotFoundError:
+                pass
+            except (OSError, pickle.UnpicklingError, EOFError,
+                    ValueError, TypeError) as e:
+                logging.warning("Ignoring unreadable configuration cache "
+                                "{}: {}".format(cache_file, e))
+
+        yaml_data = load(yaml_raw, Loader=Loader)
 
         # FIXME: this is a cheat for extreme batch numbers by allowing common
         #  parameters
@@ -73,23 +134,34 @@ class YAMLConfig():
                     if k not in batch:
                         batch[k] = v
 
-        with open(json_schema, "r") as fh:
-            json_data = json.load(fh)
+        json_data = json.loads(json_raw)
 
-        try:
-            jsonschema.validate(instance=yaml_data, schema=json_data)
-        except jsonschema.ValidationError as e:
+        error = jsonschema.exceptions.best_match(
+            get_validator(json_data).iter_errors(yaml_data))
+        if error:
             logging.error("There's an error with configuration file: {}".
                           format(yaml_file))
-            raise e
+            raise error
         logging.info("Validated configuration file {} successfully".
                      format(yaml_file))
+
+        if cache_file:
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                with tempfile.NamedTemporaryFile(dir=cache_dir, delete=False,
+                                                 suffix=".tmp") as fh:
+                    pickle.dump((json_data, yaml_data), fh,
+                                protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(fh.name, cache_file)
+            except OSError as e:
+                logging.warning("Could not cache validated configuration in "
+                                "{}: {}".format(cache_dir, e))
         return json_data, yaml_data
 
 
 TaskSpec = collections.namedtuple('Task',
-                                  ['name', 'args', 'value'])
-TaskSpec.__new__.__defaults__ = (None, None)
+                                  ['name', 'args', 'value', 'id', 'after'])
+TaskSpec.__new__.__defaults__ = (None, None, None, None)
 
 
 class Task(TaskSpec):
@@ -132,6 +204,7 @@ class EnsembleConfig(YAMLConfig, TaskArrayMixin):
         self._pre_process = self._data['ensemble']['pre_process']
         self._post_process = self._data['ensemble']['post_process']
         self._batches = self._data['ensemble']['batches']
+        self._maxjobs = self._data['ensemble'].get('maxjobs', 0)
 
     @property
     def pre_process(self):
@@ -172,22 +245,36 @@ class EnsembleConfig(YAMLConfig, TaskArrayMixin):
         """
         return self._vars
 
+    @property
+    def maxjobs(self):
+        """ Property decorator managing the ensemble wide job limit.
+
+        Returns:
+            (int): Maximum number of jobs in flight across all batches, or 0
+                if unlimited.
+        """
+        return self._maxjobs
+
 
 BatchSpec = collections.namedtuple("Batch",
                                    ["name", "templates", "templatedir",
                                     "job_file", "basedir",
                                     "runs", "maxruns", "maxjobs", "repeat",
+                                    "array", "maxtasks", "prepare", "sweep",
+                                    "depends_on",
                                     # Slurm
                                     "cluster", "email", "nodes", "ntasks",
-                                    "length",
+                                    "length", "mem",
                                     # Tasks
                                     "pre_batch", "pre_run", "post_run",
                                     "post_batch"])
 BatchSpec.__new__.__defaults__ = (None, [], None,
                                   None, None,
                                   [], 0, 0, False,
-                                  None, None, None, None,
+                                  False, None, None, None,
                                   None,
+                                  None, None, None, None,
+                                  None, None,
                                   [], [], [], [])
 
 
@@ -246,3 +333,27 @@ class Batch(BatchSpec, TaskArrayMixin):
             (list): Post batch tasks.
         """
         return self.task_array("_post_batch")
+
+    @property
+    def run_count(self):
+        """ Property decorator for the number of runs in the batch.
+
+        Returns:
+            (int): Number of listed runs plus those generated by the sweep.
+        """
+        return len(self.runs) + (sweep_size(self.sweep) if self.sweep else 0)
+
+    def iter_runs(self):
+        """Lazily generate the runs of the batch.
+
+        Listed runs come first, followed by those generated by the sweep, if
+        one is specified. Each run is a new dictionary.
+
+        Yields:
+            (dict): Variables for a run.
+        """
+        for run in self.runs:
+            yield dict(run)
+
+        if self.sweep:
+            yield from expand_sweep(self.sweep)
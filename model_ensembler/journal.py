@@ -0,0 +1,151 @@
+import collections
+import logging
+import os
+import sqlite3
+import time
+
+"""Run journal module
+
+Records the progress of every run in a SQLite database under the batch base
+directory, so that an interrupted ensemble can resume exactly where it left
+off rather than relying on picking up, skipping or indexing runs by hand.
+"""
+
+JOURNAL_NAME = ".model_ensemble.journal"
+
+# Phases a run completes, in order
+PHASES = ("started", "templated", "pre_run", "submitted", "finished",
+          "post_run")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    batch TEXT NOT NULL,
+    cycle INTEGER NOT NULL,
+    idx INTEGER NOT NULL,
+    id TEXT NOT NULL,
+    phase TEXT NOT NULL,
+    job_id TEXT,
+    job_state TEXT,
+    updated REAL NOT NULL,
+    PRIMARY KEY (batch, cycle, idx)
+);
+CREATE TABLE IF NOT EXISTS transitions (
+    batch TEXT NOT NULL,
+    cycle INTEGER NOT NULL,
+    idx INTEGER NOT NULL,
+    phase TEXT NOT NULL,
+    job_id TEXT,
+    job_state TEXT,
+    time REAL NOT NULL
+);
+"""
+
+JournalEntry = collections.namedtuple("JournalEntry",
+                                      ["phase", "job_id", "job_state"])
+
+_journals = dict()
+
+
+def get_journal(basedir):
+    """Retrieve the journal for a base directory, opening it if necessary.
+
+    Args:
+        basedir (str): Base directory of a batch.
+
+    Returns:
+        (object): RunJournal shared by every batch in the directory.
+    """
+    path = os.path.join(os.path.abspath(basedir), JOURNAL_NAME)
+
+    if path not in _journals:
+        _journals[path] = RunJournal(path)
+    return _journals[path]
+
+
+def close_journals():
+    """Close every open journal."""
+    for journal in _journals.values():
+        journal.close()
+    _journals.clear()
+
+
+class RunJournal(object):
+    """Journal of run phases, job IDs and job states for a base directory.
+
+    Every transition is appended to ``transitions`` and the latest state of
+    each run kept in ``runs``, keyed by batch name, batch cycle and run
+    index. The database is in WAL mode without syncing every commit, so
+    recording a transition is cheap and survives the process crashing.
+
+    Args:
+        path (str): Database file.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._conn = sqlite3.connect(path, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def entry(self, batch, cycle, idx):
+        """Retrieve the latest state of a run.
+
+        Args:
+            batch (str): Batch name.
+            cycle (int): Batch cycle, see ``repeat``.
+            idx (int): Run index.
+
+        Returns:
+            (object): JournalEntry, or None if the run has not been recorded.
+        """
+        row = self._conn.execute(
+            "SELECT phase, job_id, job_state FROM runs "
+            "WHERE batch = ? AND cycle = ? AND idx = ?",
+            (batch, cycle, idx)).fetchone()
+        return JournalEntry(*row) if row else None
+
+    def record(self, run, phase, job_id=None, job_state=None):
+        """Record a run reaching a phase or its job changing state.
+
+        Args:
+            run (object): Specific run configuration.
+            phase (str): One of ``PHASES``.
+            job_id (int|str, optional): Job identifier, kept from earlier
+                transitions if not given.
+            job_state (str, optional): Scheduler state of the job.
+        """
+        if phase not in PHASES:
+            raise ValueError("Unknown run phase {}".format(phase))
+
+        job_id = str(job_id) if job_id else None
+        key = (run.name, run.batch_idx, run.idx)
+        now = time.time()
+
+        logging.debug("Journal {} for {}: {} {} {}".format(
+            self._path, run.id, phase, job_id, job_state))
+
+        with self._conn:
+            self._conn.execute("BEGIN")
+            row = self._conn.execute(
+                "SELECT job_id, job_state FROM runs "
+                "WHERE batch = ? AND cycle = ? AND idx = ?", key).fetchone()
+
+            # A new job replaces the earlier job and its state, otherwise
+            # they're kept unless superseded. Merged here rather than with
+            # an upsert, which requires SQLite 3.24
+            run_job_id, run_job_state = job_id, job_state
+            if row and not job_id:
+                run_job_id = row[0]
+                run_job_state = job_state if job_state else row[1]
+
+            self._conn.execute(
+                "INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                key + (run.id, phase, run_job_id, run_job_state, now))
+            self._conn.execute(
+                "INSERT INTO transitions VALUES (?, ?, ?, ?, ?, ?, ?)",
+                key + (phase, job_id, job_state, now))
+
+    def close(self):
+        """Close the database."""
+        self._conn.close()
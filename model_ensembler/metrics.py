@@ -0,0 +1,273 @@
+import asyncio
+import collections
+import contextlib
+import json
+import logging
+import os
+import tempfile
+import time
+
+"""Metrics module
+
+Collects counters and per-phase timings as an ensemble runs, exporting them
+as a Prometheus node-exporter textfile and a JSON summary per batch.
+"""
+
+PREFIX = "model_ensembler"
+TEXTFILE_NAME = "{}.prom".format(PREFIX)
+SUMMARY_NAME = "{}.json".format(PREFIX)
+
+
+def _escape(value):
+    """Escape a Prometheus label value.
+
+    Args:
+        value (object): Label value.
+
+    Returns:
+        (str): Escaped value.
+    """
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").\
+        replace("\n", "\\n")
+
+
+def _labels(labels):
+    """Format labels for a Prometheus sample.
+
+    Args:
+        labels (tuple): Pairs of label names and values.
+
+    Returns:
+        (str): Label set, empty if there are no labels.
+    """
+    if not labels:
+        return ""
+    return "{{{}}}".format(",".join("{}=\"{}\"".format(k, _escape(v))
+                                    for k, v in labels))
+
+
+def _write(path, data):
+    """Write a file atomically, so readers never see it partially written.
+
+    Args:
+        path (str): File to write.
+        data (str): Contents.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+
+    with tempfile.NamedTemporaryFile("w", dir=directory, delete=False,
+                                     prefix=".", suffix=".tmp") as fh:
+        fh.write(data)
+    os.chmod(fh.name, 0o644)
+    os.replace(fh.name, path)
+
+
+class Metrics(object):
+    """Counters and timers, identified by name and labels.
+
+    Timers keep the count, sum, minimum and maximum of their observations
+    rather than every observation, so memory does not grow with the number
+    of runs.
+    """
+
+    def __init__(self):
+        self._counters = collections.defaultdict(float)
+        self._timers = dict()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, amount=1, **labels):
+        """Increment a counter.
+
+        Args:
+            name (str): Counter name.
+            amount (int|float, optional): Amount to add.
+            **labels: Labels identifying the counter.
+        """
+        self._counters[self._key(name, labels)] += amount
+
+    def observe(self, name, seconds, **labels):
+        """Record a duration.
+
+        Args:
+            name (str): Timer name.
+            seconds (float): Duration.
+            **labels: Labels identifying the timer.
+        """
+        key = self._key(name, labels)
+        stats = self._timers.get(key)
+
+        if stats is None:
+            self._timers[key] = [1, seconds, seconds, seconds]
+        else:
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = min(stats[2], seconds)
+            stats[3] = max(stats[3], seconds)
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """Time a block of code, including any time spent awaiting.
+
+        Args:
+            name (str): Timer name.
+            **labels: Labels identifying the timer.
+        """
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - start, **labels)
+
+    def timers(self, name):
+        """Retrieve the statistics of a timer for each set of labels.
+
+        Args:
+            name (str): Timer name.
+
+        Returns:
+            (list): Tuples of labels and a list of the count, sum, minimum
+                and maximum of the observations.
+        """
+        return [(dict(labels), list(stats))
+                for (timer, labels), stats in sorted(self._timers.items())
+                if timer == name]
+
+    def prometheus(self):
+        """Render the metrics in the Prometheus text exposition format.
+
+        Returns:
+            (str): Counters as ``<name>_total`` and timers as
+                ``<name>_seconds`` summaries, with a ``<name>_seconds_max``
+                gauge.
+        """
+        lines = list()
+
+        for metric in sorted(set(name for name, _ in self._counters)):
+            full = "{}_{}_total".format(PREFIX, metric)
+            lines.append("# TYPE {} counter".format(full))
+            lines.extend("{}{} {}".format(full, _labels(labels), value)
+                         for (name, labels), value
+                         in sorted(self._counters.items())
+                         if name == metric)
+
+        for metric in sorted(set(name for name, _ in self._timers)):
+            full = "{}_{}_seconds".format(PREFIX, metric)
+            lines.append("# TYPE {} summary".format(full))
+            timers = [(labels, stats) for (name, labels), stats
+                      in sorted(self._timers.items()) if name == metric]
+
+            for labels, (count, total, _, _) in timers:
+                lines.append("{}_sum{} {}".format(full, _labels(labels),
+                                                  total))
+                lines.append("{}_count{} {}".format(full, _labels(labels),
+                                                    count))
+
+            lines.append("# TYPE {}_max gauge".format(full))
+            lines.extend("{}_max{} {}".format(full, _labels(labels), stats[3])
+                         for labels, stats in timers)
+        return "\n".join(lines) + "\n"
+
+    def batches(self):
+        """List the batches metrics have been recorded for.
+
+        Returns:
+            (list): Batch names.
+        """
+        return sorted(set(dict(labels)["batch"]
+                          for _, labels in list(self._counters) +
+                          list(self._timers)
+                          if "batch" in dict(labels)))
+
+    def summary(self, batch=None):
+        """Summarise the metrics recorded for a batch.
+
+        Args:
+            batch (str, optional): Batch name, or None for the metrics not
+                recorded against a batch, such as scheduler calls.
+
+        Returns:
+            (dict): Counters and timer statistics, keyed by name and the
+                remaining labels.
+        """
+        res = dict(batch=batch, counters=dict(), timers=dict())
+
+        def label_key(labels):
+            return ",".join("{}={}".format(k, v) for k, v in labels
+                            if k != "batch") or "all"
+
+        for (name, labels), value in sorted(self._counters.items()):
+            if dict(labels).get("batch") == batch:
+                res["counters"].setdefault(name, dict())[
+                    label_key(labels)] = value
+
+        for (name, labels), (count, total, low, high) \
+                in sorted(self._timers.items()):
+            if dict(labels).get("batch") == batch:
+                res["timers"].setdefault(name, dict())[
+                    label_key(labels)] = dict(count=count,
+                                              sum=total,
+                                              mean=total / count,
+                                              min=low,
+                                              max=high)
+        return res
+
+    def files(self, directory):
+        """Render the Prometheus textfile and the JSON summaries.
+
+        Metrics not recorded against a batch are summarised in
+        ``SUMMARY_NAME``, and those of each batch in ``<batch>.json``.
+
+        Args:
+            directory (str): Directory the files are written to.
+
+        Returns:
+            (list): Tuples of file path and contents.
+        """
+        res = [(os.path.join(directory, TEXTFILE_NAME), self.prometheus()),
+               (os.path.join(directory, SUMMARY_NAME),
+                json.dumps(self.summary(), indent=2))]
+
+        for batch in self.batches():
+            res.append((os.path.join(directory, "{}.json".format(batch)),
+                        json.dumps(self.summary(batch), indent=2)))
+        return res
+
+    def export(self, directory):
+        """Write the Prometheus textfile and a JSON summary per batch.
+
+        Args:
+            directory (str): Directory to write to, such as that of the
+                node-exporter textfile collector.
+        """
+        for path, data in self.files(directory):
+            _write(path, data)
+
+    async def exporter(self, directory, interval):
+        """Export the metrics periodically until cancelled.
+
+        Files are rendered on the event loop, where the metrics are updated,
+        and written from a thread.
+
+        Args:
+            directory (str): See ``export``.
+            interval (int): Seconds between exports.
+        """
+        loop = asyncio.get_running_loop()
+
+        while True:
+            await asyncio.sleep(interval)
+            files = self.files(directory)
+
+            try:
+                for path, data in files:
+                    await loop.run_in_executor(None, _write, path, data)
+            except OSError as e:
+                logging.warning("Could not export metrics to {}: {}".
+                                format(directory, e))
+
+
+metrics = Metrics()
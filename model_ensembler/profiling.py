@@ -0,0 +1,157 @@
+import asyncio
+import cProfile
+import logging
+import sys
+import threading
+import time
+import traceback
+
+from model_ensembler.metrics import metrics
+
+"""Profiling module
+
+Finds synchronous work blocking the event loop whilst an ensemble runs, by
+watching the lag of the loop from a thread, along with the wall time of each
+coroutine run as a task and, optionally, a cProfile of the loop thread.
+"""
+
+
+class Profiler(object):
+    """Profile the event loop an ensemble runs on.
+
+    A heartbeat task wakes every ``lag / 2`` seconds, recording how late it
+    wakes as ``loop_lag``. A watchdog thread checks the heartbeat and, once
+    the loop has not woken it for ``lag`` seconds, logs the stack of the
+    loop thread along with the task running, which is the code blocking
+    the loop. A task factory records the wall time of every task by the
+    coroutine it runs.
+
+    Args:
+        loop (object): Event loop, which must run on the calling thread.
+        lag (float): Seconds the loop may be blocked before it is reported.
+        output (str, optional): File to write cProfile statistics of the
+            loop thread to, if the run is to be profiled.
+    """
+
+    def __init__(self, loop, lag=0.5, output=None):
+        self._loop = loop
+        self._lag = lag
+        self._interval = lag / 2
+        self._output = output
+
+        self._beat = None
+        self._reported = None
+        self._thread_id = None
+        self._stop = threading.Event()
+        self._watchdog = None
+        self._heartbeat = None
+        self._profile = None
+        self._factory = None
+
+    def start(self):
+        """Start profiling."""
+        self._thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._heartbeat = self._loop.create_task(self._run_heartbeat())
+
+        self._factory = self._loop.get_task_factory()
+        self._loop.set_task_factory(self._task_factory)
+        self._watchdog = threading.Thread(target=self._watch,
+                                          name="loop-watchdog",
+                                          daemon=True)
+        self._watchdog.start()
+
+        if self._output:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+    def stop(self):
+        """Stop profiling, reporting coroutine wall times and writing any
+        cProfile statistics."""
+        if self._profile:
+            self._profile.disable()
+            self._profile.dump_stats(self._output)
+            logging.info("Profile written to {}".format(self._output))
+
+        self._stop.set()
+        if self._watchdog:
+            self._watchdog.join()
+        if self._heartbeat:
+            self._heartbeat.cancel()
+        self._loop.set_task_factory(self._factory)
+
+        self.report()
+
+    def _task_factory(self, loop, coro, **kwargs):
+        """Create a task, recording its wall time on completion.
+
+        Args:
+            loop (object): Event loop.
+            coro (object): Coroutine the task runs.
+            **kwargs: Further task arguments, such as ``context``.
+
+        Returns:
+            (object): Task.
+        """
+        if self._factory:
+            task = self._factory(loop, coro, **kwargs)
+        else:
+            task = asyncio.Task(coro, loop=loop, **kwargs)
+
+        name = getattr(coro, "__qualname__", type(coro).__qualname__)
+        start = time.monotonic()
+
+        def done(_):
+            metrics.observe("coroutine", time.monotonic() - start,
+                            coroutine=name)
+
+        task.add_done_callback(done)
+        return task
+
+    async def _run_heartbeat(self):
+        while True:
+            self._beat = time.monotonic()
+            await asyncio.sleep(self._interval)
+
+            lag = time.monotonic() - self._beat - self._interval
+            metrics.observe("loop_lag", max(lag, 0.))
+
+            if lag >= self._lag:
+                metrics.inc("loop_stalls")
+                logging.warning("Event loop was blocked for {:.2f} seconds".
+                                format(lag))
+
+    def _watch(self):
+        """Report the stack of the loop thread whilst the loop is blocked."""
+        while not self._stop.wait(self._interval):
+            beat = self._beat
+            blocked = time.monotonic() - beat - self._interval
+
+            # Report each stall once, whilst it is happening
+            if blocked < self._lag or beat == self._reported:
+                continue
+            self._reported = beat
+
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+
+            logging.warning("Event loop blocked for {:.2f} seconds in {!r}:"
+                            "\n{}".format(blocked,
+                                          asyncio.current_task(self._loop),
+                                          "".join(traceback.format_stack(
+                                              frame))))
+
+    def report(self):
+        """Log the wall time of tasks by coroutine, longest in total first."""
+        timers = sorted(metrics.timers("coroutine"),
+                        key=lambda timer: timer[1][1], reverse=True)
+
+        lines = ["{:>8} {:>10} {:>10} {:>10}  {}".format(
+            "count", "total", "mean", "max", "coroutine")]
+        lines.extend("{:>8} {:>10.3f} {:>10.3f} {:>10.3f}  {}".format(
+            count, total, total / count, high, labels["coroutine"])
+            for labels, (count, total, _, high) in timers)
+
+        logging.info("Task wall times in seconds:\n{}".format(
+            "\n".join(lines)))
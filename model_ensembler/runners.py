@@ -1,6 +1,5 @@
 import asyncio
 import logging
-import os
 
 from pprint import pformat
 
@@ -9,7 +8,8 @@ import model_ensembler.batcher
 
 from model_ensembler.tasks import \
     CheckException, TaskException, ProcessingException
-from model_ensembler.utils import Arguments
+from model_ensembler.metrics import metrics
+from model_ensembler.utils import Arguments, get_cwd
 
 
 async def run_check(func, check):
@@ -64,59 +64,222 @@ async def run_task(func, task):
     return True
 
 
-async def run_task_items(items):
+def task_dependencies(items):
+    """Resolve the dependencies of a list of tasks and checks.
+
+    Items without ``after`` depend on the item before them, keeping lists
+    sequential by default. ``after`` names the ``id`` of earlier items in the
+    list, so an empty list allows an item to start straight away.
+
+    Args:
+        items (list): Tasks and checks.
+
+    Returns:
+        (list): For each item, the indexes of the items it depends on.
+
+    Raises:
+        TaskException: If an item depends on an id not defined earlier in the
+            list.
+    """
+    ids = dict()
+    deps = list()
+
+    for idx, item in enumerate(items):
+        after = getattr(item, "after", None)
+
+        if after is None:
+            deps.append([idx - 1] if idx > 0 else [])
+        else:
+            after = [after] if isinstance(after, str) else after
+            missing = [dep for dep in after if dep not in ids]
+
+            if missing:
+                raise TaskException("Task {} depends on {}, which are not "
+                                    "ids of earlier tasks".
+                                    format(item.name, ", ".join(missing)))
+            deps.append(sorted(set(ids[dep] for dep in after)))
+
+        if getattr(item, "id", None):
+            ids[item.id] = idx
+    return deps
+
+
+async def run_task_item(item):
+    """Run a single task or check.
+
+    Args:
+        item (object): Task or check.
+
+    Raises:
+        TaskException: Any exception from the called task.
+        CheckException: Any exception from the called check.
+    """
+    ctx = model_ensembler.batcher.run_ctx.get()
+    func = getattr(model_ensembler.tasks, item.name)
+
+    logging.debug("TASK CWD: {}".format(get_cwd()))
+    logging.debug("TASK CTX: {}".format(pformat(ctx)))
+    logging.debug("TASK FUNC: {}".format(pformat(item)))
+
+    # Ensemble pre and post processing tasks belong to no batch
+    batch = model_ensembler.batcher.batch_ctx.get(None)
+    labels = dict(task=item.name)
+    if batch:
+        labels["batch"] = batch.name
+
+    metrics.inc("tasks", **labels)
+
+    with metrics.timer("task", **labels):
+        if func.check:
+            await run_check(func, item)
+        else:
+            await run_task(func, item)
+
+
+async def run_task_graph(items, deps, limit=None):
+    """Run tasks and checks as soon as their dependencies have completed.
+
+    Once any item fails no further items are started, though those already
+    running are allowed to finish, before the first failure is raised.
+
+    Args:
+        items (list): Tasks and checks.
+        deps (list): Indexes of dependencies for each item, see
+            ``task_dependencies``.
+        limit (int, optional): Maximum number of items to run at once.
+
+    Raises:
+        TaskException: The first exception from a task.
+        CheckException: The first exception from a check.
+    """
+    sem = asyncio.Semaphore(limit) if limit else None
+    done = [asyncio.Event() for _ in items]
+    errors = list()
+
+    async def node(idx):
+        try:
+            for dep in deps[idx]:
+                await done[dep].wait()
+
+            if errors:
+                return
+
+            if sem:
+                async with sem:
+                    if not errors:
+                        await run_task_item(items[idx])
+            else:
+                await run_task_item(items[idx])
+        except (TaskException, CheckException) as e:
+            errors.append(e)
+        finally:
+            done[idx].set()
+
+    await asyncio.gather(*(node(idx) for idx in range(len(items))))
+
+    if errors:
+        raise errors[0]
+
+
+async def run_task_items(items, limit=None):
     """Run a set of task and checks.
 
     Run the list of tasks and check items, the configuration references the
     ``model_ensemble.tasks`` method to use and the context/configuration
-    provides the arguments. TaskException and CheckException are trapped and
+    provides the arguments. Items run in order unless they declare ``after``
+    dependencies, in which case they run as a graph, see
+    ``task_dependencies``. TaskException and CheckException are trapped and
     rethrown as ProcessingException.
 
     Args:
         items (list): Tasks and checks.
+        limit (int, optional): Maximum number of items to run at once.
 
     Raises:
         ProcessingException: A common exception thrown for failures in the
                             individual tasks.
     """
     try:
-        ctx = model_ensembler.batcher.run_ctx.get()
-
-        for item in items:
-            func = getattr(model_ensembler.tasks, item.name)
+        items = list(items) if items else list()
+        deps = task_dependencies(items)
 
-            logging.debug("TASK CWD: {}".format(os.getcwd()))
-            logging.debug("TASK CTX: {}".format(pformat(ctx)))
-            logging.debug("TASK FUNC: {}".format(pformat(item)))
-
-            if func.check:
-                await run_check(func, item)
-            else:
-                await run_task(func, item)
+        if all(dep == ([idx - 1] if idx > 0 else [])
+               for idx, dep in enumerate(deps)):
+            for item in items:
+                await run_task_item(item)
+        else:
+            await run_task_graph(items, deps, limit)
     except (TaskException, CheckException) as e:
         raise ProcessingException(e)
 
 
 # CORE EXECUTION FOR BATCHER
 #
+async def iter_runner(limit, tasks):
+    """Run tasks on a pool of workers, yielding results as they complete.
+
+    Up to limit workers each take the next task from the iterable, run it
+    and take another, so only limit tasks exist at any time and the iterable
+    may be a generator producing them lazily. If a task fails the remaining
+    workers are cancelled and the exception raised.
+
+    Args:
+        limit (int): Maximum number of tasks to run at once.
+        tasks (iterable): Coroutines to run.
+
+    Yields:
+        (tuple): Index of the task in the iterable and its result, in order
+            of completion.
+    """
+    numbered = enumerate(tasks)
+    queue = asyncio.Queue()
+
+    async def worker():
+        try:
+            for idx, task in numbered:
+                queue.put_nowait((idx, await task))
+        except Exception as e:
+            queue.put_nowait(e)
+        else:
+            queue.put_nowait(None)
+
+    workers = [asyncio.ensure_future(worker())
+               for _ in range(max(limit, 1))]
+    running = len(workers)
+
+    try:
+        while running:
+            item = await queue.get()
+
+            if item is None:
+                running -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+    finally:
+        for future in workers:
+            future.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+
 async def run_runner(limit, tasks):
     """Runs a list of tasks asynchronously.
 
-    Given a particular limit, establish a semaphore and run up to limit tasks.
-    Once the list of tasks is complete, return.
+    Given a particular limit, run up to limit tasks at a time, see
+    ``iter_runner``. Once all tasks are complete, return.
 
     Args:
-        limit (int): Context object for retrieving configuration.
-        tasks (list): Tasks and checks.
+        limit (int): Maximum number of tasks to run at once.
+        tasks (iterable): Coroutines to run.
 
     Returns:
-        (list): Completed tasks.
+        (list): Results of the tasks, in the order they were provided.
     """
 
     # TODO: return run task windows/info
-    sem = asyncio.Semaphore(limit)
+    results = dict()
 
-    async def sem_task(task):
-        async with sem:
-            return await task
-    return await asyncio.gather(*(sem_task(task) for task in tasks))
+    async for idx, result in iter_runner(limit, tasks):
+        results[idx] = result
+    return [results[idx] for idx in sorted(results)]
@@ -0,0 +1,249 @@
+import asyncio
+import logging
+import secrets
+import shlex
+
+from model_ensembler.utils import Arguments
+
+"""Shell worker module
+
+Contains a bounded pool of long lived shells which run commands sent to them
+over a pipe, avoiding starting a fresh shell for every command executed.
+"""
+
+_CHUNK = 65536
+
+# Waits on killed shells, see ShellWorker.kill
+_reapers = set()
+
+
+class ShellWorker(object):
+    """A long lived shell running one command at a time.
+
+    Each command runs in a subshell after changing to its working directory,
+    so directory changes, variables and ``exit`` do not leak between
+    commands. Output and the exit status are delimited by a random marker
+    written once the subshell returns.
+
+    Args:
+        shell (str): Shell executable.
+        env (dict, optional): Environment for the shell.
+    """
+
+    def __init__(self, shell, env=None):
+        self._shell = shell
+        self._env = env
+        self._proc = None
+
+    @property
+    def alive(self):
+        """ Property decorator for whether the shell can accept commands.
+
+        Returns:
+            (bool): True if the shell is running.
+        """
+        return self._proc is not None and self._proc.returncode is None
+
+    async def start(self):
+        """Start the shell."""
+        self._proc = await asyncio.create_subprocess_exec(
+            self._shell,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            env=self._env)
+
+    async def run(self, cmd, cwd, output):
+        """Run a command, passing its output on as it arrives.
+
+        Args:
+            cmd (str): Command to run.
+            cwd (str): Directory to run the command in.
+            output (callable): Coroutine function awaited with each chunk of
+                merged stdout and stderr, so it can hold up reading.
+
+        Returns:
+            (int): Return code of the command, or -1 if the shell died.
+        """
+        marker = "__model_ensembler_{}__".format(secrets.token_hex(8))
+        script = "( cd {} && eval {} ) </dev/null 2>&1\n" \
+                 "printf '{}%d\\n' $?\n".format(shlex.quote(cwd),
+                                                shlex.quote(cmd),
+                                                marker)
+        token = marker.encode()
+
+        try:
+            self._proc.stdin.write(script.encode())
+            await self._proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError) as e:
+            logging.warning("Shell worker could not accept command: {}".
+                            format(e))
+            self.kill()
+            return -1
+
+        buf = b""
+        while True:
+            data = await self._proc.stdout.read(_CHUNK)
+
+            if not data:
+                logging.warning("Shell worker exited whilst running {}".
+                                format(cmd))
+                if buf:
+                    await output(buf)
+                self.kill()
+                return -1
+
+            buf += data
+            idx = buf.find(token)
+
+            if idx >= 0:
+                if idx:
+                    await output(buf[:idx])
+
+                rest = buf[idx + len(token):]
+                while b"\n" not in rest:
+                    data = await self._proc.stdout.read(_CHUNK)
+                    if not data:
+                        self.kill()
+                        return -1
+                    rest += data
+                return int(rest.split(b"\n", 1)[0])
+
+            # Hold back enough to find a marker split across reads
+            keep = len(token) - 1
+            if len(buf) > keep:
+                await output(buf[:-keep])
+                buf = buf[-keep:]
+
+    def kill(self):
+        """Stop the shell, waiting for it to exit in the background."""
+        proc, self._proc = self._proc, None
+
+        if proc is not None and proc.returncode is None:
+            try:
+                proc.kill()
+            except ProcessLookupError:
+                pass
+
+            # Held until the shell has exited, so it isn't left a zombie
+            reaper = asyncio.ensure_future(proc.wait())
+            _reapers.add(reaper)
+            reaper.add_done_callback(_reapers.discard)
+
+    async def stop(self):
+        """Stop the shell, waiting for it to exit."""
+        proc = self._proc
+        self.kill()
+
+        if proc:
+            await proc.wait()
+
+
+class ShellPool(object):
+    """Bounded pool of shell workers reused across commands.
+
+    Workers are started on demand up to ``size``, after which commands wait
+    for a free worker. A size of zero disables the pool.
+
+    Args:
+        size (int, optional): Maximum number of workers, defaulting to the
+            ``shell_workers`` argument.
+    """
+
+    def __init__(self, size=None):
+        self._size = size
+        self._idle = list()
+        self._count = 0
+        self._cond = None
+        self._loop = None
+        self._env = None
+
+    @property
+    def enabled(self):
+        """ Property decorator for whether commands should use the pool.
+
+        Returns:
+            (bool): True if the pool has any workers.
+        """
+        if self._size is None:
+            self._size = Arguments().shell_workers or 0
+        return self._size > 0
+
+    def _reset(self, loop, env):
+        """Discard workers belonging to a different event loop or
+        environment.
+
+        Args:
+            loop (object): Running event loop.
+            env (dict): Environment for new workers.
+        """
+        if loop is not self._loop or env != self._env:
+            for worker in self._idle:
+                worker.kill()
+
+            self._idle = list()
+            self._count = 0
+            self._cond = asyncio.Condition()
+            self._loop = loop
+            self._env = env
+
+    async def run(self, cmd, cwd, output, shell, env=None):
+        """Run a command on a free worker.
+
+        Args:
+            cmd (str): Command to run.
+            cwd (str): Directory to run the command in.
+            output (callable): Coroutine function awaited with each chunk of
+                output, see ``ShellWorker.run``.
+            shell (str): Shell executable for new workers.
+            env (dict, optional): Environment for new workers.
+
+        Returns:
+            (int): Return code of the command.
+        """
+        self._reset(asyncio.get_running_loop(), env)
+        cond = self._cond
+
+        async with cond:
+            await cond.wait_for(lambda: self._idle or
+                                self._count < self._size)
+
+            if self._idle:
+                worker = self._idle.pop()
+            else:
+                worker = None
+                self._count += 1
+
+        try:
+            if worker is None:
+                worker = ShellWorker(shell, env)
+                await worker.start()
+            rc = await worker.run(cmd, cwd, output)
+        except BaseException:
+            if worker:
+                worker.kill()
+            raise
+        finally:
+            if cond is self._cond:
+                async with cond:
+                    if worker and worker.alive:
+                        self._idle.append(worker)
+                    else:
+                        self._count -= 1
+                    cond.notify()
+            elif worker:
+                worker.kill()
+        return rc
+
+    async def close(self):
+        """Stop all idle workers, busy workers stop once they finish."""
+        for worker in self._idle:
+            await worker.stop()
+
+        self._idle = list()
+        self._count = 0
+        self._cond = None
+        self._loop = None
+
+
+shell_pool = ShellPool()
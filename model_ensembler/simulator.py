@@ -0,0 +1,416 @@
+import argparse
+import contextlib
+import os
+import random
+import re
+import shlex
+import sqlite3
+import stat
+import sys
+import time
+
+from datetime import datetime
+
+"""SLURM simulator module
+
+Provides stand-in ``sbatch``, ``squeue`` and ``sacct`` commands backed by a
+small state database, so that the SLURM backend can be exercised end to end
+on a single machine. Jobs are not executed: at submission each job is given
+a queue delay, runtime and final state, from which its state at any later
+point is derived.
+
+The simulation is controlled by environment variables:
+
+* ``ME_SIM_DIR``: directory holding the state database.
+* ``ME_SIM_QUEUE``: queue delay range in seconds, as ``min,max``.
+* ``ME_SIM_RUNTIME``: runtime range in seconds, as ``min,max``.
+* ``ME_SIM_FAIL_RATE``: probability of a job ending in a failure state.
+* ``ME_SIM_FAIL_STATES``: comma separated failure states to choose from.
+* ``ME_SIM_SLOTS``: number of jobs able to run at once, 0 for unlimited.
+* ``ME_SIM_SEED``: seed for reproducible simulations.
+"""
+
+COMMANDS = ("sbatch", "squeue", "sacct")
+
+_WRAPPER = """#!/bin/sh
+: "${{ME_SIM_DIR:={state_dir}}}"
+export ME_SIM_DIR
+exec {python} -m model_ensembler.simulator {command} "$@"
+"""
+
+r_directive = re.compile(r'^#SBATCH\s+(.*)$')
+r_array = re.compile(r'^(\d+)-(\d+)(?:%(\d+))?$')
+
+
+def install(bin_dir, state_dir=None):
+    """Write stand-in SLURM command wrappers into a directory.
+
+    Args:
+        bin_dir (str): Directory to write the commands to.
+        state_dir (str, optional): Default state directory for the commands,
+            overridden by ME_SIM_DIR when set. Defaults to bin_dir/state.
+
+    Returns:
+        (str): Absolute path of bin_dir.
+    """
+    bin_dir = os.path.abspath(bin_dir)
+    state_dir = os.path.abspath(state_dir) if state_dir \
+        else os.path.join(bin_dir, "state")
+    os.makedirs(bin_dir, exist_ok=True)
+
+    for command in COMMANDS:
+        path = os.path.join(bin_dir, command)
+        with open(path, "w") as fh:
+            fh.write(_WRAPPER.format(state_dir=state_dir,
+                                     python=shlex.quote(sys.executable),
+                                     command=command))
+        os.chmod(path, os.stat(path).st_mode |
+                 stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return bin_dir
+
+
+@contextlib.contextmanager
+def _state(write=False):
+    """Open the simulator state database within a transaction.
+
+    Args:
+        write (bool): Take the write lock up front, for submissions.
+
+    Yields:
+        (object): sqlite3 connection.
+    """
+    state_dir = os.environ.get("ME_SIM_DIR", os.path.join(os.getcwd(),
+                                                          ".slurm_sim"))
+    os.makedirs(state_dir, exist_ok=True)
+
+    conn = sqlite3.connect(os.path.join(state_dir, "slurm.db"),
+                           timeout=60, isolation_level=None)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY, base INTEGER, name TEXT,
+                partition TEXT, submit REAL, start REAL, end REAL,
+                final TEXT);
+            CREATE INDEX IF NOT EXISTS jobs_base ON jobs (base);
+            CREATE INDEX IF NOT EXISTS jobs_end ON jobs (end);
+            CREATE TABLE IF NOT EXISTS slots (slot INTEGER PRIMARY KEY,
+                                              free REAL);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY,
+                                             value INTEGER);
+        """)
+        conn.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+        yield conn
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def _range(name, default):
+    """Read a min,max range from the environment.
+
+    Args:
+        name (str): Environment variable.
+        default (tuple): Range to use when unset.
+
+    Returns:
+        (tuple): Minimum and maximum.
+    """
+    value = os.environ.get(name)
+    if not value:
+        return default
+    bounds = [float(v) for v in value.split(",")]
+    return bounds[0], bounds[-1]
+
+
+def _state_at(job, now):
+    """Derive the state of a job at a point in time.
+
+    Args:
+        job (tuple): Row of submit, start, end and final state.
+        now (float): Time to derive the state at.
+
+    Returns:
+        (str): SLURM job state.
+    """
+    submit, start, end, final = job
+
+    if now < start:
+        return "PENDING"
+    elif now < end:
+        return "RUNNING"
+    return final
+
+
+def _timestamp(value, now):
+    """Format a time as sacct does, if it has happened.
+
+    Args:
+        value (float): Epoch time.
+        now (float): Current epoch time.
+
+    Returns:
+        (str): ISO time or "Unknown".
+    """
+    if value > now:
+        return "Unknown"
+    return datetime.fromtimestamp(value).strftime("%Y-%m-%dT%H:%M:%S")
+
+
+def _short_options(argv):
+    """Split combined short options such as -XnP into separate options.
+
+    Args:
+        argv (list): Command line arguments.
+
+    Returns:
+        (list): Arguments with combined flags separated.
+    """
+    split = list()
+    for arg in argv:
+        if re.match(r'^-[A-Za-z]{2,}$', arg):
+            split.extend("-{}".format(c) for c in arg[1:])
+        else:
+            split.append(arg)
+    return split
+
+
+def sbatch(argv):
+    """Stand-in sbatch, scheduling the job(s) in the state database.
+
+    Args:
+        argv (list): Command line arguments.
+
+    Returns:
+        (int): Return code.
+    """
+    parser = argparse.ArgumentParser(prog="sbatch")
+    parser.add_argument("-J", "--job-name")
+    parser.add_argument("-p", "--partition")
+    parser.add_argument("-a", "--array")
+    parser.add_argument("--parsable", action="store_true")
+    parser.add_argument("script")
+    args, _ = parser.parse_known_args(argv)
+
+    try:
+        with open(args.script, "r") as fh:
+            lines = fh.readlines()
+    except OSError as e:
+        print("sbatch: error: Unable to open file {}: {}".
+              format(args.script, e.strerror), file=sys.stderr)
+        return 1
+
+    directives = list()
+    for line in lines:
+        if line.strip() and not line.startswith("#"):
+            break
+        directive_match = r_directive.match(line)
+        if directive_match:
+            directives.extend(shlex.split(directive_match.group(1)))
+
+    script_args, _ = parser.parse_known_args(directives + [args.script])
+    name = args.job_name or script_args.job_name or \
+        os.path.basename(args.script)
+    partition = args.partition or script_args.partition or ""
+    array = args.array or script_args.array
+
+    tasks, throttle = [None], None
+    if array:
+        array_match = r_array.match(array)
+        if not array_match:
+            print("sbatch: error: Invalid job array specification",
+                  file=sys.stderr)
+            return 1
+        first, last, throttle = array_match.groups()
+        tasks = list(range(int(first), int(last) + 1))
+        throttle = int(throttle) if throttle else None
+
+    queue = _range("ME_SIM_QUEUE", (0., 2.))
+    runtime = _range("ME_SIM_RUNTIME", (1., 5.))
+    fail_rate = float(os.environ.get("ME_SIM_FAIL_RATE", 0.))
+    fail_states = os.environ.get("ME_SIM_FAIL_STATES", "FAILED").split(",")
+    slots = int(os.environ.get("ME_SIM_SLOTS", 0))
+    seed = os.environ.get("ME_SIM_SEED")
+
+    now = time.time()
+
+    with _state(write=True) as conn:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'next_id'").\
+            fetchone()
+        job_id = row[0] if row else 1000
+        conn.execute("INSERT OR REPLACE INTO meta VALUES ('next_id', ?)",
+                     (job_id + 1,))
+
+        rng = random.Random("{}-{}".format(seed, job_id)) \
+            if seed is not None else random.Random()
+
+        if slots:
+            conn.executemany("INSERT OR IGNORE INTO slots VALUES (?, 0)",
+                             [(i,) for i in range(slots)])
+
+        ends = list()
+        for i, task_id in enumerate(tasks):
+            start = now + rng.uniform(*queue)
+
+            if throttle and i >= throttle:
+                start = max(start, ends[i - throttle])
+
+            if slots:
+                slot, free = conn.execute(
+                    "SELECT slot, free FROM slots ORDER BY free LIMIT 1").\
+                    fetchone()
+                start = max(start, free)
+
+            end = start + rng.uniform(*runtime)
+            ends.append(end)
+            final = rng.choice(fail_states) if rng.random() < fail_rate \
+                else "COMPLETED"
+
+            if slots:
+                conn.execute("UPDATE slots SET free = ? WHERE slot = ?",
+                             (end, slot))
+
+            conn.execute("INSERT INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                         (str(job_id) if task_id is None
+                          else "{}_{}".format(job_id, task_id),
+                          job_id, name, partition, now, start, end, final))
+
+    print(job_id if args.parsable else "Submitted batch job {}".
+          format(job_id))
+    return 0
+
+
+def squeue(argv):
+    """Stand-in squeue, listing pending and running jobs.
+
+    Supports the %i, %j, %P and %T format specifiers.
+
+    Args:
+        argv (list): Command line arguments.
+
+    Returns:
+        (int): Return code.
+    """
+    parser = argparse.ArgumentParser(prog="squeue", add_help=False)
+    parser.add_argument("-o", "--format", default="%i %P %j %T")
+    parser.add_argument("-h", "--noheader", action="store_true",
+                        dest="noheader")
+    parser.add_argument("-p", "--partition")
+    parser.add_argument("-j", "--jobs")
+    args, _ = parser.parse_known_args(_short_options(argv))
+
+    now = time.time()
+    partitions = args.partition.split(",") if args.partition else None
+    job_ids = args.jobs.split(",") if args.jobs else None
+
+    if not args.noheader:
+        print(args.format.replace("%i", "JOBID").replace("%j", "NAME").
+              replace("%P", "PARTITION").replace("%T", "STATE"))
+
+    with _state() as conn:
+        for job_id, base, name, partition, *times in conn.execute(
+                "SELECT id, base, name, partition, submit, start, end, "
+                "final FROM jobs WHERE end > ? ORDER BY submit, id", (now,)):
+            if partitions and partition and partition not in partitions:
+                continue
+            if job_ids and job_id not in job_ids and \
+                    str(base) not in job_ids:
+                continue
+
+            fields = {"i": job_id, "j": name, "P": partition,
+                      "T": _state_at(times, now)}
+            print(re.sub(r'%([A-Za-z])',
+                         lambda m: fields.get(m.group(1), ""),
+                         args.format))
+    return 0
+
+
+def sacct(argv):
+    """Stand-in sacct, reporting on jobs by ID.
+
+    Supports the jobid, jobname, partition, state, submit, start and end
+    fields.
+
+    Args:
+        argv (list): Command line arguments.
+
+    Returns:
+        (int): Return code.
+    """
+    parser = argparse.ArgumentParser(prog="sacct")
+    parser.add_argument("-j", "--jobs")
+    parser.add_argument("-o", "--format", default="jobid,jobname,state")
+    parser.add_argument("-n", "--noheader", action="store_true")
+    parser.add_argument("-P", "--parsable2", action="store_true")
+    parser.add_argument("-X", "--allocations", action="store_true")
+    args, _ = parser.parse_known_args(_short_options(argv))
+
+    now = time.time()
+    fields = args.format.lower().split(",")
+    sep = "|" if args.parsable2 else " "
+
+    if not args.noheader:
+        print(sep.join(f.capitalize() for f in fields))
+
+    with _state() as conn:
+        if args.jobs:
+            job_ids = args.jobs.split(",")
+            rows = list()
+
+            # Array jobs are matched on their base ID as well as task IDs
+            for i in range(0, len(job_ids), 400):
+                chunk = job_ids[i:i + 400]
+                bases = [int(j) for j in chunk if j.isdigit()]
+                rows.extend(conn.execute(
+                    "SELECT * FROM jobs WHERE id IN ({}) OR base IN ({})".
+                    format(",".join("?" * len(chunk)),
+                           ",".join("?" * len(bases)) or "NULL"),
+                    chunk + bases).fetchall())
+        else:
+            rows = conn.execute("SELECT * FROM jobs").fetchall()
+
+    for job_id, base, name, partition, submit, start, end, final in \
+            sorted(set(rows), key=lambda r: (r[1], r[0])):
+        values = {
+            "jobid": job_id,
+            "jobname": name,
+            "partition": partition,
+            "state": _state_at((submit, start, end, final), now),
+            "submit": _timestamp(submit, now),
+            "start": _timestamp(start, now),
+            "end": _timestamp(end, now),
+        }
+        print(sep.join(values.get(f, "") for f in fields))
+    return 0
+
+
+def main(args=None):
+    """CLI entry point for the simulator.
+
+    Either installs the stand-in commands into a directory, or runs one of
+    them.
+    """
+    argv = sys.argv[1:] if args is None else args
+
+    if argv and argv[0] in COMMANDS:
+        return getattr(sys.modules[__name__], argv[0])(argv[1:])
+
+    parser = argparse.ArgumentParser(
+        description="Stand-in SLURM commands for local load testing")
+    subparsers = parser.add_subparsers(dest="action", required=True)
+
+    install_parser = subparsers.add_parser(
+        "install", help="Write sbatch, squeue and sacct into a directory")
+    install_parser.add_argument("bin_dir")
+    install_parser.add_argument("-s", "--state-dir", default=None)
+
+    parsed = parser.parse_args(argv)
+    print(install(parsed.bin_dir, parsed.state_dir))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,160 @@
+import functools
+import itertools
+import operator
+import random
+
+"""Parameter sweep module
+
+Generates run variables lazily from the ``sweep`` specification of a batch,
+so that only the runs being worked on are ever held in memory.
+"""
+
+METHODS = ("product", "zip", "lhs", "random")
+
+
+def sweep_size(spec):
+    """Determine the number of runs a sweep generates.
+
+    Args:
+        spec (dict): Sweep specification.
+
+    Returns:
+        (int): Number of runs.
+
+    Raises:
+        ValueError: If the specification is not understood.
+    """
+    method, params = spec["method"], spec["params"]
+
+    if method == "product":
+        return functools.reduce(operator.mul,
+                                (len(v) for v in params.values()), 1)
+    elif method == "zip":
+        return min((len(v) for v in params.values()), default=0)
+    elif method in ("lhs", "random"):
+        if "samples" not in spec:
+            raise ValueError("A {} sweep requires samples".format(method))
+        return int(spec["samples"])
+    raise ValueError("Unknown sweep method {}, expected one of {}".
+                     format(method, ", ".join(METHODS)))
+
+
+def _scale(bounds, u):
+    """Map a unit interval sample onto parameter bounds.
+
+    Integer bounds produce integers, inclusive of both bounds, otherwise a
+    float is produced.
+
+    Args:
+        bounds (list): Lower and upper bound.
+        u (float): Sample in [0, 1).
+
+    Returns:
+        (int|float): Scaled sample.
+    """
+    lo, hi = bounds
+
+    if isinstance(lo, int) and isinstance(hi, int):
+        return min(lo + int(u * (hi - lo + 1)), hi)
+    return lo + u * (hi - lo)
+
+
+_MASK64 = (1 << 64) - 1
+_ROUNDS = 4
+
+
+def _mix(x):
+    """Scramble a 64 bit integer, using the splitmix64 finaliser.
+
+    Args:
+        x (int): Value to scramble.
+
+    Returns:
+        (int): Scrambled 64 bit value.
+    """
+    x = (x + 0x9E3779B97F4A7C15) & _MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return x ^ (x >> 31)
+
+
+def _permutation(rng, n):
+    """Choose a random permutation of range(n), evaluated per index.
+
+    A keyed Feistel network permutes the smallest even bit width covering n,
+    and indexes landing outside range(n) are walked along their cycle until
+    they land within it, so permutations drawn for different parameters are
+    independent without any being held in memory.
+
+    Args:
+        rng (object): random.Random instance to draw the keys from.
+        n (int): Size of the permutation.
+
+    Returns:
+        (callable): Function mapping an index in range(n) to its position.
+    """
+    half = max((n - 1).bit_length() + 1, 2) // 2
+    mask = (1 << half) - 1
+    keys = [rng.getrandbits(64) for _ in range(_ROUNDS)]
+
+    def feistel(i):
+        left, right = i >> half, i & mask
+        for key in keys:
+            left, right = right, left ^ (_mix(right ^ key) & mask)
+        return (left << half) | right
+
+    def permute(i):
+        i = feistel(i)
+        while i >= n:
+            i = feistel(i)
+        return i
+
+    return permute
+
+
+def expand_sweep(spec):
+    """Lazily generate the run variables of a sweep.
+
+    Sweeps are one of:
+
+    * ``product``: every combination of the listed values of each parameter.
+    * ``zip``: the nth values of each parameter together.
+    * ``lhs``: Latin hypercube samples within ``[lower, upper]`` bounds.
+    * ``random``: uniform samples within ``[lower, upper]`` bounds, or drawn
+      from a ``choices`` list.
+
+    Sampled sweeps take a number of ``samples`` and an optional ``seed``.
+    Latin hypercube strata are assigned by an independent keyed permutation
+    per parameter, so no sample plan is held in memory.
+
+    Args:
+        spec (dict): Sweep specification.
+
+    Yields:
+        (dict): Variables for a run.
+    """
+    method, params = spec["method"], spec["params"]
+    names = list(params.keys())
+    size = sweep_size(spec)
+
+    if method == "product":
+        for values in itertools.product(*(params[k] for k in names)):
+            yield dict(zip(names, values))
+    elif method == "zip":
+        for values in zip(*(params[k] for k in names)):
+            yield dict(zip(names, values))
+    elif method == "lhs":
+        rng = random.Random(spec.get("seed"))
+        perms = {k: _permutation(rng, size) for k in names}
+
+        for i in range(size):
+            yield {k: _scale(params[k], (perms[k](i) + rng.random()) / size)
+                   for k in names}
+    else:
+        rng = random.Random(spec.get("seed"))
+
+        for _ in range(size):
+            yield {k: rng.choice(params[k]["choices"])
+                   if isinstance(params[k], dict)
+                   else _scale(params[k], rng.random())
+                   for k in names}
@@ -1,30 +1,8 @@
-import importlib
 import logging
 
 from model_ensembler.tasks.utils import \
     check_task, processing_task, execute_command
-
-# TODO: dynamic imports need to take place here
-cluster = None
-
-
-def init_hpc_backend(backend):
-    """ Initialise cluster backend to use.
-
-    Args:
-        backend (str): Cluster backed to use.
-
-    Raises:
-        ImportError/ModuleNotFoundError: If cluster backend cannot be imported.
-    """
-    global cluster
-
-    logging.info("Importing {}".format(backend))
-    try:
-        cluster = importlib.import_module(backend)
-    except (ImportError, ModuleNotFoundError) as e:
-        logging.exception("Couldn't dynamically import cluster backend")
-        raise e
+from model_ensembler.utils import cluster_ctx
 
 
 """HPC tasks
@@ -34,23 +12,35 @@ This module contains HPC related task methods
 
 
 async def find_id(job_id):
-    return await cluster.find_id(job_id)
+    return await cluster_ctx.get().find_id(job_id)
 
 
 @check_task
-async def jobs(ctx, limit, match):
+async def jobs(ctx, limit, match, reserve=False):
     """Check: Assert whether number of jobs in SLURM is under limit.
 
+    The count comes from the backend's shared job count, which lists the
+    scheduler queue at most once per check timeout rather than for every
+    check.
+
     Args:
         ctx (object): Contextual configuration.
         limit (int): Number of jobs to check for.
         match (str): Prefix to match jobs by.
+        reserve (bool, optional): Reserve a slot for a submission that follows
+            a successful check, see ``JobCounter.check``.
 
     Returns:
         (bool): True if number of jobs is less than limit, otherwise false.
     """
 
+    cluster = cluster_ctx.get()
+
     # TODO: match with regex
+    if hasattr(cluster, "job_counts"):
+        return await cluster.job_counts.check(ctx, match, limit,
+                                              reserve=reserve)
+
     async with cluster.job_lock:
         job_list = await cluster.current_jobs(ctx, match)
         res = len(job_list) < int(limit)
@@ -76,6 +66,8 @@ async def submit(ctx, script=None):
     # TODO: check this as an optional argument avoids run submission
     #  as intended
     if script:
+        cluster = cluster_ctx.get()
+
         async with cluster.job_lock:
             await cluster.submit_job(ctx, script)
 
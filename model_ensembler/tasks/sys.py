@@ -1,8 +1,12 @@
+import asyncio
+import functools
 import logging
 import os
-import shutil
+
+from model_ensembler.utils import get_cwd
 
 from .exceptions import FailureNotToleratedError
+from .transfer import remove_tree, transfer
 from .utils import check_task, processing_task, execute_command
 
 """System tasks
@@ -70,20 +74,26 @@ async def execute(ctx, cmd, cwd=None, log=False, shell=None):
 
 # TODO: Context identification. WE MUST HAVE ID
 @processing_task
-async def move(ctx, dest, include=None, exclude=None, cwd=None):
-    """Process: rsync current working directory contents.
+async def move(ctx, dest, include=None, exclude=None, cwd=None, link=True):
+    """Process: copy current working directory contents, as rsync would.
+
+    Files are copied natively on a thread pool, away from the event loop,
+    using ``transfer.transfer``.
 
     Args:
         ctx (object): Contextual configuration.
         dest (str): Path to copy ctx.id named directory to.
         include (List[str], optional): rsync include specifiers.
         exclude (List[str], optional): rsync exclude specifiers, defaults to
-            "*" when calling rsync if include specifiers are given and no
-            exclude specifiers are provided.
-        cwd (str, optional): See ``utils.execute_command``.
+            "*" if include specifiers are given and no exclude specifiers
+            are provided.
+        cwd (str, optional): Directory to copy, defaulting to the base
+            directory of the current batch.
+        link (bool, optional): Hard link files rather than copying them when
+            the destination is on the same filesystem.
 
     Returns:
-        (bool): true if return code is zero, false otherwise.
+        (bool): true if the copy succeeded, false otherwise.
 
     Raises:
         RuntimeError: If did not provide necessary context attribute for using
@@ -95,26 +105,33 @@ async def move(ctx, dest, include=None, exclude=None, cwd=None):
 
     # TODO: Type checking
     include = [] if not include else include
-    exclude = ["*"] if not exclude and include else []
-    dest = os.path.join(dest, ctx.id)
+    exclude = ["*"] if not exclude and include else (exclude or [])
+    src = os.path.join(get_cwd(), cwd) if cwd else get_cwd()
+    # Relative destinations are relative to the directory being copied
+    dest = os.path.join(src, dest, ctx.id)
 
-    liststr = " ".join(["--include=\"{}\"".
-                       format(i.strip("\"")) for i in include]) + " " + \
-        " ".join(["--exclude=\"{}\"".
-                 format(e.strip("\"")) for e in exclude])
+    logging.info("Transferring {} to {}, include {} exclude {}".
+                 format(src, dest, include, exclude))
 
-    cmd = "rsync -aXE {} ./ {}/".format(liststr, dest)
-    logging.info(cmd)
+    try:
+        copied = await asyncio.get_running_loop().run_in_executor(
+            None, functools.partial(transfer, src, dest,
+                                    include, exclude, link))
+    except OSError as e:
+        logging.exception("Could not transfer {} to {}: {}".
+                          format(src, dest, e))
+        return False
 
-    res = await execute_command(cmd, cwd)
-    if res.returncode == 0:
-        return True
-    return False
+    logging.debug("Transferred {} files to {}".format(copied, dest))
+    return True
 
 
 @processing_task
 async def remove(ctx, directory=None):
-    """Process: Remove directory using shutil.rmtree.
+    """Process: Remove directory, unlinking files in parallel.
+
+    The removal runs on a thread pool, away from the event loop, using
+    ``transfer.remove_tree``.
 
     Args:
         ctx (object): Contextual configuration.
@@ -129,11 +146,13 @@ async def remove(ctx, directory=None):
     """
     if not directory:
         directory = ctx.dir
+    directory = os.path.join(get_cwd(), directory)
 
     logging.info("Attempting to remove data on {}".format(directory))
 
     try:
-        shutil.rmtree(directory)
+        await asyncio.get_running_loop().run_in_executor(
+            None, remove_tree, directory)
     except OSError as e:
         logging.exception("Could not remove {}: {}".
                           format(directory, e.strerror))
@@ -0,0 +1,444 @@
+import concurrent.futures
+import errno
+import logging
+import os
+import re
+import secrets
+import shutil
+import stat
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+"""Transfer utilities
+
+This module contains the native copy and removal engine used by the system
+tasks, running file operations on a thread pool away from the event loop.
+"""
+
+TRANSFER_WORKERS = 8
+
+# Linux ioctl cloning a file's extents, see ioctl_ficlone(2)
+FICLONE = 0x40049409
+MODES = ("copy", "hardlink", "reflink", "symlink")
+
+_executor = None
+
+
+def get_executor():
+    """Retrieve the thread pool used for file operations.
+
+    Returns:
+        (object): concurrent.futures.ThreadPoolExecutor.
+    """
+    global _executor
+
+    if _executor is None:
+        _executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=TRANSFER_WORKERS,
+            thread_name_prefix="transfer")
+    return _executor
+
+
+def _glob_regex(pattern):
+    """Translate an rsync style wildcard pattern into a regular expression.
+
+    Args:
+        pattern (str): Pattern, where ``*`` and ``?`` do not match ``/`` and
+            ``**`` matches anything.
+
+    Returns:
+        (str): Regular expression source.
+    """
+    res = ""
+    i = 0
+
+    while i < len(pattern):
+        c = pattern[i]
+
+        if pattern.startswith("**", i):
+            res += ".*"
+            i += 2
+            continue
+        elif c == "*":
+            res += "[^/]*"
+        elif c == "?":
+            res += "[^/]"
+        elif c == "[" and "]" in pattern[i + 1:]:
+            end = pattern.index("]", i + 2 if pattern[i + 1:i + 2] == "]"
+                                else i + 1)
+            body = pattern[i + 1:end]
+            if body.startswith("!"):
+                body = "^" + body[1:]
+            res += "[{}]".format(body.replace("\\", "\\\\"))
+            i = end
+        else:
+            res += re.escape(c)
+        i += 1
+    return res
+
+
+class FilterRules(object):
+    """Include and exclude rules matching files as rsync does.
+
+    Includes are considered before excludes, and the first rule matching a
+    path decides it, with unmatched paths included. Patterns without a ``/``
+    match the name of a file or directory at any depth, patterns containing
+    one match the end of the path relative to the source, or the whole path
+    if they start with ``/``. A trailing ``/`` only matches directories. An
+    excluded directory is not descended into.
+
+    Args:
+        include (list, optional): Include patterns.
+        exclude (list, optional): Exclude patterns.
+    """
+
+    def __init__(self, include=None, exclude=None):
+        self._rules = list()
+
+        for included, patterns in ((True, include), (False, exclude)):
+            for pattern in patterns or []:
+                self._rules.append((included,) + self._compile(pattern))
+
+    @staticmethod
+    def _compile(pattern):
+        pattern = pattern.strip("\"")
+        dir_only = pattern.endswith("/")
+        pattern = pattern.rstrip("/")
+
+        if "/" not in pattern:
+            return re.compile("^{}$".format(_glob_regex(pattern))), \
+                dir_only, False
+        elif pattern.startswith("/"):
+            return re.compile("^{}$".format(_glob_regex(pattern[1:]))), \
+                dir_only, True
+        return re.compile("(^|/){}$".format(_glob_regex(pattern))), \
+            dir_only, True
+
+    def included(self, path, is_dir=False):
+        """Determine whether a path is included in a transfer.
+
+        Args:
+            path (str): Path relative to the source, using ``/``.
+            is_dir (bool, optional): Whether the path is a directory.
+
+        Returns:
+            (bool): True if the path should be transferred.
+        """
+        for included, regex, dir_only, full in self._rules:
+            if dir_only and not is_dir:
+                continue
+
+            subject = path if full else path.rsplit("/", 1)[-1]
+            if regex.search(subject):
+                return included
+        return True
+
+
+def _unchanged(src_stat, dst):
+    """Quick check, as rsync does, for a destination matching its source.
+
+    Args:
+        src_stat (object): os.stat_result of the source.
+        dst (str): Destination path.
+
+    Returns:
+        (bool): True if the destination has the same size and mtime.
+    """
+    try:
+        dst_stat = os.lstat(dst)
+    except FileNotFoundError:
+        return False
+    return stat.S_ISREG(dst_stat.st_mode) and \
+        dst_stat.st_size == src_stat.st_size and \
+        int(dst_stat.st_mtime) == int(src_stat.st_mtime)
+
+
+_FALLBACK_ERRNOS = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EBADF,
+                    errno.EOPNOTSUPP, errno.ENOTSUP)
+
+
+def _copy_data(src, dst, size):
+    """Copy file contents within the kernel where possible.
+
+    ``os.copy_file_range`` is tried first, allowing filesystems to clone or
+    copy server side, then ``os.sendfile`` and finally a userspace copy.
+
+    Args:
+        src (str): Source file.
+        dst (str): Destination file.
+        size (int): Size of the source file.
+    """
+    block = max(size, 1 << 20)
+
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        for method in ("copy_file_range", "sendfile"):
+            if not hasattr(os, method):
+                continue
+
+            try:
+                if method == "copy_file_range":
+                    while os.copy_file_range(fsrc.fileno(), fdst.fileno(),
+                                             block):
+                        pass
+                else:
+                    while os.sendfile(fdst.fileno(), fsrc.fileno(), None,
+                                      block):
+                        pass
+                return
+            except OSError as e:
+                if e.errno not in _FALLBACK_ERRNOS:
+                    raise
+
+                fsrc.seek(0)
+                fdst.seek(0)
+                fdst.truncate()
+
+        shutil.copyfileobj(fsrc, fdst, 1 << 20)
+
+
+def reflink_data(src, dst, size):
+    """Clone file contents, sharing data blocks where the filesystem allows.
+
+    Args:
+        src (str): Source file.
+        dst (str): Destination file.
+        size (int): Size of the source file.
+    """
+    if fcntl:
+        try:
+            with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return
+        except OSError as e:
+            logging.debug("Could not reflink {}, copying instead: {}".
+                          format(src, e))
+
+    _copy_data(src, dst, size)
+
+
+def copy_file(src, dst, mode="copy"):
+    """Copy a single file, preserving its metadata.
+
+    Changed files are written alongside the destination and renamed into
+    place, so that any links to the previous destination are unaffected.
+
+    Args:
+        src (str): Source path.
+        dst (str): Destination path.
+        mode (str, optional): One of ``MODES``, how regular files are
+            transferred.
+
+    Returns:
+        (bool): True if anything was transferred.
+    """
+    src_stat = os.lstat(src)
+
+    if stat.S_ISLNK(src_stat.st_mode):
+        target = os.readlink(src)
+        if os.path.islink(dst) and os.readlink(dst) == target:
+            return False
+        if os.path.lexists(dst):
+            os.unlink(dst)
+        os.symlink(target, dst)
+        return True
+
+    if not stat.S_ISREG(src_stat.st_mode):
+        logging.warning("Skipping special file {}".format(src))
+        return False
+
+    if mode in ("hardlink", "symlink"):
+        try:
+            if os.path.samestat(src_stat, os.stat(dst)):
+                return False
+        except FileNotFoundError:
+            pass
+
+        try:
+            if os.path.lexists(dst):
+                os.unlink(dst)
+
+            if mode == "hardlink":
+                os.link(src, dst)
+            else:
+                os.symlink(os.path.abspath(src), dst)
+            return True
+        except OSError as e:
+            logging.debug("Could not {} {}, copying instead: {}".
+                          format(mode, src, e))
+
+    if _unchanged(src_stat, dst):
+        return False
+
+    if os.path.lexists(dst) and not os.path.isfile(dst):
+        raise IsADirectoryError(errno.EISDIR,
+                                "Cannot replace with a file", dst)
+
+    tmp = os.path.join(os.path.dirname(dst),
+                       ".{}.{}".format(os.path.basename(dst),
+                                       secrets.token_hex(4)))
+    try:
+        if mode == "reflink":
+            reflink_data(src, tmp, src_stat.st_size)
+        else:
+            _copy_data(src, tmp, src_stat.st_size)
+        shutil.copystat(src, tmp, follow_symlinks=False)
+        os.replace(tmp, dst)
+    except BaseException:
+        if os.path.lexists(tmp):
+            os.unlink(tmp)
+        raise
+    return True
+
+
+def _copy_tree(src, dest, included, file_mode):
+    """Copy a directory tree on the transfer thread pool.
+
+    Args:
+        src (str): Source directory.
+        dest (str): Destination directory, created if necessary.
+        included (callable): Accepting a relative path and whether it is a
+            directory, returning whether to transfer it.
+        file_mode (callable): Accepting a relative path, returning the mode
+            to pass to ``copy_file``.
+
+    Returns:
+        (int): Number of files transferred.
+
+    Raises:
+        ValueError: If the destination is the source directory.
+    """
+    os.makedirs(dest, exist_ok=True)
+
+    # A destination inside the source is left out of the walk, else the
+    # copy would recurse into itself
+    dest_stat = os.stat(dest)
+    if os.path.samestat(os.stat(src), dest_stat):
+        raise ValueError("Cannot transfer {} onto itself".format(src))
+
+    executor = get_executor()
+    futures = list()
+    dirs = [(src, dest)]
+    stack = [""]
+
+    while stack:
+        rel_dir = stack.pop()
+
+        with os.scandir(os.path.join(src, rel_dir)) as it:
+            for entry in it:
+                rel = "/".join([rel_dir, entry.name]) if rel_dir \
+                    else entry.name
+                is_dir = entry.is_dir(follow_symlinks=False)
+
+                if is_dir and os.path.samestat(
+                        entry.stat(follow_symlinks=False), dest_stat):
+                    continue
+                if not included(rel, is_dir):
+                    continue
+
+                target = os.path.join(dest, rel)
+                if is_dir:
+                    os.makedirs(target, exist_ok=True)
+                    dirs.append((entry.path, target))
+                    stack.append(rel)
+                else:
+                    futures.append(executor.submit(copy_file, entry.path,
+                                                   target, file_mode(rel)))
+
+    copied = sum(future.result() for future in futures)
+
+    # Directory times change as their contents are written, so set them last
+    for src_dir, dest_dir in reversed(dirs):
+        shutil.copystat(src_dir, dest_dir)
+    return copied
+
+
+def transfer(src, dest, include=None, exclude=None, link=True):
+    """Copy the contents of a directory to another, as ``rsync -a``.
+
+    Files are copied on the transfer thread pool. When the source and
+    destination share a filesystem, regular files are hard linked instead
+    of copied, if ``link`` is set.
+
+    Args:
+        src (str): Source directory.
+        dest (str): Destination directory, created if necessary.
+        include (list, optional): Include patterns, see ``FilterRules``.
+        exclude (list, optional): Exclude patterns, see ``FilterRules``.
+        link (bool, optional): Hard link files on the same filesystem.
+
+    Returns:
+        (int): Number of files transferred.
+
+    Raises:
+        OSError: If any file cannot be transferred.
+        ValueError: If the destination is the source directory.
+    """
+    rules = FilterRules(include, exclude)
+    os.makedirs(dest, exist_ok=True)
+
+    mode = "hardlink" if link and \
+        os.stat(src).st_dev == os.stat(dest).st_dev else "copy"
+    return _copy_tree(src, dest, rules.included, lambda rel: mode)
+
+
+def populate(src, dest, mode, copy_suffix=".j2"):
+    """Populate a directory from another by linking or cloning its files.
+
+    Files ending with ``copy_suffix``, which are about to be rewritten, are
+    always copied.
+
+    Args:
+        src (str): Source directory, such as a template snapshot.
+        dest (str): Destination directory, created if necessary.
+        mode (str): One of ``MODES``, how other regular files are
+            transferred.
+        copy_suffix (str, optional): Suffix of files that are always copied.
+
+    Returns:
+        (int): Number of files transferred.
+
+    Raises:
+        OSError: If any file cannot be transferred.
+    """
+    if mode not in MODES:
+        raise ValueError("Unknown transfer mode {}".format(mode))
+
+    return _copy_tree(src, dest, lambda rel, is_dir: True,
+                      lambda rel: "copy" if rel.endswith(copy_suffix)
+                      else mode)
+
+
+def remove_tree(path):
+    """Remove a directory tree, unlinking files in parallel.
+
+    Args:
+        path (str): Directory to remove.
+
+    Raises:
+        OSError: If the tree cannot be removed.
+    """
+    if os.path.islink(path) or not os.path.isdir(path):
+        os.unlink(path)
+        return
+
+    executor = get_executor()
+    futures = list()
+    dirs = list()
+
+    for root, subdirs, files in os.walk(path):
+        dirs.append(root)
+
+        # Links to directories are listed as directories but not walked
+        for name in files + [d for d in subdirs
+                             if os.path.islink(os.path.join(root, d))]:
+            futures.append(executor.submit(os.unlink,
+                                           os.path.join(root, name)))
+
+    for future in futures:
+        future.result()
+
+    for directory in reversed(dirs):
+        os.rmdir(directory)
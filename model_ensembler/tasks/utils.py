@@ -1,4 +1,5 @@
 import asyncio
+import collections
 import functools
 import inspect
 import logging
@@ -7,7 +8,10 @@ import types
 
 from datetime import datetime
 
-from model_ensembler.utils import Arguments
+from model_ensembler.metrics import metrics
+from model_ensembler.shell import shell_pool
+from model_ensembler.utils import \
+    Arguments, command_path_ctx, get_cwd, run_io
 
 """Task utilities
 
@@ -15,6 +19,11 @@ This module contains implementation and functionality relating generally to
 tasks
 """
 
+OUTPUT_CHUNK = 65536
+OUTPUT_LIMIT = 65536
+# Bytes of output buffered before being written to a command log
+LOG_BUFFER = 1048576
+
 
 def flight_task(func, check=True):
     """Decorator for making func as a task, providing context preprocessing.
@@ -62,54 +71,203 @@ check_task = functools.partial(flight_task, check=True)
 processing_task = functools.partial(flight_task, check=False)
 
 
-async def execute_command(cmd, cwd=None, log=False, shell=None):
+class OutputCapture(object):
+    """Memory bounded capture of command output.
+
+    Output is written to a log file, if requested, in buffers of
+    ``LOG_BUFFER`` bytes on the I/O pool, see ``utils.run_io``, so the event
+    loop never waits on the file. Only the last ``limit`` bytes are held in
+    memory for the result.
+
+    Args:
+        log_name (str, optional): Path of a log file to write all output to,
+            created on the first output.
+        limit (int, optional): Maximum number of trailing bytes to retain,
+            or None to retain everything.
+    """
+
+    def __init__(self, log_name=None, limit=None):
+        self._log_name = log_name
+        self._limit = limit
+        self._fh = None
+        self._log_chunks = list()
+        self._log_size = 0
+        self._log_write = None
+        self._chunks = collections.deque()
+        self._size = 0
+        self.truncated = False
+
+    def write(self, data):
+        """Accept a chunk of output.
+
+        Args:
+            data (bytes): Output chunk.
+        """
+        if not data:
+            return
+
+        if self._log_name:
+            self._log_chunks.append(data)
+            self._log_size += len(data)
+
+            if self._log_size >= LOG_BUFFER:
+                self._flush_log()
+
+        self._chunks.append(data)
+        self._size += len(data)
+
+        while self._limit is not None and self._size > self._limit:
+            excess = self._size - self._limit
+            head = self._chunks[0]
+            self.truncated = True
+
+            if len(head) <= excess:
+                self._chunks.popleft()
+                self._size -= len(head)
+            else:
+                self._chunks[0] = head[excess:]
+                self._size -= excess
+
+    def _flush_log(self):
+        """Hand the buffered output to the I/O pool, after earlier writes."""
+        data = b"".join(self._log_chunks)
+        self._log_chunks = list()
+        self._log_size = 0
+        self._log_write = asyncio.ensure_future(
+            self._write_log(self._log_write, data))
+
+    async def _write_log(self, previous, data):
+        """Write output to the log file once the previous write is done.
+
+        Args:
+            previous (object): Future of the previous write, or None.
+            data (bytes): Output to write.
+        """
+        if previous:
+            await previous
+
+        def write():
+            if not self._fh:
+                self._fh = open(self._log_name, "wb")
+            self._fh.write(data)
+
+        await run_io(write)
+
+    async def drain(self):
+        """Wait for log writes in progress, so output can't outpace them."""
+        if self._log_write:
+            await asyncio.shield(self._log_write)
+
+    async def close(self):
+        """Finish the log file, if one was written."""
+        try:
+            if self._log_chunks:
+                self._flush_log()
+            await self.drain()
+        finally:
+            if self._fh:
+                await run_io(self._fh.close)
+                self._fh = None
+                logging.info("Command log written to {}".
+                             format(self._log_name))
+
+    @property
+    def output(self):
+        """ Property decorator for the retained output.
+
+        Returns:
+            (bytes): Trailing output, at most ``limit`` bytes.
+        """
+        return b"".join(self._chunks)
+
+
+async def execute_command(cmd, cwd=None, log=False, shell=None,
+                          limit=OUTPUT_LIMIT):
     """Standard handling for calling external command.
 
+    Output is streamed rather than collected once the command exits, so
+    memory use does not grow with the verbosity of the command.
+
     Args:
         cmd (str): The relative path of the command being called to cwd.
         cwd (str, optional): The current working directory to call the cmd
-            from, passed to subprocess.
+            from, passed to subprocess. Relative to, and defaulting to, the
+            base directory of the current batch, see ``utils.get_cwd``.
         log (bool, optional): If true, output stdout/stderr to logfile in cwd.
         shell (str, optional): Which shell to ask subprocess to invoke when
             processing the command, will default to bash internally.
+        limit (int, optional): Maximum number of trailing bytes of output to
+            return, None returns all output for commands that are parsed.
 
     Returns:
         (object): Namespace containing the returncode, stdout and stderr from
             the process that was invoked.
     """
 
-    logging.debug("Executing command {0}, cwd {1}".
-                  format(cmd, cwd if cwd else "unset"))
+    cwd = os.path.join(get_cwd(), cwd) if cwd else get_cwd()
+    logging.debug("Executing command {0}, cwd {1}".format(cmd, cwd))
 
     start_dt = datetime.now()
 
     args = Arguments()
     shell = args.shell if not shell else shell
 
-    proc = await asyncio.create_subprocess_shell(
-        cmd,
-        executable=shell,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.STDOUT,
-        cwd=cwd)
+    paths = [path for path in (args.command_path, command_path_ctx.get())
+             if path]
 
-    (stdout, stderr) = await proc.communicate()
-    await proc.wait()
+    env = None
+    if paths:
+        env = dict(os.environ,
+                   PATH=os.pathsep.join(paths +
+                                        [os.environ.get("PATH", "")]))
 
-    if log and stdout:
+    log_name = None
+    if log:
         log_name = "execute_command.{}.log".\
             format(start_dt.strftime("%H%M%S.%f"))
+        log_name = os.path.join(cwd, log_name)
+
+    capture = OutputCapture(log_name, limit)
+
+    async def output(data):
+        # Output is held up whilst the log file catches up
+        capture.write(data)
+        await capture.drain()
+
+    pooled = shell_pool.enabled and shell == args.shell
+    mode = "shell_pool" if pooled else "subprocess"
+    metrics.inc("commands", mode=mode)
+
+    try:
+        with metrics.timer("command", mode=mode):
+            if pooled:
+                returncode = await shell_pool.run(cmd, cwd, output,
+                                                  shell, env)
+            else:
+                proc = await asyncio.create_subprocess_shell(
+                    cmd,
+                    executable=shell,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.STDOUT,
+                    cwd=cwd,
+                    env=env)
 
-        if cwd:
-            log_name = os.path.join(cwd, log_name)
+                while True:
+                    data = await proc.stdout.read(OUTPUT_CHUNK)
+                    if not data:
+                        break
+                    await output(data)
 
-        with open(log_name, "w") as fh:
-            fh.write(stdout.decode())
+                returncode = await proc.wait()
+    finally:
+        await capture.close()
 
-        logging.info("Command log written to {}".format(log_name))
+    if capture.truncated:
+        logging.debug("Command output truncated to last {} bytes".
+                      format(limit))
 
     ret = types.SimpleNamespace(
-        returncode=proc.returncode, stdout=stdout, stderr=stderr)
+        returncode=returncode, stdout=capture.output, stderr=None)
 
     if ret.returncode != 0:
         logging.warning("Command returned err: {}".format(ret.stderr))
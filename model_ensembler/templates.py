@@ -7,58 +7,205 @@ import shutil
 import jinja2
 
 from model_ensembler.exceptions import TemplatingError
-from model_ensembler.utils import Arguments
+from model_ensembler.metrics import metrics
+from model_ensembler.tasks.transfer import populate, transfer
+from model_ensembler.utils import Arguments, get_cwd, run_io
 
 
-async def prepare_run_directory(batch, run):
+_environments = dict()
+_snapshots = set()
+
+
+def get_templatedir(batch):
+    """Resolve the template directory of a batch.
+
+    Args:
+        batch (object): Whole batch configuration.
+
+    Returns:
+        (str): Template directory, relative paths being relative to the base
+            directory of the batch.
+    """
+    return os.path.join(get_cwd(), batch.templatedir)
+
+
+def get_snapshot_dir(batch):
+    """Resolve the directory holding the template snapshot of a batch.
+
+    Args:
+        batch (object): Whole batch configuration.
+
+    Returns:
+        (str): Snapshot directory within the base directory of the batch.
+    """
+    return os.path.join(get_cwd(), ".{}.template".format(batch.name))
+
+
+async def snapshot_template_directory(batch):
+    """Take a snapshot of the batch template directory for its runs.
+
+    For batches whose ``prepare`` mode links or clones files, the template
+    directory is copied once into the base directory, from which each run
+    directory is then populated. Files unchanged since a previous snapshot
+    are kept as they were.
+
+    Args:
+        batch (object): Whole batch configuration.
+
+    Raises:
+        TemplatingError: If the template directory cannot be copied.
+    """
+    if not batch.prepare or batch.prepare == "copy":
+        return
+
+    templatedir = get_templatedir(batch)
+    snapshot = get_snapshot_dir(batch)
+    logging.info("Snapshotting {} to {} for {} preparation".
+                 format(templatedir, snapshot, batch.prepare))
+
+    try:
+        await run_io(transfer, templatedir, snapshot, link=False)
+    except OSError as e:
+        raise TemplatingError("Could not snapshot template directory {}: {}".
+                              format(batch.templatedir, e))
+    _snapshots.add(snapshot)
+
+
+def recopy_templates(templatedir, template_list, run):
+    """Copy the batch templates into an existing run directory.
+
+    Args:
+        templatedir (str): Directory containing the batch templates.
+        template_list (list): Paths to template sources.
+        run (object): Specific run configuration.
+    """
+    for tmpl_file in template_list:
+        src_path = os.path.join(templatedir, tmpl_file)
+        dst_path = shutil.copy(src_path, os.path.join(run.dir, tmpl_file))
+        logging.info("Re-copied {} to {} for template regeneration".
+                     format(src_path, dst_path))
+
+
+async def prepare_run_directory(batch, run, pickup=None):
     """ Preparing directory for each run from batch templates
 
+    Directory I/O runs on the I/O pool, see ``run_io``.
+
     Args:
         batch (object): Whole batch configuration.
         run (object): Specific run configuration.
+        pickup (bool, optional): Reuse an existing run directory, defaulting
+            to the ``pickup`` argument.
 
     Raises:
         TemplatingError: If template directory cannot be moved from source
                         to destination.
     """
     args = Arguments()
+    pickup = args.pickup if pickup is None else pickup
+    templatedir = get_templatedir(batch)
 
-    if args.pickup and os.path.exists(run.dir):
+    if pickup and os.path.exists(run.dir):
         logging.info("Picked up previous job directory for run {}".
                      format(run.id))
 
-        for tmpl_file in batch.templates:
-            src_path = os.path.join(batch.templatedir, tmpl_file)
-            dst_path = shutil.copy(src_path, os.path.join(run.dir, tmpl_file))
-            logging.info("Re-copied {} to {} for template regeneration".
-                         format(src_path, dst_path))
+        await run_io(recopy_templates, templatedir, batch.templates, run)
     else:
         if os.path.exists(run.dir):
             raise TemplatingError("Run directory {} already exists".
                                   format(run.dir))
 
-        os.makedirs(run.dir, mode=0o775)
+        await run_io(os.makedirs, run.dir, mode=0o775)
+
+        snapshot = get_snapshot_dir(batch)
 
-        cmd = "rsync -aXE {}/ {}/".format(batch.templatedir, run.dir)
+        if snapshot in _snapshots:
+            logging.info("Populating {} from {} by {}".
+                         format(run.dir, snapshot, batch.prepare))
+
+            try:
+                await run_io(populate, snapshot, run.dir, batch.prepare)
+            except OSError as e:
+                raise TemplatingError("Could not populate {} from {}: {}".
+                                      format(run.dir, snapshot, e))
+            return
+
+        cmd = "rsync -aXE {}/ {}/".format(templatedir, run.dir)
         logging.info(cmd)
-        proc = await asyncio.create_subprocess_exec(*shlex.split(cmd))
-        rc = await proc.wait()
+        metrics.inc("commands", mode="template_copy")
+
+        with metrics.timer("command", mode="template_copy"):
+            proc = await asyncio.create_subprocess_exec(*shlex.split(cmd))
+            rc = await proc.wait()
 
         if rc != 0:
             raise TemplatingError("Could not grab template directory {} to {}".
-                                  format(batch.templatedir, run.dir))
+                                  format(templatedir, run.dir))
+
+
+def get_environment(templatedir):
+    """Retrieve the shared Jinja2 environment for a template directory.
+
+    Templates are compiled once by the environment and reused for every run,
+    being recompiled only if their source changes. If the
+    ``template_cache`` argument is set, compiled bytecode is also kept on
+    disk there, so later invocations skip compilation.
+
+    Args:
+        templatedir (str): Directory containing the batch templates.
+
+    Returns:
+        (object): jinja2.Environment loading from the template directory.
+    """
+    templatedir = os.path.abspath(templatedir)
+
+    if templatedir not in _environments:
+        args = Arguments()
+        bytecode_cache = None
+
+        if args.template_cache:
+            os.makedirs(args.template_cache, exist_ok=True)
+            bytecode_cache = jinja2.FileSystemBytecodeCache(
+                args.template_cache)
 
+        _environments[templatedir] = jinja2.Environment(
+            loader=jinja2.FileSystemLoader(templatedir),
+            bytecode_cache=bytecode_cache)
+    return _environments[templatedir]
 
-def process_templates(run, template_list):
+
+async def render_templates(run, template_list, templatedir=None):
+    """Render templates on the I/O pool, away from the event loop.
+
+    Args:
+        run (object): Specific run configuration.
+        template_list (list): Paths to template sources.
+        templatedir (str, optional): See ``process_templates``, relative to
+            the base directory of the batch.
+
+    Raises:
+        TemplatingError: If cannot template using the provided format.
+    """
+    if templatedir:
+        templatedir = os.path.join(get_cwd(), templatedir)
+    await run_io(process_templates, run, template_list, templatedir)
+
+
+def process_templates(run, template_list, templatedir=None):
     """Render templates based on provided context.
 
     Args:
         run (object): Specific run configuration.
         template_list (list): Paths to template sources.
+        templatedir (str, optional): Directory the run's templates were
+            copied from, whose compiled templates are shared between runs.
+            If not given, each run's copy is compiled.
 
     Raises:
         TemplatingError: If cannot template using the provided format.
     """
+    env = get_environment(templatedir) if templatedir else None
+
     for tmpl_file in template_list:
         if tmpl_file[-3:] != ".j2":
             raise TemplatingError("{} doe not appear to be a Jinja2 template "
@@ -66,13 +213,20 @@ def process_templates(run, template_list):
 
         try:
             tmpl_path = os.path.join(run.dir, tmpl_file)
-            with open(tmpl_path, "r") as fh:
-                tmpl_data = fh.read()
-
             dst_file = tmpl_path[:-3]
             logging.info("Templating {} to {}".format(tmpl_path, dst_file))
-            tmpl = jinja2.Template(tmpl_data)
+
+            if env:
+                tmpl = env.get_template(tmpl_file.replace(os.sep, "/"))
+            else:
+                with open(tmpl_path, "r") as fh:
+                    tmpl = jinja2.Template(fh.read())
             dst_data = tmpl.render(run=run)
+
+            # Never write through a file linked from a template snapshot
+            if os.path.lexists(dst_file):
+                os.unlink(dst_file)
+
             with open(dst_file, "w+") as fh:
                 fh.write(dst_data)
             os.chmod(dst_file, os.stat(tmpl_path).st_mode)
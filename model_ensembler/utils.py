@@ -1,3 +1,7 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import functools
 import logging
 import logging.handlers
 import os
@@ -9,6 +13,64 @@ Classes and methods for general purpose functionality
 """
 
 
+cwd_ctx = contextvars.ContextVar("cwd", default=None)
+# Cluster backend module of the current batch, here so tasks resolve the
+# backend of the ensemble they run for
+cluster_ctx = contextvars.ContextVar("cluster")
+# Directory searched for commands ahead of --command-path, for backends
+# providing their own commands
+command_path_ctx = contextvars.ContextVar("command_path", default=None)
+_io_executor = None
+
+
+def get_cwd():
+    """Retrieve the working directory for the current batch.
+
+    Batches run concurrently on the event loop, so rather than changing the
+    process working directory, each batch sets its base directory in
+    ``cwd_ctx`` for the tasks and commands it runs.
+
+    Returns:
+        (str): Base directory of the current batch, otherwise the process
+            working directory.
+    """
+    return cwd_ctx.get() or os.getcwd()
+
+
+def get_io_executor():
+    """Retrieve the bounded pool used for blocking file I/O.
+
+    Run directories are prepared and rendered on it, and command logs
+    written, away from the event loop.
+
+    Returns:
+        (object): concurrent.futures.ThreadPoolExecutor, sized by the
+            ``io_workers`` argument.
+    """
+    global _io_executor
+
+    if _io_executor is None:
+        _io_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(Arguments().io_workers, 1),
+            thread_name_prefix="io")
+    return _io_executor
+
+
+async def run_io(func, *args, **kwargs):
+    """Run a blocking function on the I/O pool, away from the event loop.
+
+    Args:
+        func (callable): Function to run.
+        *args: Positional arguments for func.
+        **kwargs: Keyword arguments for func.
+
+    Returns:
+        (object): Result of func.
+    """
+    return await asyncio.get_running_loop().run_in_executor(
+        get_io_executor(), functools.partial(func, *args, **kwargs))
+
+
 class Arguments(object):
     """Singleton implementation of the arguments as an immutable object"""
 
@@ -29,6 +91,88 @@ class Arguments(object):
         return getattr(self.instance, item)
 
 
+class RunContext(object):
+    """Compact layered view of the variables available to a run.
+
+    Variables are looked up through a chain of mappings, most specific
+    first, as ``collections.ChainMap`` does. Layers such as the ensemble
+    vars and batch fields are shared between runs, so each run only adds a
+    small overlay of its own fields rather than a copy of every variable.
+
+    Variables are read as attributes, as with the namedtuple previously used
+    for runs, or by key. Contexts are immutable, so a layer is never
+    modified through a context and fields cannot leak between runs.
+
+    Args:
+        *maps (dict): Mappings of variables, most specific first.
+    """
+    __slots__ = ("_maps",)
+
+    def __init__(self, *maps):
+        object.__setattr__(self, "_maps", maps)
+
+    def _new_child(self, *fields):
+        """Create a context with fields overlaid on this one.
+
+        Args:
+            *fields (dict): Variables taking precedence over this context's,
+                most specific first.
+
+        Returns:
+            (object): New RunContext sharing this context's layers.
+        """
+        return RunContext(*fields, *self._maps)
+
+    def _asdict(self):
+        """Flatten the context into a single dictionary.
+
+        Returns:
+            (dict): Variables visible through the context.
+        """
+        res = dict()
+        for m in reversed(self._maps):
+            res.update(m)
+        return res
+
+    def __getattr__(self, item):
+        for m in self._maps:
+            if item in m:
+                return m[item]
+        raise AttributeError("Run has no variable {}".format(item))
+
+    def __setattr__(self, key, value):
+        raise AttributeError("Run variables cannot be modified")
+
+    def __getitem__(self, item):
+        for m in self._maps:
+            if item in m:
+                return m[item]
+        raise KeyError(item)
+
+    def __contains__(self, item):
+        return any(item in m for m in self._maps)
+
+    def __iter__(self):
+        return iter(self._asdict())
+
+    def __len__(self):
+        return len(set().union(*self._maps))
+
+    def __eq__(self, other):
+        if isinstance(other, RunContext):
+            return self._asdict() == other._asdict()
+        return NotImplemented
+
+    __hash__ = None
+
+    def __reduce__(self):
+        return RunContext, self._maps
+
+    def __repr__(self):
+        return "Run({})".format(", ".join(
+            "{}={!r}".format(k, v) for k, v in self._asdict().items()))
+
+
 def background_fork(double=False):
     """Allows for the calling process to fork into the background.
 
@@ -0,0 +1,6 @@
+from model_ensembler.cli import parse_args
+
+# Arguments is a process wide singleton, so establish it once with timeouts
+# that keep the asynchronous machinery responsive under test
+parse_args(["-ct", "0", "-st", "0", "-rt", "0", "-et", "0",
+            "test.yaml", "dummy"])
@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+from model_ensembler import batcher
+from model_ensembler.config import Batch
+
+
+class TestRunBatches:
+    def test_dependencies(self):
+        """
+        Validate batches follow the one before unless they name dependencies
+        """
+        batches = [Batch("a"), Batch("b"), Batch("c", depends_on=[]),
+                   Batch("d", depends_on=["a", "c"]),
+                   Batch("e", depends_on="b")]
+
+        assert batcher.batch_dependencies(batches) == \
+            [[], [0], [], [0, 2], [1]]
+
+        with pytest.raises(RuntimeError):
+            batcher.batch_dependencies([Batch("a", depends_on="b"),
+                                        Batch("b")])
+
+    def test_concurrent(self, monkeypatch):
+        """
+        Validate independent batches overlap and dependents wait, each with
+        its own context
+        """
+        trace = []
+
+        async def execution(batch, repeat=False):
+            batcher.batch_ctx.set(batch)
+            trace.append(("start", batch.name))
+            await asyncio.sleep(0.01 if batch.name == "a" else 0.02)
+            assert batcher.batch_ctx.get() is batch
+            trace.append(("end", batch.name))
+
+        monkeypatch.setattr(batcher, "do_batch_execution", execution)
+
+        asyncio.run(batcher.run_batches([
+            Batch("a"), Batch("b", depends_on=[]),
+            Batch("c", depends_on=["a", "b"])]))
+
+        assert trace == [("start", "a"), ("start", "b"), ("end", "a"),
+                         ("end", "b"), ("start", "c"), ("end", "c")]
+
+
+class TestBatchExecutor:
+    def test_multiplexed(self, monkeypatch):
+        """
+        Validate executors run concurrently on one loop, each with its own
+        context
+        """
+        seen = []
+
+        async def batches(cfg_batches):
+            await asyncio.sleep(0)
+            seen.append((batcher.run_ctx.get().ensemble,
+                         batcher.extra_ctx.get()["extra"],
+                         batcher.jobs_ctx.get() is not None,
+                         batcher.cluster_ctx.get().__name__))
+
+        monkeypatch.setattr(batcher, "run_batches", batches)
+
+        def config(name, maxjobs):
+            return type("Config", (), {"vars": {"ensemble": name},
+                                       "maxjobs": maxjobs,
+                                       "batches": [],
+                                       "pre_process": [],
+                                       "post_process": []})()
+
+        executors = [
+            batcher.BatchExecutor(config("a", 0), "dummy", {"extra": 1}),
+            batcher.BatchExecutor(config("b", 2), "local", {"extra": 2}),
+        ]
+
+        async def run():
+            await asyncio.gather(*(e.execute() for e in executors))
+            return batcher.run_ctx.get(None)
+
+        assert asyncio.run(run()) is None
+        assert sorted(seen) == [
+            ("a", 1, False, "model_ensembler.cluster.dummy"),
+            ("b", 2, True, "model_ensembler.cluster.local")]
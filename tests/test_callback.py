@@ -0,0 +1,64 @@
+import asyncio
+import collections
+import os
+import subprocess
+
+from model_ensembler.callback import CallbackServer
+from model_ensembler.cluster import JobPoller
+
+Run = collections.namedtuple("Run", ["id", "dir"])
+
+
+class TestCallbackServer:
+    def test_job_script_notifies_poller(self, tmp_path):
+        """
+        Validate an injected job script wakes its waiter via the socket
+        """
+        job_file = os.path.join(tmp_path, "job.sh")
+        with open(job_file, "w") as fh:
+            fh.write("#!/bin/bash\n#SBATCH --job-name=x\nexit 3\n")
+        os.chmod(job_file, 0o755)
+
+        async def find_ids(job_ids):
+            return dict()
+
+        async def run():
+            server = CallbackServer("unix:{}".format(
+                os.path.join(tmp_path, "cb.sock")))
+            await server.start()
+
+            run = Run("tst-0", str(tmp_path))
+            server.inject(run, job_file)
+            server.watch(run, 42, poller)
+
+            proc = await asyncio.create_subprocess_exec(job_file)
+            await proc.wait()
+
+            job = await asyncio.wait_for(
+                poller.wait_for(42, ("COMPLETED", "FAILED")), 10)
+            await server.stop()
+            return job
+
+        poller = JobPoller(find_ids)
+        job = asyncio.run(run())
+
+        assert job.state == "FAILED"
+
+    def test_injects_after_directives(self, tmp_path):
+        """
+        Validate the helper does not break up scheduler directives
+        """
+        job_file = os.path.join(tmp_path, "job.sh")
+        with open(job_file, "w") as fh:
+            fh.write("#!/bin/bash\n#SBATCH --nodes=1\n\n#SBATCH -t 1\n"
+                     "echo hi\n")
+
+        server = CallbackServer("tcp:127.0.0.1:0")
+        server.inject(Run("tst-0", str(tmp_path)), job_file)
+
+        with open(job_file) as fh:
+            data = fh.read()
+
+        assert data.index("#SBATCH -t 1") < data.index("_me_callback")
+        assert data.index("_me_callback") < data.index("echo hi")
+        assert subprocess.run(["bash", "-n", job_file]).returncode == 0
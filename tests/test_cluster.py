@@ -0,0 +1,359 @@
+import asyncio
+import collections
+import os
+import types
+
+import pytest
+
+from model_ensembler.cluster import \
+    ArraySubmitter, Job, JobCounter, JobPoller, TokenBucket
+from model_ensembler.cluster import dummy, local, slurm
+
+
+class TestJobPoller:
+    def test_single_query_per_poll(self):
+        """
+        Validate that many waiting runs share one backend query per poll
+        """
+        calls = []
+        polls = {"n": 0}
+
+        async def find_ids(job_ids):
+            calls.append(sorted(job_ids))
+            polls["n"] += 1
+            state = "RUNNING" if polls["n"] < 3 else "COMPLETED"
+            return {j: Job(j, state, True, False) for j in job_ids}
+
+        poller = JobPoller(find_ids)
+
+        async def run():
+            return await asyncio.gather(*[
+                poller.wait_for(job_id, ("COMPLETED",))
+                for job_id in range(50)])
+
+        jobs = asyncio.run(run())
+
+        assert all(job.state == "COMPLETED" for job in jobs)
+        assert len(calls) == 3
+        assert calls[0] == sorted(str(j) for j in range(50))
+
+    def test_update_resolves_waiter(self):
+        """
+        Validate that pushed updates wake waiters without a backend query
+        """
+        async def find_ids(job_ids):
+            return dict()
+
+        poller = JobPoller(find_ids)
+
+        async def run():
+            waiter = asyncio.ensure_future(poller.wait_for(1, ("FAILED",)))
+            await asyncio.sleep(0)
+            poller.update(1, Job("1", "FAILED", True, True))
+            return await waiter
+
+        assert asyncio.run(run()).state == "FAILED"
+
+    def test_reused_id_not_stale(self):
+        """
+        Validate a finished job's state does not resolve a later wait on the
+        same job ID
+        """
+        states = ["COMPLETED"]
+
+        async def find_ids(job_ids):
+            return {j: Job(j, states[0], True, True) for j in job_ids}
+
+        poller = JobPoller(find_ids)
+
+        async def run():
+            first = await poller.wait_for("a", ("COMPLETED",))
+            states[0] = "RUNNING"
+            poller.update("a", Job("a", "COMPLETED", True, True))
+            second = await poller.wait_for("a", ("RUNNING", "COMPLETED"))
+            return first, second
+
+        first, second = asyncio.run(run())
+        assert first.state == "COMPLETED"
+        assert second.state == "RUNNING"
+
+
+class TestSlurmFindIds:
+    def test_parses_multiple_jobs(self, monkeypatch):
+        """
+        Validate one sacct call is parsed into jobs keyed by ID
+        """
+        commands = []
+
+        async def execute_command(cmd, *args, **kwargs):
+            commands.append(cmd)
+            return types.SimpleNamespace(returncode=0, stdout=(
+                "101|tst1-0|COMPLETED|2024-01-01T00:00:00|Unknown\n"
+                "102|tst1-1|CANCELLED by 1000|Unknown|Unknown\n"
+                "garbage\n").encode(), stderr=None)
+
+        monkeypatch.setattr(slurm, "execute_command", execute_command)
+        jobs = asyncio.run(slurm.find_ids([101, 102, 103]))
+
+        assert len(commands) == 1
+        assert "-j 101,102,103 " in commands[0]
+        assert set(jobs.keys()) == {"101", "102"}
+        assert jobs["102"].state == "CANCELLED"
+
+    def test_expands_pending_array_tasks(self, monkeypatch):
+        """
+        Validate array tasks are queried by array job and ranges expanded
+        """
+        commands = []
+
+        async def execute_command(cmd, *args, **kwargs):
+            commands.append(cmd)
+            return types.SimpleNamespace(returncode=0, stdout=(
+                "200_0|tst1|RUNNING|Unknown|Unknown\n"
+                "200_[1-2,4%2]|tst1|PENDING|Unknown|Unknown\n").encode(),
+                stderr=None)
+
+        monkeypatch.setattr(slurm, "execute_command", execute_command)
+        jobs = asyncio.run(slurm.find_ids(["200_0", "200_1", "200_4"]))
+
+        assert "-j 200 " in commands[0]
+        assert set(jobs.keys()) == {"200_0", "200_1", "200_2", "200_4"}
+        assert jobs["200_4"].state == "PENDING"
+
+
+class TestArraySubmitter:
+    def test_coalesces_runs(self):
+        """
+        Validate that a full set of pending runs is submitted as one array
+        """
+        submissions = []
+
+        async def submit_array(ctxs, script=None, limit=None):
+            submissions.append((list(ctxs), script, limit))
+            return ["300_{}".format(i) for i in range(len(ctxs))]
+
+        submitter = ArraySubmitter(submit_array, "job.sh", 4, 2)
+
+        async def run():
+            return await asyncio.gather(*[submitter.submit(ctx)
+                                          for ctx in "abcd"])
+
+        assert asyncio.run(run()) == ["300_0", "300_1", "300_2", "300_3"]
+        assert submissions == [(list("abcd"), "job.sh", 2)]
+
+    def test_limit_across_arrays(self):
+        """
+        Validate later arrays are throttled to the capacity left by earlier
+        ones, which is handed back to them as tasks finish
+        """
+        submissions = []
+        throttles = []
+
+        async def submit_array(ctxs, script=None, limit=None):
+            submissions.append((list(ctxs), limit))
+            return ["{}_{}".format(len(submissions), i)
+                    for i in range(len(ctxs))]
+
+        async def throttle_array(job_id, limit):
+            throttles.append((job_id, limit))
+
+        submitter = ArraySubmitter(submit_array, "job.sh", 4, 2,
+                                   throttle_array=throttle_array)
+
+        async def run():
+            first = await asyncio.gather(*[submitter.submit(ctx)
+                                           for ctx in "abcd"])
+            submitter.finished(first[0])
+            submitter.finished(first[1])
+
+            second = [asyncio.ensure_future(submitter.submit(ctx))
+                      for ctx in "ef"]
+            await asyncio.sleep(0.01)
+            assert len(submissions) == 1
+
+            submitter.finished(first[2])
+            await asyncio.gather(*second)
+            submitter.finished(first[3])
+            await asyncio.sleep(0)
+
+        asyncio.run(run())
+
+        assert submissions == [(list("abcd"), 2), (list("ef"), 1)]
+        assert throttles == [("2_0", 2)]
+
+    def test_short_result_fails_array(self):
+        """
+        Validate that too few task IDs fail every run rather than hanging
+        """
+        async def submit_array(ctxs, script=None, limit=None):
+            return ["301_0"]
+
+        submitter = ArraySubmitter(submit_array, "job.sh", 3)
+
+        async def run():
+            return await asyncio.wait_for(asyncio.gather(
+                *[submitter.submit(ctx) for ctx in "abc"]), 1)
+
+        assert asyncio.run(run()) == [None, None, None]
+
+
+class TestTokenBucket:
+    def test_limits_rate_after_burst(self):
+        """
+        Validate that submissions beyond the burst are held to the rate
+        """
+        bucket = TokenBucket(rate=50, burst=2)
+
+        async def run():
+            return [await bucket.acquire() for _ in range(5)]
+
+        waits = asyncio.run(run())
+
+        assert waits[0] < 0.01 and waits[1] < 0.01
+        assert sum(waits) >= 0.05
+
+    def test_unlimited(self):
+        """
+        Validate a zero rate never waits
+        """
+        bucket = TokenBucket(rate=0)
+
+        assert asyncio.run(bucket.acquire()) == 0.
+
+
+class TestJobCounter:
+    def test_reservations_enforce_limit(self):
+        """
+        Validate concurrent checks cannot pass for the same remaining slot
+        """
+        calls = []
+
+        async def current_jobs(ctx, match):
+            calls.append(match)
+            return [{"id": "1", "name": "tst-0", "state": "RUNNING"}]
+
+        counter = JobCounter(current_jobs)
+        ctx = types.SimpleNamespace(cluster="short")
+
+        async def run():
+            return await asyncio.gather(*[
+                counter.check(ctx, "tst", 3, reserve=True)
+                for _ in range(4)])
+
+        assert sorted(asyncio.run(run())) == [False, False, True, True]
+
+        counter.submitted(ctx, "tst", "2")
+        counter.submitted(ctx, "tst", None)
+        counter.finished(ctx, "tst", "1")
+        assert counter._view(ctx, "tst").count == 1
+
+
+class TestDummyBackend:
+    def test_runs_and_records_failures(self, tmp_path):
+        """
+        Validate dummy jobs complete or fail based on their return code
+        """
+        Run = collections.namedtuple("Run", ["id", "dir"])
+        runs = list()
+
+        for idx, rc in enumerate((0, 1)):
+            run_dir = os.path.join(tmp_path, "dmy-{}".format(idx))
+            os.makedirs(run_dir)
+            with open(os.path.join(run_dir, "job.sh"), "w") as fh:
+                fh.write("#!/bin/sh\nexit {}\n".format(rc))
+            os.chmod(os.path.join(run_dir, "job.sh"), 0o755)
+            runs.append(Run("dmy-{}".format(idx), run_dir))
+
+        async def run():
+            job_ids = [await dummy.submit_job(r, script="job.sh")
+                       for r in runs]
+            return [await dummy.poller.wait_for(job_id, dummy.FINISH_STATES)
+                    for job_id in job_ids]
+
+        jobs = asyncio.run(run())
+
+        assert [job.state for job in jobs] == ["COMPLETED", "FAILED"]
+        assert asyncio.run(dummy.current_jobs(None, "dmy")) == []
+
+    def test_unique_ids(self, tmp_path):
+        """
+        Validate runs sharing an ID, as across ensembles with one batch
+        name, are submitted as separate jobs
+        """
+        Run = collections.namedtuple("Run", ["id", "dir"])
+        with open(os.path.join(tmp_path, "job.sh"), "w") as fh:
+            fh.write("#!/bin/sh\nexit 0\n")
+        os.chmod(os.path.join(tmp_path, "job.sh"), 0o755)
+        run = Run("twin-0", str(tmp_path))
+
+        async def run_twice():
+            job_ids = [await dummy.submit_job(run, script="job.sh")
+                       for _ in range(2)]
+            await asyncio.gather(*(
+                dummy.poller.wait_for(job_id, dummy.FINISH_STATES)
+                for job_id in job_ids))
+            return job_ids
+
+        job_ids = asyncio.run(run_twice())
+
+        assert len(set(job_ids)) == 2
+        assert all(job_id.startswith("twin-0") for job_id in job_ids)
+
+
+class TestLocalBackend:
+    def test_packs_onto_slots(self):
+        """
+        Validate requests start only when cores and memory are free
+        """
+        slots = local.SlotScheduler(4, 1024)
+        started = []
+
+        async def job(name, cores, memory):
+            await slots.acquire(*slots.clamp(cores, memory))
+            started.append(name)
+            await asyncio.sleep(0.05)
+            await slots.release(*slots.clamp(cores, memory))
+
+        async def run():
+            await asyncio.gather(job("a", 3, 256), job("b", 2, 256),
+                                 job("c", 1, 768), job("d", 8, None))
+
+        asyncio.run(run())
+
+        assert started == ["a", "c", "b", "d"]
+
+    def test_cancel_terminates_job(self, tmp_path):
+        """
+        Validate that cancelling a running job terminates its process
+        """
+        script = tmp_path / "job.sh"
+        script.write_text("#!/bin/bash\necho $$ >pid\nsleep 30\n")
+        script.chmod(0o755)
+        ctx = types.SimpleNamespace(id="tst-0", dir=str(tmp_path),
+                                    ntasks=1, mem=None)
+
+        async def run():
+            task = asyncio.ensure_future(
+                local._run_job("cancel", ctx, "job.sh"))
+            while not (tmp_path / "pid").exists() or \
+                    not (tmp_path / "pid").read_text():
+                await asyncio.sleep(0.01)
+            task.cancel()
+            await asyncio.wait_for(
+                asyncio.gather(task, return_exceptions=True), 5)
+
+        asyncio.run(run())
+        pid = int((tmp_path / "pid").read_text())
+
+        with pytest.raises(ProcessLookupError):
+            os.kill(pid, 0)
+        assert local._jobs["cancel"].state == "FAILED"
+
+    def test_parse_memory(self):
+        """
+        Validate memory requests are converted to megabytes
+        """
+        assert local.parse_memory(512) == 512.
+        assert local.parse_memory("2G") == 2048.
+        assert local.parse_memory("512kb") == 0.5
+        assert local.parse_memory(None) is None
@@ -0,0 +1,60 @@
+import sqlite3
+
+import pytest
+
+from model_ensembler.journal import JOURNAL_NAME, close_journals, get_journal
+from model_ensembler.utils import RunContext
+
+
+@pytest.fixture
+def journal(tmp_path):
+    yield get_journal(str(tmp_path))
+    close_journals()
+
+
+def run(idx, cycle=1):
+    return RunContext({"name": "tst", "batch_idx": cycle, "idx": idx,
+                       "id": "tst-{}".format(idx)})
+
+
+class TestRunJournal:
+    def test_phases(self, journal, tmp_path):
+        """
+        Validate the latest phase of each run is kept, along with its job,
+        and every transition is appended
+        """
+        assert journal.entry("tst", 1, 0) is None
+
+        journal.record(run(0), "started")
+        journal.record(run(0), "templated")
+        journal.record(run(0), "submitted", job_id=100)
+        journal.record(run(0), "submitted", job_state="RUNNING")
+        journal.record(run(1), "started")
+
+        entry = journal.entry("tst", 1, 0)
+        assert (entry.phase, entry.job_id, entry.job_state) == \
+            ("submitted", "100", "RUNNING")
+
+        journal.record(run(0), "finished", job_state="COMPLETED")
+        journal.record(run(0), "post_run")
+
+        assert journal.entry("tst", 1, 0) == ("post_run", "100", "COMPLETED")
+        assert journal.entry("tst", 1, 1).phase == "started"
+        assert journal.entry("tst", 2, 0) is None
+
+        conn = sqlite3.connect(str(tmp_path / JOURNAL_NAME))
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert conn.execute("SELECT COUNT(*) FROM transitions").\
+            fetchone()[0] == 7
+
+    def test_resubmission(self, journal):
+        """
+        Validate a new job replaces the job and state of an earlier one
+        """
+        journal.record(run(0), "finished", job_id=100, job_state="FAILED")
+        journal.record(run(0), "submitted", job_id=101)
+
+        assert journal.entry("tst", 1, 0) == ("submitted", "101", None)
+
+        with pytest.raises(ValueError):
+            journal.record(run(0), "unknown")
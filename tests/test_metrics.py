@@ -0,0 +1,99 @@
+import asyncio
+import json
+import types
+
+from model_ensembler import metrics as metrics_module, templates
+from model_ensembler.config import Batch
+from model_ensembler.metrics import Metrics, SUMMARY_NAME, TEXTFILE_NAME
+
+
+def metrics():
+    res = Metrics()
+    res.inc("scheduler_calls", command="sbatch")
+    res.inc("scheduler_calls", 2, command="sbatch")
+    res.inc("runs", batch="tst")
+    res.observe("phase", 2., batch="tst", phase="queue")
+    res.observe("phase", 4., batch="tst", phase="queue")
+    res.observe("phase", 1., batch="oth", phase="run")
+    return res
+
+
+class TestMetrics:
+    def test_prometheus(self):
+        """
+        Validate counters and timers are rendered in the text exposition
+        format
+        """
+        lines = metrics().prometheus().splitlines()
+
+        assert "# TYPE model_ensembler_scheduler_calls_total counter" in lines
+        assert "model_ensembler_scheduler_calls_total{command=\"sbatch\"} " \
+               "3.0" in lines
+        assert "# TYPE model_ensembler_phase_seconds summary" in lines
+        assert "model_ensembler_phase_seconds_sum{batch=\"tst\"," \
+               "phase=\"queue\"} 6.0" in lines
+        assert "model_ensembler_phase_seconds_count{batch=\"tst\"," \
+               "phase=\"queue\"} 2" in lines
+        assert "model_ensembler_phase_seconds_max{batch=\"tst\"," \
+               "phase=\"queue\"} 4.0" in lines
+
+    def test_summary(self):
+        """
+        Validate each batch is summarised separately from metrics recorded
+        against no batch
+        """
+        res = metrics()
+
+        assert res.batches() == ["oth", "tst"]
+        assert res.summary("tst") == {
+            "batch": "tst",
+            "counters": {"runs": {"all": 1}},
+            "timers": {"phase": {"phase=queue": {
+                "count": 2, "sum": 6., "mean": 3., "min": 2., "max": 4.}}},
+        }
+        assert res.summary()["counters"] == \
+            {"scheduler_calls": {"command=sbatch": 3}}
+
+    def test_export(self, tmp_path):
+        """
+        Validate the textfile and summaries are written to the directory
+        """
+        directory = tmp_path / "metrics"
+        metrics().export(str(directory))
+
+        assert sorted(p.name for p in directory.iterdir()) == \
+            sorted([TEXTFILE_NAME, SUMMARY_NAME, "oth.json", "tst.json"])
+        assert json.loads((directory / "tst.json").read_text())["batch"] == \
+            "tst"
+
+    def test_template_copy_counted(self, tmp_path, monkeypatch):
+        """
+        Validate the template copy of each run is counted as a spawned
+        command
+        """
+        spawned = []
+
+        async def create_subprocess_exec(*args, **kwargs):
+            spawned.append(args)
+            proc = types.SimpleNamespace()
+
+            async def wait():
+                return 0
+
+            proc.wait = wait
+            return proc
+
+        monkeypatch.setattr(templates.asyncio, "create_subprocess_exec",
+                            create_subprocess_exec)
+
+        def copies():
+            return metrics_module.metrics.summary()["counters"].\
+                get("commands", dict()).get("mode=template_copy", 0)
+
+        before = copies()
+        run = types.SimpleNamespace(id="tst-0", dir=str(tmp_path / "tst-0"))
+        asyncio.run(templates.prepare_run_directory(
+            Batch("tst", templatedir=str(tmp_path / "template")), run))
+
+        assert spawned[0][0] == "rsync"
+        assert copies() == before + 1
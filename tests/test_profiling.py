@@ -0,0 +1,40 @@
+import asyncio
+import logging
+import time
+
+from model_ensembler.metrics import metrics
+from model_ensembler.profiling import Profiler
+
+
+class TestProfiler:
+    def test_blocked_loop(self, caplog, tmp_path):
+        """
+        Validate a blocked event loop is reported with the blocking stack,
+        and task wall times and the profile are recorded
+        """
+        output = tmp_path / "profile.out"
+
+        async def blocking_item():
+            time.sleep(0.3)
+
+        async def run():
+            profiler = Profiler(asyncio.get_running_loop(), lag=0.05,
+                                output=str(output))
+            profiler.start()
+            await asyncio.sleep(0.05)
+            await asyncio.ensure_future(blocking_item())
+            await asyncio.sleep(0.05)
+            profiler.stop()
+
+        with caplog.at_level(logging.INFO):
+            asyncio.run(run())
+
+        blocked = [r.getMessage() for r in caplog.records
+                   if r.getMessage().startswith("Event loop blocked")]
+        assert len(blocked) == 1
+        assert "blocking_item" in blocked[0]
+
+        assert [labels for labels, _ in metrics.timers("coroutine")
+                if labels["coroutine"].endswith("blocking_item")]
+        assert "blocking_item" in caplog.text.split("Task wall times")[1]
+        assert output.exists()
@@ -0,0 +1,132 @@
+import asyncio
+
+import pytest
+
+import model_ensembler.batcher
+import model_ensembler.tasks
+
+from model_ensembler.config import Task
+from model_ensembler.runners import iter_runner, run_runner, run_task_items
+from model_ensembler.tasks import ProcessingException, TaskException
+from model_ensembler.tasks.utils import processing_task
+
+
+@pytest.fixture
+def trace(monkeypatch):
+    events = []
+
+    @processing_task
+    async def step(ctx, tag, delay=0.01, fail=False):
+        events.append(("start", tag))
+        await asyncio.sleep(delay)
+        if fail:
+            raise TaskException("{} failed".format(tag))
+        events.append(("end", tag))
+
+    monkeypatch.setattr(model_ensembler.tasks, "step", step, raising=False)
+    return events
+
+
+def run_items(items, limit=None):
+    async def run():
+        model_ensembler.batcher.run_ctx.set(dict())
+        await run_task_items(items, limit)
+    asyncio.run(run())
+
+
+class TestRunTaskItems:
+    def test_sequential_by_default(self, trace):
+        """
+        Validate items without dependencies keep running in order
+        """
+        run_items([Task("step", {"tag": t}) for t in "abc"])
+
+        assert trace == [("start", "a"), ("end", "a"),
+                         ("start", "b"), ("end", "b"),
+                         ("start", "c"), ("end", "c")]
+
+    def test_graph_with_limit(self, trace):
+        """
+        Validate independent items overlap up to the limit and dependants
+        wait for them
+        """
+        run_items([
+            Task("step", {"tag": "a"}, id="a", after=[]),
+            Task("step", {"tag": "b"}, id="b", after=[]),
+            Task("step", {"tag": "c"}, id="c", after=[]),
+            Task("step", {"tag": "d"}, after=["a", "b", "c"]),
+        ], limit=2)
+
+        starts = [tag for event, tag in trace if event == "start"]
+        assert trace[:2] == [("start", "a"), ("start", "b")]
+        assert starts[-1] == "d"
+        assert trace.index(("start", "d")) > trace.index(("end", "c"))
+
+    def test_failure_stops_dependants(self, trace):
+        """
+        Validate a failure is raised as ProcessingException and dependants
+        are not started
+        """
+        with pytest.raises(ProcessingException):
+            run_items([
+                Task("step", {"tag": "a", "fail": True}, id="a", after=[]),
+                Task("step", {"tag": "b", "delay": 0.05}, id="b", after=[]),
+                Task("step", {"tag": "c"}, after="a"),
+            ])
+
+        assert ("end", "b") in trace
+        assert ("start", "c") not in trace
+
+    def test_unknown_dependency(self, trace):
+        """
+        Validate depending on an undefined id fails before running anything
+        """
+        with pytest.raises(ProcessingException):
+            run_items([Task("step", {"tag": "a"}, after="z")])
+        assert trace == []
+
+
+class TestRunRunner:
+    def test_consumes_tasks_lazily(self):
+        """
+        Validate tasks are only taken from a generator as there is room for
+        them, with results kept in order
+        """
+        counts = {"created": 0, "finished": 0, "outstanding": 0}
+
+        async def task(idx):
+            await asyncio.sleep(0.01 * (idx % 3))
+            counts["finished"] += 1
+            return idx
+
+        def tasks():
+            for idx in range(20):
+                counts["created"] += 1
+                counts["outstanding"] = max(
+                    counts["outstanding"],
+                    counts["created"] - counts["finished"])
+                yield task(idx)
+
+        results = asyncio.run(run_runner(4, tasks()))
+
+        assert counts["outstanding"] == 4
+        assert results == list(range(20))
+
+    def test_yields_on_completion(self):
+        """
+        Validate results are yielded as tasks complete and failures raised
+        """
+        async def task(idx):
+            await asyncio.sleep(0.01 * (3 - idx))
+            if idx == 4:
+                raise TaskException("failed")
+            return idx
+
+        async def run(count):
+            return [idx async for idx, _ in
+                    iter_runner(4, (task(idx) for idx in range(count)))]
+
+        assert asyncio.run(run(4)) == [3, 2, 1, 0]
+
+        with pytest.raises(TaskException):
+            asyncio.run(run(5))
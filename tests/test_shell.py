@@ -0,0 +1,84 @@
+import asyncio
+
+from model_ensembler import shell
+from model_ensembler.shell import ShellPool, ShellWorker
+
+
+class TestShellPool:
+    def test_commands_keep_cwd_and_return_code(self, tmp_path):
+        """
+        Validate pooled commands run in their own directory with their own
+        return code, without leaking state between commands
+        """
+        pool = ShellPool(2)
+        dirs = []
+
+        for idx in range(6):
+            dirs.append(tmp_path / str(idx))
+            dirs[-1].mkdir()
+
+        async def run(idx):
+            chunks = []
+
+            async def output(data):
+                chunks.append(data)
+
+            rc = await pool.run("cd /; X={0}; pwd; echo $X >&2; exit {0}".
+                                format(idx) if idx % 2 else
+                                "echo ${{X:-unset}}; pwd; exit {}".
+                                format(idx), str(dirs[idx]),
+                                output, "/bin/bash")
+            return rc, b"".join(chunks).decode().split()
+
+        async def run_all():
+            res = await asyncio.gather(*[run(idx) for idx in range(6)])
+            workers = pool._count
+            await pool.close()
+            return res, workers
+
+        results, workers = asyncio.run(run_all())
+
+        assert workers <= 2
+        for idx, (rc, output) in enumerate(results):
+            assert rc == idx
+            if idx % 2:
+                assert output == ["/", str(idx)]
+            else:
+                assert output == ["unset", str(dirs[idx])]
+
+    def test_large_output(self, tmp_path):
+        """
+        Validate output spanning many reads is returned intact
+        """
+        pool = ShellPool(1)
+        chunks = []
+
+        async def output(data):
+            chunks.append(data)
+
+        async def run():
+            rc = await pool.run("head -c 300000 /dev/zero | tr '\\0' x",
+                                str(tmp_path), output, "/bin/bash")
+            await pool.close()
+            return rc
+
+        assert asyncio.run(run()) == 0
+        assert b"".join(chunks) == b"x" * 300000
+
+    def test_killed_worker_reaped(self):
+        """
+        Validate a killed shell is waited on rather than left a zombie
+        """
+        async def run():
+            worker = ShellWorker("/bin/bash")
+            await worker.start()
+            proc = worker._proc
+            worker.kill()
+
+            await asyncio.wait_for(proc.wait(), 5)
+            return proc
+
+        proc = asyncio.run(run())
+
+        assert proc.returncode is not None
+        assert not shell._reapers
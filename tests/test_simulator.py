@@ -0,0 +1,59 @@
+import os
+
+from model_ensembler import simulator
+
+
+class TestSimulator:
+    def test_job_lifecycle(self, tmp_path, monkeypatch, capsys):
+        """
+        Validate sbatch, squeue and sacct agree on simulated job states
+        """
+        monkeypatch.setenv("ME_SIM_DIR", str(tmp_path))
+        monkeypatch.setenv("ME_SIM_QUEUE", "100,100")
+        monkeypatch.setenv("ME_SIM_RUNTIME", "10,10")
+
+        script = os.path.join(tmp_path, "job.sh")
+        with open(script, "w") as fh:
+            fh.write("#!/bin/bash\n#SBATCH --job-name=tst1-0\n"
+                     "#SBATCH --partition=short\necho\n")
+
+        assert simulator.main(["sbatch", "--no-requeue", script]) == 0
+        assert simulator.main(["sbatch", "--array=0-2%1", script]) == 0
+        assert capsys.readouterr().out.split("\n")[:2] == \
+            ["Submitted batch job 1000", "Submitted batch job 1001"]
+
+        simulator.main(["squeue", "-o", "%j,%T", "-h", "-p", "short"])
+        assert capsys.readouterr().out.split() == ["tst1-0,PENDING"] * 4
+
+        simulator.main(["sacct", "-XnP", "-j", "1001",
+                        "-o", "jobid,jobname,state,start,end"])
+        assert capsys.readouterr().out.split() == [
+            "1001_{}|tst1-0|PENDING|Unknown|Unknown".format(i)
+            for i in range(3)]
+
+    def test_install(self, tmp_path):
+        """
+        Validate the stand-in commands are written as executables
+        """
+        bin_dir = simulator.install(os.path.join(tmp_path, "bin"))
+
+        for command in simulator.COMMANDS:
+            assert os.access(os.path.join(bin_dir, command), os.X_OK)
+
+    def test_backend_installs_on_use(self, tmp_path, monkeypatch):
+        """
+        Validate the backend leaves the environment alone on import and
+        installs its commands when first used
+        """
+        path = os.environ["PATH"]
+        from model_ensembler.cluster import simulator as backend
+
+        assert os.environ["PATH"] == path
+
+        monkeypatch.setattr(backend, "_bin_dir", None)
+        monkeypatch.setenv("ME_SIM_BIN", os.path.join(tmp_path, "bin"))
+        bin_dir = backend.command_path()
+
+        assert bin_dir == os.path.join(tmp_path, "bin")
+        assert os.access(os.path.join(bin_dir, "sbatch"), os.X_OK)
+        assert os.environ["PATH"] == path
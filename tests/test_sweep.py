@@ -0,0 +1,70 @@
+import itertools
+
+import pytest
+
+from model_ensembler.sweep import expand_sweep, sweep_size
+
+
+class TestSweep:
+    def test_product_and_zip(self):
+        """
+        Validate product and zip sweeps combine parameters as itertools does
+        """
+        params = {"a": [1, 2, 3], "b": ["x", "y"]}
+
+        assert list(expand_sweep({"method": "product", "params": params})) \
+            == [{"a": a, "b": b}
+                for a, b in itertools.product(*params.values())]
+        assert list(expand_sweep({"method": "zip", "params": params})) == \
+            [{"a": 1, "b": "x"}, {"a": 2, "b": "y"}]
+        assert sweep_size({"method": "product", "params": params}) == 6
+
+    def test_lhs_stratified_and_seeded(self):
+        """
+        Validate Latin hypercube samples fill every stratum of each parameter
+        and are reproducible with a seed
+        """
+        spec = {"method": "lhs", "samples": 50, "seed": 3,
+                "params": {"x": [0., 1.], "n": [0, 49]}}
+        runs = list(expand_sweep(spec))
+
+        assert runs == list(expand_sweep(spec))
+        assert sorted(int(r["x"] * 50) for r in runs) == list(range(50))
+        assert sorted(r["n"] for r in runs) == list(range(50))
+
+    def test_lhs_parameters_independent(self):
+        """
+        Validate Latin hypercube parameters are not stratified in lockstep,
+        including for very small designs
+        """
+        params = {"p{}".format(i): [0, 1] for i in range(8)}
+        runs = list(expand_sweep({"method": "lhs", "samples": 2, "seed": 1,
+                                  "params": params}))
+
+        assert len(set(tuple(r[k] for r in runs) for k in params)) == 2
+
+        params = {"p{}".format(i): [0, 19] for i in range(10)}
+        runs = list(expand_sweep({"method": "lhs", "samples": 20, "seed": 1,
+                                  "params": params}))
+        orders = [tuple(r[k] for r in runs) for k in params]
+
+        assert all(sorted(order) == list(range(20)) for order in orders)
+        assert len(set(orders)) == len(orders)
+
+    def test_random_is_lazy(self):
+        """
+        Validate sampled sweeps are generated lazily
+        """
+        spec = {"method": "random", "samples": 10 ** 9, "seed": 1,
+                "params": {"x": [0., 1.], "c": {"choices": ["a", "b"]}}}
+        runs = list(itertools.islice(expand_sweep(spec), 5))
+
+        assert len(runs) == 5
+        assert all(0. <= r["x"] < 1. and r["c"] in ("a", "b") for r in runs)
+
+    def test_unknown_method(self):
+        """
+        Validate unknown sweep methods are rejected
+        """
+        with pytest.raises(ValueError):
+            sweep_size({"method": "grid", "params": {}})
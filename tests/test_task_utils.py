@@ -0,0 +1,102 @@
+import asyncio
+import glob
+import os
+import threading
+
+from model_ensembler.shell import ShellPool
+from model_ensembler.tasks import utils
+from model_ensembler.tasks.utils import OutputCapture, execute_command
+
+
+class TestOutputCapture:
+    def test_retains_tail(self):
+        """
+        Validate only the trailing limit of output is held in memory
+        """
+        capture = OutputCapture(limit=10)
+
+        for chunk in (b"abcdef", b"ghijkl", b"mnopqrstuvwxyz"):
+            capture.write(chunk)
+
+        assert capture.output == b"qrstuvwxyz"
+        assert capture.truncated
+
+    def test_execute_command_streams_to_log(self, tmp_path):
+        """
+        Validate the log file receives all output whilst the result is capped
+        """
+        res = asyncio.run(execute_command(
+            "seq 1 20000", cwd=str(tmp_path), log=True, limit=6))
+
+        logs = glob.glob(os.path.join(tmp_path, "execute_command.*.log"))
+
+        assert res.returncode == 0
+        assert res.stdout == b"20000\n"
+        assert len(logs) == 1
+        with open(logs[0], "rb") as fh:
+            assert fh.read().splitlines()[-1] == b"20000"
+
+    def test_log_written_off_loop(self, tmp_path, monkeypatch):
+        """
+        Validate log buffers are written in order away from the event loop
+        """
+        monkeypatch.setattr(utils, "LOG_BUFFER", 1000)
+        run_io = utils.run_io
+        threads = set()
+        log_name = str(tmp_path / "capture.log")
+
+        async def recorded_io(func, *args, **kwargs):
+            def call():
+                threads.add(threading.current_thread())
+                return func(*args, **kwargs)
+            return await run_io(call)
+
+        monkeypatch.setattr(utils, "run_io", recorded_io)
+
+        async def run():
+            capture = OutputCapture(log_name, limit=10)
+            for i in range(2000):
+                capture.write("{}\n".format(i).encode())
+            await capture.close()
+
+        asyncio.run(run())
+
+        assert threads and threading.main_thread() not in threads
+        with open(log_name, "rb") as fh:
+            assert fh.read().splitlines() == \
+                [str(i).encode() for i in range(2000)]
+
+    def test_pooled_output_waits_for_log(self, tmp_path, monkeypatch):
+        """
+        Validate pooled commands are held up whilst their log is written,
+        rather than chaining writes without limit
+        """
+        monkeypatch.setattr(utils, "LOG_BUFFER", 1000)
+        monkeypatch.setattr(utils, "shell_pool", ShellPool(1))
+        run_io = utils.run_io
+        writes = {"now": 0, "max": 0}
+
+        async def counted_io(func, *args, **kwargs):
+            writes["now"] += 1
+            writes["max"] = max(writes["max"], writes["now"])
+            try:
+                await asyncio.sleep(0.001)
+                return await run_io(func, *args, **kwargs)
+            finally:
+                writes["now"] -= 1
+
+        monkeypatch.setattr(utils, "run_io", counted_io)
+
+        async def run():
+            res = await execute_command("seq 1 20000", cwd=str(tmp_path),
+                                        log=True, limit=6)
+            await utils.shell_pool.close()
+            return res
+
+        res = asyncio.run(run())
+        logs = glob.glob(os.path.join(tmp_path, "execute_command.*.log"))
+
+        assert res.stdout == b"20000\n"
+        assert writes["max"] == 1
+        with open(logs[0], "rb") as fh:
+            assert fh.read().splitlines()[-1] == b"20000"
@@ -0,0 +1,60 @@
+import asyncio
+import collections
+import os
+import shutil
+import threading
+
+import jinja2
+
+from model_ensembler import templates
+from model_ensembler.templates import process_templates
+
+
+class TestProcessTemplates:
+    def test_compiles_once(self, tmp_path, monkeypatch):
+        """
+        Validate runs render from a single compilation of each template
+        """
+        compiled = []
+        compile_orig = jinja2.Environment.compile
+
+        def compile(self, *args, **kwargs):
+            compiled.append(args[0])
+            return compile_orig(self, *args, **kwargs)
+
+        monkeypatch.setattr(jinja2.Environment, "compile", compile)
+
+        templatedir = tmp_path / "template"
+        templatedir.mkdir()
+        with open(templatedir / "job.sh.j2", "w") as fh:
+            fh.write("#!/bin/sh\necho {{ run.id }}\n")
+        os.chmod(templatedir / "job.sh.j2", 0o755)
+
+        Run = collections.namedtuple("Run", ["id", "dir"])
+
+        for idx in range(3):
+            run = Run("tmpl-{}".format(idx), str(tmp_path / str(idx)))
+            shutil.copytree(templatedir, run.dir)
+            process_templates(run, ["job.sh.j2"], str(templatedir))
+
+            with open(os.path.join(run.dir, "job.sh")) as fh:
+                assert fh.read() == "#!/bin/sh\necho {}".format(run.id)
+            assert os.access(os.path.join(run.dir, "job.sh"), os.X_OK)
+            assert not os.path.exists(os.path.join(run.dir, "job.sh.j2"))
+
+        assert len(compiled) == 1
+
+    def test_renders_off_loop(self, monkeypatch):
+        """
+        Validate rendering happens on the I/O pool rather than the loop
+        """
+        threads = []
+
+        monkeypatch.setattr(
+            templates, "process_templates",
+            lambda *args: threads.append(threading.current_thread().name))
+
+        asyncio.run(templates.render_templates(None, ["job.sh.j2"]))
+
+        assert len(threads) == 1
+        assert threads[0].startswith("io")
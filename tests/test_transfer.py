@@ -0,0 +1,121 @@
+import asyncio
+import os
+import types
+
+import pytest
+
+from model_ensembler.tasks import move, remove
+from model_ensembler.tasks.transfer import FilterRules, populate, transfer
+
+
+def make_tree(root):
+    for rel in ("a.nc", "b.log", "sub/c.nc", "sub/d.log", "sub/deep/e.nc"):
+        path = os.path.join(root, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as fh:
+            fh.write(rel * 1000)
+    os.symlink("a.nc", os.path.join(root, "link.nc"))
+
+
+def listing(root):
+    return sorted(os.path.relpath(os.path.join(d, f), root)
+                  for d, _, files in os.walk(root) for f in files)
+
+
+class TestFilterRules:
+    def test_rsync_matching(self):
+        """
+        Validate include, exclude, anchoring and directory only patterns
+        """
+        rules = FilterRules(["*.nc", "sub/"], ["*"])
+
+        assert rules.included("a.nc")
+        assert not rules.included("b.log")
+        assert rules.included("sub", is_dir=True)
+        assert not rules.included("sub2", is_dir=True)
+        assert rules.included("sub/c.nc")
+        assert not rules.included("sub/d.log")
+
+        rules = FilterRules(None, ["/sub/deep", "**/*.log"])
+        assert not rules.included("sub/deep", is_dir=True)
+        assert rules.included("other/sub/deep", is_dir=True)
+        assert not rules.included("sub/d.log")
+        assert rules.included("b.log")
+
+
+class TestTransfer:
+    def test_copy_and_link(self, tmp_path):
+        """
+        Validate copies match the source, with hard links on one filesystem
+        """
+        src, dest = tmp_path / "src", tmp_path / "dest"
+        make_tree(src)
+
+        for link in (False, True):
+            target = str(dest / str(link))
+            transfer(str(src), target, link=link)
+
+            assert listing(target) == listing(src)
+            assert os.readlink(os.path.join(target, "link.nc")) == "a.nc"
+            assert os.path.samefile(os.path.join(target, "sub/c.nc"),
+                                    src / "sub/c.nc") == link
+            with open(os.path.join(target, "sub/deep/e.nc")) as fh:
+                assert fh.read() == "sub/deep/e.nc" * 1000
+
+    def test_dest_inside_src(self, tmp_path):
+        """
+        Validate a destination inside the source is not copied into itself
+        """
+        src = tmp_path / "src"
+        make_tree(src)
+        expected = listing(src)
+        target = str(src / "sub" / "out")
+
+        transfer(str(src), target, link=False)
+        transfer(str(src), target, link=False)
+
+        assert listing(target) == expected
+        with pytest.raises(ValueError):
+            transfer(str(src), str(src))
+
+    def test_populate_modes(self, tmp_path):
+        """
+        Validate populated files are linked except templates, which are
+        copied
+        """
+        src = tmp_path / "snapshot"
+        make_tree(src)
+        with open(src / "job.sh.j2", "w") as fh:
+            fh.write("{{ run.id }}")
+
+        for mode in ("hardlink", "symlink", "reflink"):
+            target = tmp_path / mode
+            populate(str(src), str(target), mode)
+
+            assert listing(target) == listing(src)
+            assert not os.path.islink(target / "job.sh.j2")
+            assert not os.path.samefile(target / "job.sh.j2",
+                                        src / "job.sh.j2")
+            assert os.path.samefile(target / "sub/c.nc", src / "sub/c.nc") \
+                == (mode != "reflink")
+            assert os.path.islink(target / "a.nc") == (mode == "symlink")
+
+    def test_move_and_remove_tasks(self, tmp_path):
+        """
+        Validate the move and remove tasks filter like rsync and clean up
+        """
+        src = tmp_path / "run"
+        make_tree(src)
+        ctx = types.SimpleNamespace(id="run-0", dir=str(src))
+
+        assert asyncio.run(move(ctx, str(tmp_path / "archive"),
+                                include=["*.nc"]))
+        assert listing(tmp_path / "archive" / "run-0") == ["a.nc", "link.nc"]
+
+        assert asyncio.run(move(ctx, str(tmp_path / "logs"),
+                                exclude=["*.log"]))
+        assert listing(tmp_path / "logs" / "run-0") == \
+            ["a.nc", "link.nc", "sub/c.nc", "sub/deep/e.nc"]
+
+        assert asyncio.run(remove(ctx))
+        assert not os.path.exists(src)
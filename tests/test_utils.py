@@ -0,0 +1,61 @@
+import pickle
+
+import jinja2
+import pytest
+
+from model_ensembler.tasks.utils import flight_task
+from model_ensembler.utils import RunContext
+
+
+@pytest.fixture
+def batch():
+    return RunContext({"name": "tst", "maxruns": 2},
+                      {"name": "ensemble", "seed": 42})
+
+
+class TestRunContext:
+    def test_layers(self, batch):
+        """
+        Validate variables resolve most specific first, without modifying
+        the shared layers
+        """
+        run = batch._new_child({"id": "tst-0"}, {"id": "tst-1", "seed": 1})
+
+        assert run.id == "tst-0"
+        assert run.seed == 1
+        assert run.name == "tst"
+        assert run["maxruns"] == 2
+        assert len(run) == 4
+        assert run._asdict() == {"name": "tst", "seed": 1, "maxruns": 2,
+                                 "id": "tst-0"}
+        assert "id" not in batch
+        assert batch.seed == 42
+
+    def test_no_leaks(self, batch):
+        """
+        Validate runs do not see each other's fields and cannot be modified
+        """
+        first = batch._new_child({"id": "tst-0", "only_first": True})
+        second = batch._new_child({"id": "tst-1"})
+
+        assert first.only_first
+        assert not hasattr(second, "only_first")
+
+        with pytest.raises(AttributeError):
+            first.id = "other"
+
+    def test_consumers(self, batch):
+        """
+        Validate runs work with templates, run. task arguments and pickle
+        """
+        run = batch._new_child({"id": "tst-0", "dir": "/tmp"})
+
+        tmpl = jinja2.Template("{{ run.name }} {{ run.id }}")
+        assert tmpl.render(run=run) == "tst tst-0"
+
+        @flight_task
+        def task(ctx, value=None, cwd=None):
+            return value, cwd
+
+        assert task(run, value="run.id") == ("tst-0", "/tmp")
+        assert pickle.loads(pickle.dumps(run)) == run
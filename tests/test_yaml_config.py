@@ -39,6 +39,7 @@ class TestYAMLConfig:
             "missing_name.yaml": "is a required property",
             "bad_type.yaml": "is not of type",
             "invalid_batch_config.yaml": "'name' and 'basedir' should be defined",
+            "bad_sweep_bounds.yaml": "is too long",
         }.items(),
     )
     def test_example_yamls_config_invalid(self, filename, expected_error):
@@ -53,3 +54,31 @@ class TestYAMLConfig:
         assert expected_error in str(
             exc_info.value
         ), f"Expected '{expected_error}' in error for {filename}"
+
+
+class TestConfigCache:
+    def test_cached_configuration_reused(self, tmp_path, monkeypatch):
+        """
+        Validate a validated configuration is loaded from the cache until
+        the YAML changes
+        """
+        yaml_file = os.path.join(EXAMPLES_DIR, "sanity-check.yml")
+        copy = tmp_path / "config.yml"
+        copy.write_bytes(open(yaml_file, "rb").read())
+
+        _, data = YAMLConfig.validate(SCHEMA_PATH, str(copy),
+                                      cache_dir=str(tmp_path / "cache"))
+        assert len(os.listdir(tmp_path / "cache")) == 1
+
+        def load(*args, **kwargs):
+            raise AssertionError("Configuration was parsed again")
+
+        monkeypatch.setattr("model_ensembler.config.load", load)
+        _, cached = YAMLConfig.validate(SCHEMA_PATH, str(copy),
+                                        cache_dir=str(tmp_path / "cache"))
+        assert cached == data
+
+        copy.write_bytes(copy.read_bytes() + b"\n# changed\n")
+        with pytest.raises(AssertionError):
+            YAMLConfig.validate(SCHEMA_PATH, str(copy),
+                                cache_dir=str(tmp_path / "cache"))